@@ -0,0 +1,431 @@
+#logging
+import logging
+
+import asyncio
+import contextvars
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'admission'
+
+# Admission control for the expensive endpoints, keyed by the caller's Cognito `sub`:
+#   - Rate limits: one token bucket per (user, endpoint). Buckets live in process memory, or in a
+#     SQLite file shared by all workers on the host when ADMISSION_STORE_PATH is set.
+#   - Stage limits: a FairLimiter bounds how many LLM generations / embedding runs a process
+#     has in flight. Waiting callers queue per user and slots are handed out round-robin across
+#     users, so one user's burst cannot starve the others. The limits are per process; size
+#     them as (provider budget / number of workers).
+# Rejections raise AdmissionRejected, which the apps turn into 429 with a Retry-After header.
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+# "<endpoint>=<requests>/<seconds>" pairs; the bucket holds <requests> tokens and refills over <seconds>.
+RATE_LIMITS = os.getenv("RATE_LIMITS", "chat=30/60,index=3/3600,index_upload=30/3600,find_vets=60/60,search_vets_by_text=60/60")
+ADMISSION_STORE_PATH = os.getenv("ADMISSION_STORE_PATH") # e.g. backend/cache/admission.sqlite3
+ADMISSION_MAX_TRACKED_USERS = int(os.getenv("ADMISSION_MAX_TRACKED_USERS", "100000"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_QUEUE_PER_USER = int(os.getenv("ADMISSION_MAX_QUEUE_PER_USER", "4"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        """Retry-After value: whole seconds, at least 1."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_rate_limits(spec):
+    """
+    Parse RATE_LIMITS
+
+    Args:
+        spec: Comma-separated "<endpoint>=<requests>/<seconds>" pairs
+
+    Returns:
+        Dict of endpoint -> (capacity, refill rate in tokens per second)
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            endpoint, rate = item.split("=", 1)
+            requests_allowed, seconds = rate.split("/", 1)
+            limits[endpoint.strip()] = (float(requests_allowed), float(requests_allowed) / float(seconds))
+        except ValueError:
+            logger.error(f"Ignoring malformed RATE_LIMITS entry '{item}' (expected <endpoint>=<requests>/<seconds>).")
+    return limits
+
+
+def _refill(tokens, updated, capacity, rate, now):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _take(tokens, capacity, rate):
+    """
+    Returns:
+        (tokens left, seconds until a token is available or 0.0 if one was taken)
+    """
+    if tokens >= 1.0:
+        return tokens - 1.0, 0.0
+    return tokens, (1.0 - tokens) / rate
+
+
+class MemoryBucketStore:
+    def __init__(self, max_keys=ADMISSION_MAX_TRACKED_USERS):
+        """
+        Token buckets of this process
+
+        Args:
+            max_keys: Bucket count above which idle (full) buckets are dropped
+        """
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens, retry_after = _take(_refill(tokens, updated, capacity, rate, now), capacity, rate)
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return retry_after
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is indistinguishable from a new one.
+        self._buckets = {key: value for key, value in self._buckets.items() if value[2] > now}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBucketStore:
+    _SCHEMA = "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+
+    def __init__(self, path, idle_seconds=86400):
+        """
+        Token buckets shared by the worker processes of one host through a SQLite file
+
+        Args:
+            path: Database file; created if missing
+            idle_seconds: Buckets untouched for this long are deleted
+        """
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self._local = threading.local()
+        self._takes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(self._SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+
+    def _connection(self):
+        # One connection per thread and process: SQLite connections must not cross a fork.
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key, capacity, rate):
+        now = time.time() # wall clock: comparable across processes
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens, retry_after = _take(_refill(tokens, updated, capacity, rate, now), capacity, rate)
+                connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    connection.execute("DELETE FROM buckets WHERE updated < ?", (now - self.idle_seconds,))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Fail open: a locked or broken store must not take the API down with it.
+            logger.warning(f"Admission store '{self.path}' unavailable, admitting request: {e}")
+            metrics.increment("admission_store_errors_total")
+            return 0.0
+        return retry_after
+
+    def clear(self):
+        self._connection().execute("DELETE FROM buckets")
+
+
+class RateLimiter:
+    def __init__(self, limits, store):
+        """
+        Per-user, per-endpoint token buckets
+
+        Args:
+            limits: Dict of endpoint -> (capacity, refill rate per second), see parse_rate_limits
+            store: MemoryBucketStore or SQLiteBucketStore
+        """
+        self.limits = limits
+        self.store = store
+
+    def check(self, user, endpoint):
+        """
+        Take a token from the user's bucket for `endpoint`; endpoints without a limit always pass
+
+        Raises:
+            AdmissionRejected: The bucket is empty
+        """
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return
+        retry_after = self.store.take(f"{endpoint}:{user}", *limit)
+        if retry_after > 0:
+            metrics.increment("admission_rejections_total", scope=endpoint, reason="rate_limited")
+            raise AdmissionRejected(f"Too many '{endpoint}' requests; please retry later.", retry_after)
+
+
+def _create_rate_limiter():
+    if ADMISSION_STORE_PATH:
+        logger.info(f"Admission rate limits shared through '{ADMISSION_STORE_PATH}'.")
+        store = SQLiteBucketStore(ADMISSION_STORE_PATH)
+    else:
+        store = MemoryBucketStore()
+    return RateLimiter(parse_rate_limits(RATE_LIMITS), store)
+
+
+RATE_LIMITER = _create_rate_limiter()
+
+
+# The user a request runs for, so the stage limiters deep in RAGService can queue it fairly.
+_current_user = contextvars.ContextVar("admission_user", default="anonymous")
+
+
+def current_user():
+    return _current_user.get()
+
+
+@contextmanager
+def user_scope(user):
+    token = _current_user.set(user)
+    try:
+        yield user
+    finally:
+        _current_user.reset(token)
+
+
+def user_key(claims, remote_addr):
+    """
+    Identity requests are limited by: the Cognito `sub` claim, or the client address when
+    authentication is disabled (TESTING)
+    """
+    sub = (claims or {}).get("sub")
+    return sub if sub else f"ip:{remote_addr}"
+
+
+def admit(user, endpoint):
+    """
+    Rate-limit check run by the apps before an endpoint's view
+
+    Raises:
+        AdmissionRejected: The user is over the endpoint's rate limit
+    """
+    if ADMISSION_CONTROL:
+        RATE_LIMITER.check(user, endpoint)
+
+
+class _Waiter:
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        # Called with the limiter's lock held; the slot now belongs to this waiter.
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class FairLimiter:
+    def __init__(self, name, limit, max_queue=ADMISSION_MAX_QUEUE, max_queue_per_user=ADMISSION_MAX_QUEUE_PER_USER):
+        """
+        Concurrency limit for an expensive stage with per-user fair queueing
+
+        When all slots are busy, callers wait in a queue of their own user; a freed slot goes to
+        the next user in round-robin order, not to the longest waiter overall.
+
+        Args:
+            name: Stage name; slots are timed as `<name>_slot`, whose median sets Retry-After
+            limit: Calls allowed in flight at once in this process
+            max_queue: Waiting callers (all users) beyond which new callers are rejected
+            max_queue_per_user: Waiting callers of one user beyond which that user is rejected
+        """
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self._active = 0
+        self._queued = 0
+        self._queues = OrderedDict() # user -> deque of _Waiter, in round-robin order
+        self._lock = threading.Lock()
+
+    def _enqueue(self, user, loop=None):
+        """
+        Returns:
+            None if a slot was taken immediately, else the _Waiter to wait on
+
+        Raises:
+            AdmissionRejected: The queues are full
+        """
+        with self._lock:
+            if self._active < self.limit and not self._queued:
+                self._active += 1
+                return None
+            queue = self._queues.get(user)
+            if self._queued >= self.max_queue or (queue is not None and len(queue) >= self.max_queue_per_user):
+                reason = "queue_full" if self._queued >= self.max_queue else "user_queue_full"
+                retry_after = self._estimated_wait()
+            else:
+                waiter = _Waiter(loop)
+                if queue is None:
+                    queue = self._queues[user] = deque()
+                queue.append(waiter)
+                self._queued += 1
+                return waiter
+        metrics.increment("admission_rejections_total", scope=self.name, reason=reason)
+        raise AdmissionRejected(f"Too many requests waiting for '{self.name}'; please retry later.", retry_after)
+
+    def _estimated_wait(self):
+        typical = metrics.REGISTRY.stage_percentile(f"{self.name}_slot", 0.5) or 1.0
+        return typical * (self._queued + 1) / self.limit
+
+    def _abandon(self, user, waiter):
+        """
+        Take a waiter that stopped waiting out of its queue
+
+        Returns:
+            True if it was granted a slot in the meantime (the caller now owns it)
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            queue = self._queues.get(user)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[user]
+            return False
+
+    def release(self):
+        with self._lock:
+            if not self._queues:
+                self._active -= 1
+                return
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user) # this user's next waiter goes behind the other users
+            else:
+                del self._queues[user]
+            waiter.grant()
+
+    def _timed_out(self, waited):
+        metrics.increment("admission_rejections_total", scope=self.name, reason="queue_timeout")
+        return AdmissionRejected(f"Timed out after {waited:.1f}s waiting for '{self.name}'; please retry later.", self._estimated_wait())
+
+    @contextmanager
+    def slot(self, user=None, timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        """
+        Hold one slot for the block, waiting fairly for it (threads)
+
+        Args:
+            user: Queue to wait in (default: the request's user from user_scope)
+            timeout: Longest wait in seconds
+
+        Raises:
+            AdmissionRejected: The queues are full or the wait timed out
+        """
+        if not ADMISSION_CONTROL:
+            yield
+            return
+        user = user or current_user()
+        waiter = self._enqueue(user)
+        if waiter is not None:
+            started = time.monotonic()
+            if not waiter.event.wait(timeout) and not self._abandon(user, waiter):
+                raise self._timed_out(time.monotonic() - started)
+            metrics.REGISTRY.observe_stage(f"{self.name}_queue_wait", time.monotonic() - started)
+        try:
+            with metrics.stage_timer(f"{self.name}_slot"):
+                yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, user=None, timeout=ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        """Async variant of slot(); waiting does not block the event loop."""
+        if not ADMISSION_CONTROL:
+            yield
+            return
+        user = user or current_user()
+        waiter = self._enqueue(user, asyncio.get_running_loop())
+        if waiter is not None:
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(user, waiter):
+                    raise self._timed_out(time.monotonic() - started) from None
+            except asyncio.CancelledError:
+                if self._abandon(user, waiter):
+                    self.release()
+                raise
+            metrics.REGISTRY.observe_stage(f"{self.name}_queue_wait", time.monotonic() - started)
+        try:
+            with metrics.stage_timer(f"{self.name}_slot"):
+                yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {"active": self._active, "queued": self._queued, "users_waiting": len(self._queues)}
+
+
+# Process-wide limits on the stages that spend the OpenAI budget.
+LLM_LIMITER = FairLimiter("llm_generation", LLM_CONCURRENCY)
+EMBEDDING_LIMITER = FairLimiter("embedding", EMBEDDING_CONCURRENCY)
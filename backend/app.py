@@ -1,18 +1,29 @@
 #logging
 import logging
-from logging.handlers import RotatingFileHandler
+from logging_setup import configure_logging
 
 import base64
-from flask import Flask, request, jsonify
+from functools import wraps
+from flask import Flask, Request, request, jsonify, Response, g, abort, make_response
 from flask_cors import CORS
 from flask_compress import Compress
 import os
 from dotenv import load_dotenv
 from rag_service import RAGService
 from flask_awscognito import AWSCognitoAuthentication
-import boto3
+from flask_awscognito.utils import extract_access_token
+from flask_awscognito.exceptions import TokenVerifyError
+from token_cache import CognitoTokenVerifier
 import json
-import math
+import threading
+import time
+import vet_search
+import metrics
+import admission
+import index_generations
+import sessions
+import request_profiler
+import pdf_uploads
 
 # Load environment variables
 load_dotenv()
@@ -30,32 +41,26 @@ if not os.path.exists(LOG_DIR):
 
 LOG_FILE_APP = os.path.join(LOG_DIR, 'pethealth_main_app.log') # Specific name for app logs
 
-# Configure root logger. `force=True` will remove any existing handlers
-# and reconfigure, which is useful if other modules (like Flask) try to set up basicConfig.
-logging.basicConfig(
-    level=logging.DEBUG, # Capture DEBUG level and above from all loggers. Set to INFO in production.
-    format='%(asctime)s [%(levelname)-8s] %(name)-30s %(filename)s:%(lineno)d - %(message)s',
-    handlers=[
-        RotatingFileHandler(LOG_FILE_APP, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8'), # 10MB, 5 backups
-        logging.StreamHandler() # To also print to console
-    ],
-    force=True 
-)
+# Configure root logger. Handlers run on a background thread fed by a queue, so request threads
+# never wait on file or console I/O. Level comes from LOG_LEVEL (INFO by default; DEBUG for local
+# debugging), with per-logger overrides in LOG_LEVELS (see logging_setup.py).
+configure_logging(LOG_FILE_APP, default_level="INFO", max_bytes=10*1024*1024, backup_count=5) # 10MB, 5 backups
 
 # Get a specific logger for this application module (app.py itself)
 module_logger = logging.getLogger(__name__) # logger name will be 'app' if __name__ is '__main__'
 
-app = Flask(__name__)
+class SpoolingRequest(Request):
+    """Streams multipart file parts into pdf_uploads.spooled_stream (memory up to a bound, then disk)."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return pdf_uploads.spooled_stream()
 
-# Make Flask's default logger use our handlers and level.
-# This ensures Flask's internal logs (request handling, errors) go to file/format.
-# Remove default Flask handlers first if any were added before basicConfig.
-if app.logger.hasHandlers():
-    app.logger.handlers.clear()
+app = Flask(__name__)
+app.request_class = SpoolingRequest
 
-for handler in logging.getLogger().handlers: # Get handlers from the root logger
-    app.logger.addHandler(handler)
-app.logger.setLevel(logging.DEBUG) # Match root logger's level or set as needed
+# Flask's logger ('app') propagates to the root logger's queue handler; drop any handler of its
+# own (it would write synchronously and duplicate every record) and inherit the root level.
+app.logger.handlers.clear()
+app.logger.setLevel(logging.NOTSET)
 
 CORS(app)
 Compress(app)
@@ -78,14 +83,104 @@ app.config['AWS_COGNITO_JWT_HEADER_PREFIX'] = 'Bearer' # Default is 'Bearer'
 # Initialize AWSCognitoAuthentication
 aws_auth = AWSCognitoAuthentication(app)
 
-location_client = None
-if LOCATION_PLACE_INDEX_NAME:
+# Verified tokens and the user pool's signing keys are cached per process (see token_cache.py),
+# so repeated requests with the same token skip signature verification and the JWKS download.
+token_verifier = CognitoTokenVerifier(aws_auth)
+
+def authentication_required(view):
+    """
+    Same contract as aws_auth.authentication_required (401 with {"message": ...} for a rejected
+    token, claims in g.cognito_claims, skipped when TESTING), verifying through token_verifier.
+    Verification is timed as the `cognito_auth` stage; a rejected token counts as a stage error.
+    """
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        if not app.config.get("TESTING"):
+            access_token = extract_access_token(request.headers)
+            try:
+                with metrics.stage_timer("cognito_auth"):
+                    claims = token_verifier.verify(access_token)
+            except TokenVerifyError as e:
+                _ = request.data
+                abort(make_response(jsonify(message=str(e)), 401))
+            aws_auth.claims = claims
+            g.cognito_claims = claims
+        return view(*args, **kwargs)
+
+    return decorated
+
+def admission_rejected_response(e):
+    return jsonify({"error": str(e)}), 429, {"Retry-After": e.retry_after_header}
+
+def admission_controlled(endpoint):
+    """
+    Rate-limit the view per user for `endpoint` (see admission.py) and run it as that user, so
+    the LLM/embedding stage limits inside it queue the request fairly. Goes below
+    authentication_required; a rejection anywhere in the view becomes 429 with Retry-After.
+    """
+    def decorator(view):
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            user = admission.user_key(g.get("cognito_claims"), request.remote_addr)
+            try:
+                admission.admit(user, endpoint)
+                with admission.user_scope(user):
+                    return view(*args, **kwargs)
+            except admission.AdmissionRejected as e:
+                app.logger.warning(f"Request to '{endpoint}' from user '{user}' rejected: {e}")
+                return admission_rejected_response(e)
+        return decorated
+    return decorator
+
+def profiled(endpoint):
+    """
+    Profile the request when asked to (authorised X-Profile-Request header or PROFILE_SAMPLE_RATE,
+    see request_profiler.py); a profiled response carries its X-Request-ID. Goes directly below
+    @app.route, so token checks, request parsing and JSON encoding are in the profile.
+    With profiling not configured the view is returned unwrapped.
+    """
+    def decorator(view):
+        if not request_profiler.PROFILING_ENABLED:
+            return view
+
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            reason = request_profiler.profile_reason(request.headers)
+            if reason is None:
+                return view(*args, **kwargs)
+            request_id = request_profiler.request_id_from(request.headers)
+            response, _ = request_profiler.profile_call(
+                request_id, endpoint, reason, lambda: make_response(view(*args, **kwargs))
+            )
+            response.headers[request_profiler.REQUEST_ID_HEADER] = request_id
+            return response
+        return decorated
+    return decorator
+
+WARM_UP_ON_START = os.getenv("WARM_UP_ON_START", "false").lower() in ("1", "true", "yes")
+
+def _create_location_client():
+    import boto3 # Deferred: boto3 is slow to import and only needed once vets are searched
     try:
-        location_client = boto3.client('location', region_name=AWS_REGION_FOR_CLIENTS)
+        client = boto3.client('location', region_name=AWS_REGION_FOR_CLIENTS)
         module_logger.info(f"Amazon Location Service client initialized.")
+        return client
     except Exception as e:
         module_logger.error(f"Failed to initialize Amazon Location Service client: {e}", exc_info=True)
-else:
+        return None
+
+location_client = None # Created on first use by get_location_client()
+_location_client_lock = threading.Lock()
+
+def get_location_client():
+    global location_client
+    if location_client is None and LOCATION_PLACE_INDEX_NAME:
+        with _location_client_lock:
+            if location_client is None:
+                location_client = _create_location_client()
+    return location_client
+
+if not LOCATION_PLACE_INDEX_NAME:
     module_logger.warning("AWS_LOCATION_PLACE_INDEX_NAME not set. Vet finding feature will be disabled.")
 
 # Initializing RAG service
@@ -101,8 +196,35 @@ except Exception as e: # Catch any other unexpected error during init
     # import traceback
     # traceback.print_exc()
 
+def reinitialize_clients_after_fork():
+    """
+    Drop network clients in a freshly forked worker process so they are re-created there.
+    Called from the gunicorn `post_fork` hook (see gunicorn.conf.py); everything else built at
+    import time stays shared with the master copy-on-write.
+    """
+    global location_client
+    module_logger.info(f"Worker process {os.getpid()} re-creating network clients after fork.")
+    location_client = None
+    if rag_service_instance is not None:
+        rag_service_instance.reinitialize_clients()
+
+def warm_up():
+    """
+    Build the serving components and open their connections before this process takes traffic.
+    Runs automatically when WARM_UP_ON_START is set (gunicorn `post_worker_init`, the ASGI
+    `before_serving` hook, or the development server); safe to call more than once.
+    """
+    get_location_client()
+    if rag_service_instance is not None:
+        try:
+            rag_service_instance.warm_up()
+        except Exception as e:
+            module_logger.critical(f"CRITICAL: RAGService warm-up failed: {e}", exc_info=True)
+
 @app.route('/api/index', methods=['POST'])
-@aws_auth.authentication_required # Protect this endpoint
+@profiled("index")
+@authentication_required # Protect this endpoint
+@admission_controlled("index")
 def index_documents_endpoint():
     """
     Endpoint to index PDF documents using RAGService.
@@ -141,65 +263,73 @@ def index_documents_endpoint():
         response_data = {"success": True, "message": f"Indexing complete. Processed chunks: {num_indexed}"}
         app.logger.info(f"Indexing successful for '{pdf_directory_abs}': {response_data}") 
         return jsonify(response_data)
+    except admission.AdmissionRejected:
+        raise
     except Exception as e:
         app.logger.error(f"Error during '/api/index' execution for directory '{pdf_directory_abs}': {e}", exc_info=True)
         # import traceback
         # traceback.print_exc()
         return jsonify({"error": f"Indexing failed: {str(e)}"}), 500
 
+@app.route('/api/index/upload', methods=['POST'])
+@profiled("index_upload")
+@authentication_required # Protect this endpoint
+@admission_controlled("index_upload")
+def upload_documents_endpoint():
+    """
+    Index uploaded PDFs (multipart field `files`, repeatable) without copying them onto the
+    server first; see pdf_uploads.py. Responds with each upload's chunk count and stage timings.
+    """
+    app.logger.info(f"'/api/index/upload' endpoint hit by {request.remote_addr}")
+    if rag_service_instance is None:
+        return jsonify({"error": "RAGService is not available due to an initialization error."}), 503
+    # Checked before request.files reads the body; Flask sets no overall request size limit.
+    if request.content_length is None:
+        return jsonify({"error": "Uploads need a Content-Length header."}), 411
+    if request.content_length > pdf_uploads.UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload larger than {pdf_uploads.UPLOAD_MAX_BYTES} bytes."}), 413
+
+    files = [f for f in request.files.getlist(pdf_uploads.UPLOAD_FIELD) if f and f.filename]
+    if not files:
+        return jsonify({"error": f"Attach one or more PDFs as '{pdf_uploads.UPLOAD_FIELD}'."}), 400
+    not_pdf = [f.filename for f in files if not pdf_uploads.is_pdf(f.stream)]
+    if not_pdf:
+        return jsonify({"error": f"Not PDF files: {', '.join(not_pdf)}"}), 400
+
+    start = time.perf_counter()
+    try:
+        results = rag_service_instance.index_uploaded_pdfs([(f.stream, f.filename) for f in files])
+    except admission.AdmissionRejected:
+        raise
+    except index_generations.GenerationBuildInProgress as e:
+        return jsonify({"error": str(e)}), 409, {"Retry-After": str(pdf_uploads.BUILD_RETRY_AFTER_SECONDS)}
+    except Exception as e:
+        app.logger.error(f"Error during '/api/index/upload' execution: {e}", exc_info=True)
+        return jsonify({"error": f"Indexing failed: {str(e)}"}), 500
+    body, status = pdf_uploads.upload_response(results, time.perf_counter() - start)
+    app.logger.info(f"Indexed {len(files)} uploaded PDF(s) into {body['chunks']} chunks in {body['seconds']:.2f}s (status {status}).")
+    return jsonify(body), status
+
 @app.route('/api/find_vets', methods=['POST'])
-@aws_auth.authentication_required # Protect this endpoint
+@authentication_required # Protect this endpoint
+@admission_controlled("find_vets")
 def find_vets_api():
     app.logger.info(f"'/api/find_vets' endpoint hit by {request.remote_addr}")
+    location_client = get_location_client()
     if not location_client or not LOCATION_PLACE_INDEX_NAME:
         return jsonify({"error": "Vet finding service unavailable/not configured."}), 503
     data = request.json
     latitude, longitude = data.get('latitude'), data.get('longitude')
     if latitude is None or longitude is None: return jsonify({"error": "Latitude/longitude required."}), 400
     try:
-        # --- FIX: Calculate a bounding box to filter results ---
-        radius_km = 50  # Search within a 50km radius (approx. 30 miles)
-        lat_delta = radius_km / 111.0
-        lon_delta = radius_km / (111.0 * math.cos(math.radians(latitude)))
-
-        min_lon = longitude - lon_delta
-        min_lat = latitude - lat_delta
-        max_lon = longitude + lon_delta
-        max_lat = latitude + lat_delta
-        # ---------------------------------------------------------
-
         app.logger.info(f"Searching for vets near ({latitude}, {longitude}) using ALS index '{LOCATION_PLACE_INDEX_NAME}'.")
-
-        search_text = 'veterinary animal pet clinic hospital vet'
-        search_params = {
-            'IndexName': LOCATION_PLACE_INDEX_NAME, 
-            # 'BiasPosition': [float(longitude), float(latitude)],
-            # FIX: Add the FilterBBox parameter to restrict the search area
-            'FilterBBox': [min_lon, min_lat, max_lon, max_lat], 
-            'MaxResults': 20,
-            'Text': search_text,
-        }
-        response = location_client.search_place_index_for_text(**search_params)
-        vets = []
-        for place_result in response.get('Results', []):
-            place = place_result.get('Place', {})
-
-            # Safer way to parse the address label
-            label_parts = place.get('Label', '').split(', ', 1)
-            vet_name = label_parts[0]
-            vet_address = label_parts[1] if len(label_parts) > 1 else ''
-
-            vet_info = {
-                "id": place.get('PlaceId'), 
-                "name": vet_name,
-                "address": vet_address,
-                "longitude": place.get('Geometry', {}).get('Point', [None, None])[0],
-                "latitude": place.get('Geometry', {}).get('Point', [None, None])[1],
-                "phone": place.get('PhoneNumber')
-            }
-            
-            if vet_info["name"]:
-                vets.append(vet_info)
+        tile_latitude, tile_longitude = vet_search.snap_to_tile(latitude, longitude)
+        search_params = vet_search.nearby_search_params(LOCATION_PLACE_INDEX_NAME, tile_latitude, tile_longitude)
+        # Concurrent searches for the same tile share one Amazon Location call.
+        vets = vet_search.VET_SEARCH_FLIGHT.do(
+            vet_search.nearby_search_key(tile_latitude, tile_longitude),
+            lambda: vet_search.parse_vet_results(location_client.search_place_index_for_text(**search_params))
+        )
             
         app.logger.info(f"Found {len(vets)} potential veterinary locations.")
         # If no vets are found, add a helpful error message to the frontend.
@@ -212,9 +342,11 @@ def find_vets_api():
         return jsonify({"error": "Failed to find nearby vets due to a server error."}), 500
 
 @app.route('/api/search_vets_by_text', methods=['POST'])
-@aws_auth.authentication_required
+@authentication_required
+@admission_controlled("search_vets_by_text")
 def search_vets_by_text_api():
     app.logger.info(f"'/api/search_vets_by_text' endpoint hit by {request.remote_addr}")
+    location_client = get_location_client()
     if not location_client or not LOCATION_PLACE_INDEX_NAME:
         return jsonify({"error": "Vet finding service unavailable/not configured."}), 503
 
@@ -224,38 +356,12 @@ def search_vets_by_text_api():
         return jsonify({"error": "A search query is required."}), 400
 
     try:
-        # Prepend search terms to the user's location query for better results
-        search_text = f"veterinarian or vet in {query}"
-        app.logger.info(f"Searching for vets with text query: '{search_text}'")
-
-        search_params = {
-            'IndexName': os.getenv("AWS_LOCATION_PLACE_INDEX_NAME"),
-            'Text': search_text,
-            'FilterCountries': ['USA'], # Optional: Filter results to a specific country
-            'MaxResults': 10,
-            'Language': 'en'
-        }
-
-        response = location_client.search_place_index_for_text(**search_params)
-
-        vets = []
-        for place_result in response.get('Results', []):
-            place = place_result.get('Place', {})
-            
-            label_parts = place.get('Label', '').split(', ', 1)
-            vet_name = label_parts[0]
-            vet_address = label_parts[1] if len(label_parts) > 1 else ''
-
-            vet_info = {
-                "id": place.get('PlaceId'), 
-                "name": vet_name,
-                "address": vet_address,
-                "longitude": place.get('Geometry', {}).get('Point', [None, None])[0],
-                "latitude": place.get('Geometry', {}).get('Point', [None, None])[1],
-                "phone": place.get('PhoneNumber')
-            }
-            if vet_info["name"]: 
-                vets.append(vet_info)
+        search_params = vet_search.text_search_params(LOCATION_PLACE_INDEX_NAME, query)
+        app.logger.info(f"Searching for vets with text query: '{search_params['Text']}'")
+        vets = vet_search.VET_SEARCH_FLIGHT.do(
+            vet_search.text_search_key(query),
+            lambda: vet_search.parse_vet_results(location_client.search_place_index_for_text(**search_params))
+        )
 
         app.logger.info(f"Found {len(vets)} vets for text query '{query}'.")
         return jsonify({"success": True, "vets": vets})
@@ -265,7 +371,9 @@ def search_vets_by_text_api():
         return jsonify({"error": "Failed to find nearby vets due to a server error."}), 500
 
 @app.route('/api/chat', methods=['POST'])
-@aws_auth.authentication_required # Protect this endpoint
+@profiled("chat")
+@authentication_required # Protect this endpoint
+@admission_controlled("chat")
 def chat_endpoint():
     app.logger.info(f"'/api/chat' endpoint hit by {request.remote_addr}")
     if rag_service_instance is None:
@@ -273,17 +381,20 @@ def chat_endpoint():
 
     content_type_header = request.headers.get('Content-Type', '').lower()
     user_message = ''
-    chat_history_from_frontend = []
+    conversation_id = None # set: server-side session (see sessions.py) instead of `chat_history`
     image_data_base64 = None
 
     if 'multipart/form-data' in content_type_header:
         app.logger.debug("Processing chat request as multipart/form-data.")
         user_message = request.form.get('message', '')
+        conversation_id = request.form.get('conversation_id')
         chat_history_str = request.form.get('chat_history', '[]')
-        try:
-            chat_history_from_frontend = json.loads(chat_history_str)
-        except json.JSONDecodeError:
-            chat_history_from_frontend = []
+
+        def load_chat_history():
+            try:
+                return json.loads(chat_history_str)
+            except json.JSONDecodeError:
+                return []
 
         if 'image' in request.files:
             image_file = request.files['image']
@@ -295,27 +406,71 @@ def chat_endpoint():
         app.logger.debug("Processing chat request as application/json.")
         data = request.json
         user_message = data.get('message', '')
-        chat_history_from_frontend = data.get('chat_history', [])
+        conversation_id = data.get('conversation_id')
+        load_chat_history = lambda: data.get('chat_history', [])
         
     if not user_message and not image_data_base64:
         return jsonify({"error": "Please provide a message or an image."}), 400
         
     if not user_message and image_data_base64:
         user_message = "User uploaded an image of a pet's skin condition for analysis."
+
+    conversation = None
+    if conversation_id is not None:
+        # `chat_history` is only read to seed a conversation the server does not know (yet).
+        try:
+            conversation = sessions.SESSION_STORE.open(admission.current_user(), conversation_id, load_chat_history)
+        except sessions.ConversationNotFound as e:
+            # The client resends the message with its `chat_history` (see Chat.jsx).
+            return jsonify({"error": str(e), "conversation_reset": True}), 409
+        chat_history_from_frontend = conversation.history()
+    else:
+        chat_history_from_frontend = load_chat_history()
         
     try:
-        structured_ai_response = rag_service_instance.generate_response(
-            user_message, chat_history_from_frontend, image_data_base64=image_data_base64
-        )
+        with metrics.stage_timer("chat_generate_response"):
+            structured_ai_response = rag_service_instance.generate_response(
+                user_message, chat_history_from_frontend, image_data_base64=image_data_base64
+            )
+        if conversation is not None:
+            sessions.SESSION_STORE.record_turn(conversation, user_message, structured_ai_response["response"], structured_ai_response["urgency"])
+            # Coalesced requests share the response dict: add the ID to a copy.
+            structured_ai_response = {**structured_ai_response, "conversation_id": conversation.id}
         return jsonify(structured_ai_response)
+    except admission.AdmissionRejected:
+        raise
     except Exception as e:
         app.logger.error(f"Error in /api/chat execution: {e}", exc_info=True)
         return jsonify({"urgency": "ERROR", "message": "An internal server error occurred."}), 500
 
+@app.route('/api/profiles/<endpoint>/<request_id>', methods=['GET'])
+def profile_summary_endpoint(endpoint, request_id):
+    """
+    Top functions by self time of a profiled request (written to the logs directory, see
+    request_profiler.py). Requires the X-Profile-Request token; 404 without it.
+    """
+    if not request_profiler.token_authorised(request.headers.get(request_profiler.PROFILE_HEADER)):
+        abort(404)
+    summary = request_profiler.load_summary(endpoint, request_id)
+    if summary is None:
+        return jsonify({"error": f"No profile for request '{request_id}'."}), 404
+    return jsonify(summary)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Per-stage latency histograms/percentiles and cache/error counters in Prometheus text format.
+    Unauthenticated so Prometheus can scrape it; expose it on an internal network only.
+    """
+    return Response(metrics.render_prometheus(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
 if __name__ == '__main__':
+    # Development server only. In production run: gunicorn -c gunicorn.conf.py wsgi:app
     module_logger.info("Flask application starting in debug mode (app.py as __main__)...")
     if rag_service_instance is None:
         module_logger.warning("Flask app is starting, but RAGService failed to initialize. Chat functionality will be impaired.")
+    if WARM_UP_ON_START:
+        warm_up()
     
     # use_reloader=False is crucial with custom logging setup in debug mode
     # to prevent the logging configuration from running twice or causing issues.
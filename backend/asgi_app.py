@@ -0,0 +1,294 @@
+# Async (ASGI) serving mode for the I/O-bound endpoints.
+#
+#   hypercorn -b 0.0.0.0:5000 --workers 4 asgi_app:app
+#
+# Same routes, request/response contracts and Cognito protection as app.py, but each request
+# awaits its outbound calls (Bedrock, SageMaker, OpenAI, Pinecone, Amazon Location) instead of
+# holding a worker thread, so one process can serve hundreds of concurrent conversations.
+
+#logging
+import logging
+
+import asyncio
+import base64
+import json
+import os
+import time
+from functools import partial, wraps
+
+from quart import Quart, request, jsonify, g, Response
+from quart.wrappers import Request
+from quart_cors import cors
+from flask_awscognito.utils import extract_access_token
+from flask_awscognito.exceptions import FlaskAWSCognitoError, TokenVerifyError
+
+# Importing the Flask module reuses its logging setup, configuration, the shared RAGService
+# and the lazily created Amazon Location client.
+import app as flask_backend
+import vet_search
+import metrics
+import admission
+import index_generations
+import sessions
+import pdf_uploads
+from rag_service import run_blocking
+
+module_logger = logging.getLogger(__name__) # Logger name will be 'asgi_app'
+
+class SpoolingRequest(Request):
+    """Streams multipart file parts into pdf_uploads.spooled_stream, like app.SpoolingRequest."""
+    def make_form_data_parser(self):
+        return self.form_data_parser_class(
+            charset=self.charset, errors=self.encoding_errors, max_content_length=self.max_content_length,
+            cls=self.parameter_storage_class, stream_factory=pdf_uploads.spooled_stream,
+        )
+
+
+app = Quart(__name__)
+app.request_class = SpoolingRequest
+app = cors(app, allow_origin="*")
+
+
+@app.before_serving
+async def warm_up():
+    if flask_backend.WARM_UP_ON_START:
+        await asyncio.to_thread(flask_backend.warm_up)
+
+
+async def _verify_cognito_token(access_token):
+    # Shares the Flask app's verified-token and signing-key caches. A cache hit is answered on
+    # the event loop; a miss may verify an RS256 signature or download the JWKS, so it runs off it.
+    token_verifier = flask_backend.token_verifier
+    claims = token_verifier.cached_claims(access_token)
+    if claims is not None:
+        return claims
+    return await run_blocking(token_verifier.verify_uncached, access_token)
+
+
+def authentication_required(view):
+    """
+    Async equivalent of AWSCognitoAuthentication.authentication_required.
+    """
+    @wraps(view)
+    async def decorated(*args, **kwargs):
+        if not app.config.get("TESTING"):
+            try:
+                with metrics.stage_timer("cognito_auth"):
+                    g.cognito_claims = await _verify_cognito_token(extract_access_token(request.headers))
+            except TokenVerifyError as e:
+                return jsonify(message=str(e)), 401
+            except FlaskAWSCognitoError as e:
+                module_logger.error(f"Cognito signing keys unavailable: {e}", exc_info=True)
+                return jsonify(message="Authentication service unavailable."), 503
+        return await view(*args, **kwargs)
+
+    return decorated
+
+
+def admission_controlled(endpoint):
+    """
+    Async equivalent of app.admission_controlled.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def decorated(*args, **kwargs):
+            user = admission.user_key(g.get("cognito_claims"), request.remote_addr)
+            try:
+                # The rate-limit buckets may live in SQLite (ADMISSION_STORE_PATH): off the event loop.
+                await run_blocking(admission.admit, user, endpoint)
+                with admission.user_scope(user):
+                    return await view(*args, **kwargs)
+            except admission.AdmissionRejected as e:
+                module_logger.warning(f"Request to '{endpoint}' from user '{user}' rejected: {e}")
+                return jsonify({"error": str(e)}), 429, {"Retry-After": e.retry_after_header}
+        return decorated
+    return decorator
+
+
+@app.route('/api/index', methods=['POST'])
+@authentication_required
+@admission_controlled("index")
+async def index_documents_endpoint():
+    module_logger.info(f"'/api/index' endpoint hit by {request.remote_addr}")
+    rag_service_instance = flask_backend.rag_service_instance
+    if rag_service_instance is None:
+        return jsonify({"error": "RAGService is not available due to an initialization error."}), 503
+
+    data = await request.get_json()
+    pdf_directory_relative = data.get('directory', '../pdfs')
+    script_dir = os.path.dirname(flask_backend.__file__) # Directory of app.py
+    pdf_directory_abs = os.path.abspath(os.path.join(script_dir, pdf_directory_relative))
+    if not os.path.isdir(pdf_directory_abs):
+        module_logger.warning(f"Directory not found for indexing: '{pdf_directory_abs}'")
+        return jsonify({"error": f"Directory not found or is not a directory: {pdf_directory_abs}"}), 404
+
+    try:
+        # Indexing is CPU heavy and long running; keep it off the event loop.
+        num_indexed = await asyncio.to_thread(rag_service_instance.index_documents, pdf_directory_abs)
+        return jsonify({"success": True, "message": f"Indexing complete. Processed chunks: {num_indexed}"})
+    except admission.AdmissionRejected:
+        raise
+    except Exception as e:
+        module_logger.error(f"Error during '/api/index' execution for directory '{pdf_directory_abs}': {e}", exc_info=True)
+        return jsonify({"error": f"Indexing failed: {str(e)}"}), 500
+
+
+@app.route('/api/index/upload', methods=['POST'])
+@authentication_required
+@admission_controlled("index_upload")
+async def upload_documents_endpoint():
+    module_logger.info(f"'/api/index/upload' endpoint hit by {request.remote_addr}")
+    rag_service_instance = flask_backend.rag_service_instance
+    if rag_service_instance is None:
+        return jsonify({"error": "RAGService is not available due to an initialization error."}), 503
+    # A body without Content-Length (chunked) is still cut off at Quart's MAX_CONTENT_LENGTH (16 MiB by default).
+    if request.content_length is not None and request.content_length > pdf_uploads.UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload larger than {pdf_uploads.UPLOAD_MAX_BYTES} bytes."}), 413
+
+    files = [f for f in (await request.files).getlist(pdf_uploads.UPLOAD_FIELD) if f and f.filename]
+    if not files:
+        return jsonify({"error": f"Attach one or more PDFs as '{pdf_uploads.UPLOAD_FIELD}'."}), 400
+    not_pdf = [f.filename for f in files if not pdf_uploads.is_pdf(f.stream)]
+    if not_pdf:
+        return jsonify({"error": f"Not PDF files: {', '.join(not_pdf)}"}), 400
+
+    start = time.perf_counter()
+    try:
+        # PDF parsing and embedding are long running; keep them off the event loop.
+        results = await asyncio.to_thread(rag_service_instance.index_uploaded_pdfs, [(f.stream, f.filename) for f in files])
+    except admission.AdmissionRejected:
+        raise
+    except index_generations.GenerationBuildInProgress as e:
+        return jsonify({"error": str(e)}), 409, {"Retry-After": str(pdf_uploads.BUILD_RETRY_AFTER_SECONDS)}
+    except Exception as e:
+        module_logger.error(f"Error during '/api/index/upload' execution: {e}", exc_info=True)
+        return jsonify({"error": f"Indexing failed: {str(e)}"}), 500
+    body, status = pdf_uploads.upload_response(results, time.perf_counter() - start)
+    return jsonify(body), status
+
+
+async def _search_vets(key, search_params):
+    # Concurrent searches with the same key (tile or normalised text) share one Amazon Location call.
+    async def search():
+        location_client = flask_backend.get_location_client()
+        response = await run_blocking(partial(location_client.search_place_index_for_text, **search_params))
+        return vet_search.parse_vet_results(response)
+    return await vet_search.VET_SEARCH_FLIGHT.ado(key, search)
+
+
+@app.route('/api/find_vets', methods=['POST'])
+@authentication_required
+@admission_controlled("find_vets")
+async def find_vets_api():
+    module_logger.info(f"'/api/find_vets' endpoint hit by {request.remote_addr}")
+    if not flask_backend.get_location_client() or not flask_backend.LOCATION_PLACE_INDEX_NAME:
+        return jsonify({"error": "Vet finding service unavailable/not configured."}), 503
+    data = await request.get_json()
+    latitude, longitude = data.get('latitude'), data.get('longitude')
+    if latitude is None or longitude is None: return jsonify({"error": "Latitude/longitude required."}), 400
+    try:
+        tile_latitude, tile_longitude = vet_search.snap_to_tile(latitude, longitude)
+        vets = await _search_vets(
+            vet_search.nearby_search_key(tile_latitude, tile_longitude),
+            vet_search.nearby_search_params(flask_backend.LOCATION_PLACE_INDEX_NAME, tile_latitude, tile_longitude)
+        )
+        module_logger.info(f"Found {len(vets)} potential veterinary locations.")
+        return jsonify({"success": True, "vets": vets})
+    except Exception as e:
+        module_logger.error(f"Error in /api/find_vets: {e}", exc_info=True)
+        return jsonify({"error": "Failed to find nearby vets due to a server error."}), 500
+
+
+@app.route('/api/search_vets_by_text', methods=['POST'])
+@authentication_required
+@admission_controlled("search_vets_by_text")
+async def search_vets_by_text_api():
+    module_logger.info(f"'/api/search_vets_by_text' endpoint hit by {request.remote_addr}")
+    if not flask_backend.get_location_client() or not flask_backend.LOCATION_PLACE_INDEX_NAME:
+        return jsonify({"error": "Vet finding service unavailable/not configured."}), 503
+    data = await request.get_json()
+    query = data.get('query')
+    if not query:
+        return jsonify({"error": "A search query is required."}), 400
+    try:
+        vets = await _search_vets(vet_search.text_search_key(query), vet_search.text_search_params(flask_backend.LOCATION_PLACE_INDEX_NAME, query))
+        module_logger.info(f"Found {len(vets)} vets for text query '{query}'.")
+        return jsonify({"success": True, "vets": vets})
+    except Exception as e:
+        module_logger.error(f"An unexpected error occurred in /api/search_vets_by_text: {e}", exc_info=True)
+        return jsonify({"error": "Failed to find nearby vets due to a server error."}), 500
+
+
+@app.route('/api/chat', methods=['POST'])
+@authentication_required
+@admission_controlled("chat")
+async def chat_endpoint():
+    module_logger.info(f"'/api/chat' endpoint hit by {request.remote_addr}")
+    rag_service_instance = flask_backend.rag_service_instance
+    if rag_service_instance is None:
+        return jsonify({"error": "RAGService is not available. Please check server logs."}), 503
+
+    content_type_header = request.headers.get('Content-Type', '').lower()
+    user_message = ''
+    conversation_id = None
+    image_data_base64 = None
+
+    if 'multipart/form-data' in content_type_header:
+        form = await request.form
+        files = await request.files
+        user_message = form.get('message', '')
+        conversation_id = form.get('conversation_id')
+
+        def load_chat_history():
+            try:
+                return json.loads(form.get('chat_history', '[]'))
+            except json.JSONDecodeError:
+                return []
+
+        image_file = files.get('image')
+        if image_file and image_file.filename != '':
+            image_data_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+            module_logger.info(f"Image '{image_file.filename}' received and converted to base64.")
+    else: # JSON
+        data = await request.get_json()
+        user_message = data.get('message', '')
+        conversation_id = data.get('conversation_id')
+        load_chat_history = lambda: data.get('chat_history', [])
+
+    if not user_message and not image_data_base64:
+        return jsonify({"error": "Please provide a message or an image."}), 400
+
+    if not user_message and image_data_base64:
+        user_message = "User uploaded an image of a pet's skin condition for analysis."
+
+    conversation = None
+    if conversation_id is not None:
+        # The store may be SQLite (SESSION_STORE_PATH): off the event loop.
+        try:
+            conversation = await run_blocking(sessions.SESSION_STORE.open, admission.current_user(), conversation_id, load_chat_history)
+        except sessions.ConversationNotFound as e:
+            return jsonify({"error": str(e), "conversation_reset": True}), 409
+        chat_history_from_frontend = conversation.history()
+    else:
+        chat_history_from_frontend = load_chat_history()
+
+    try:
+        with metrics.stage_timer("chat_generate_response"):
+            structured_ai_response = await rag_service_instance.agenerate_response(
+                user_message, chat_history_from_frontend, image_data_base64=image_data_base64
+            )
+        if conversation is not None:
+            await run_blocking(sessions.SESSION_STORE.record_turn, conversation, user_message,
+                               structured_ai_response["response"], structured_ai_response["urgency"])
+            structured_ai_response = {**structured_ai_response, "conversation_id": conversation.id}
+        return jsonify(structured_ai_response)
+    except admission.AdmissionRejected:
+        raise
+    except Exception as e:
+        module_logger.error(f"Error in /api/chat execution: {e}", exc_info=True)
+        return jsonify({"urgency": "ERROR", "message": "An internal server error occurred."}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    return Response(metrics.render_prometheus(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
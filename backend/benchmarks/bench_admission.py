@@ -0,0 +1,203 @@
+# Fairness check + benchmark: per-user admission control on /api/chat.
+#
+#   python -m benchmarks.bench_admission [--heavy-requests 32] [--light-users 6]
+#
+# One "heavy" user fires a burst of concurrent chat requests while several "light" users send
+# one request each, against the Flask app (threads) and the ASGI app (asyncio) with a fake chain
+# behind a small LLM concurrency limit. Reports the light users' latency with a single FIFO queue
+# and with per-user fair queueing, then with the default per-user queue bound and rate limit,
+# where the heavy user's excess must be rejected with 429 + Retry-After and every light user
+# served. Then checks that a chain abandoned at its deadline keeps its LLM slot until it really
+# ends, and that a rejection at the slot does not count against the chain's circuit breaker.
+# Finally checks that two processes sharing ADMISSION_STORE_PATH share one bucket.
+# Exits non-zero if any of these checks fails.
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+import admission
+import app as flask_backend
+import asgi_app
+import metrics
+import resilience
+from benchmarks.fakes import build_fake_rag_service
+
+HEAVY_ADDR = "10.0.0.1"
+
+
+def _body(i):
+    # Distinct history per request, so identical requests are not coalesced into one chain run.
+    return {"message": "My cat is sneezing", "chat_history": [{"sender": "user", "text": f"turn {i}"}]}
+
+
+def _configure(args, fifo, bounded):
+    admission.RATE_LIMITER.store.clear()
+    admission.RATE_LIMITER.limits = admission.parse_rate_limits(admission.RATE_LIMITS) if bounded else {}
+    admission.LLM_LIMITER = admission.FairLimiter(
+        "llm_generation", args.llm_concurrency,
+        max_queue_per_user=admission.ADMISSION_MAX_QUEUE_PER_USER if bounded else args.heavy_requests + args.light_users
+    )
+    # FIFO baseline: every request waits in one shared queue.
+    admission.user_key = (lambda claims, remote_addr: "everyone") if fifo else _user_key
+    flask_backend.rag_service_instance = build_fake_rag_service(bedrock_ms=args.bedrock_ms, chain_ms=args.chain_ms)
+
+
+_user_key = admission.user_key
+
+
+def _run_flask(args):
+    client = flask_backend.app.test_client()
+    results = []
+
+    def one(addr, i):
+        start = time.perf_counter()
+        response = client.post("/api/chat", json=_body(i), environ_base={"REMOTE_ADDR": addr})
+        results.append((addr, response.status_code, response.headers.get("Retry-After"), time.perf_counter() - start))
+
+    with ThreadPoolExecutor(max_workers=args.heavy_requests + args.light_users) as pool:
+        for i in range(args.heavy_requests):
+            pool.submit(one, HEAVY_ADDR, i)
+        time.sleep(args.light_delay_ms / 1000.0) # light users arrive while the burst is queued
+        for i in range(args.light_users):
+            pool.submit(one, f"10.0.1.{i}", i)
+    return results
+
+
+async def _run_asgi(args):
+    client = asgi_app.app.test_client()
+    results = []
+
+    async def one(addr, i, delay):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        response = await client.post("/api/chat", json=_body(i), scope_base={"client": (addr, 40000)})
+        results.append((addr, response.status_code, response.headers.get("Retry-After"), time.perf_counter() - start))
+
+    await asyncio.gather(
+        *(one(HEAVY_ADDR, i, 0) for i in range(args.heavy_requests)),
+        *(one(f"10.0.1.{i}", i, args.light_delay_ms / 1000.0) for i in range(args.light_users))
+    )
+    return results
+
+
+def _summarise(results):
+    light = sorted(latency for addr, status, _, latency in results if addr != HEAVY_ADDR and status == 200)
+    heavy_ok = sum(1 for addr, status, _, _ in results if addr == HEAVY_ADDR and status == 200)
+    rejected = [(addr, retry_after) for addr, status, retry_after, _ in results if status == 429]
+    return light, heavy_ok, rejected
+
+
+def _check_abandoned_chain(chain_seconds=0.3, deadline_seconds=0.05):
+    """
+    Returns:
+        (slots held right after the deadline, slots held once the chain ended,
+         breaker failures after a rejection at the slot)
+    """
+    limiter = admission.FairLimiter("bench_llm", 1, max_queue_per_user=0)
+    breaker = resilience.CircuitBreaker("bench_chain")
+    try:
+        resilience.call_with_deadline(lambda: time.sleep(chain_seconds), resilience.Deadline(deadline_seconds),
+                                      "bench_chain", breaker=breaker, gate=lambda: limiter.slot(user="a"))
+    except resilience.DeadlineExceeded:
+        pass
+    held_after_deadline = limiter.stats()["active"]
+    breaker.reset()
+    try:
+        # The abandoned chain still holds the only slot and user "b" may not queue: rejected.
+        resilience.call_with_deadline(lambda: None, resilience.Deadline(1.0), "bench_chain", breaker=breaker,
+                                      gate=lambda: limiter.slot(user="b", timeout=0))
+    except admission.AdmissionRejected:
+        pass
+    rejection_failures = breaker._failures
+    time.sleep(chain_seconds)
+    return held_after_deadline, limiter.stats()["active"], rejection_failures
+
+
+def _shared_store_worker(path, attempts, admitted):
+    store = admission.SQLiteBucketStore(path)
+    admitted.put(sum(1 for _ in range(attempts) if store.take("chat:shared-user", 10, 1e-6) == 0.0))
+
+
+def _check_shared_store(attempts=20):
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'admission.sqlite3')
+        admitted = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_shared_store_worker, args=(path, attempts, admitted)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return admitted.get() + admitted.get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-user admission control under a one-user burst')
+    parser.add_argument('--heavy-requests', type=int, default=32)
+    parser.add_argument('--light-users', type=int, default=6)
+    parser.add_argument('--llm-concurrency', type=int, default=4)
+    parser.add_argument('--chain-ms', type=float, default=200)
+    parser.add_argument('--bedrock-ms', type=float, default=20)
+    parser.add_argument('--light-delay-ms', type=float, default=100)
+    args = parser.parse_args()
+
+    flask_backend.app.config['TESTING'] = True
+    asgi_app.app.config['TESTING'] = True
+    servers = (("flask", _run_flask), ("asgi", lambda a: asyncio.run(_run_asgi(a))))
+    failures = 0
+
+    print(f"{'server':<6} {'queueing':<26} {'light p50 ms':>12} {'light max ms':>12} {'light ok':>9} {'heavy ok':>9} {'429s':>5}")
+    for server, run in servers:
+        rows = {}
+        for label, fifo, bounded in (("fifo", True, False), ("fair", False, False), ("fair + bounds/rate limit", False, True)):
+            _configure(args, fifo, bounded)
+            light, heavy_ok, rejected = _summarise(run(args))
+            rows[label] = light
+            print(f"{server:<6} {label:<26} {statistics.median(light) * 1000:>12.0f} {light[-1] * 1000:>12.0f} "
+                  f"{len(light):>9} {heavy_ok:>9} {len(rejected):>5}")
+            if len(light) != args.light_users:
+                print(f"FAIL: {server} {label}: {args.light_users - len(light)} light user request(s) not served")
+                failures += 1
+            if bounded and (not rejected or any(addr != HEAVY_ADDR or not retry_after for addr, retry_after in rejected)):
+                print(f"FAIL: {server} {label}: the heavy user's excess was not rejected with 429 + Retry-After")
+                failures += 1
+        if rows["fair"][-1] >= rows["fifo"][-1]:
+            print(f"FAIL: {server}: fair queueing did not shorten the light users' wait")
+            failures += 1
+
+    admission.user_key = _user_key
+    held, released, rejection_failures = _check_abandoned_chain()
+    print(f"\nchain abandoned at its deadline: {held} slot(s) held after the deadline, {released} once it ended")
+    if (held, released) != (1, 0):
+        print("FAIL: an abandoned chain did not keep its LLM slot until it ended")
+        failures += 1
+    if rejection_failures:
+        print("FAIL: a rejection at the LLM slot counted as a chain failure")
+        failures += 1
+
+    shared = _check_shared_store()
+    print(f"shared SQLite store: 2 processes x 20 attempts on a 10-token bucket -> {shared} admitted")
+    if shared != 10:
+        print("FAIL: processes sharing ADMISSION_STORE_PATH did not share the bucket")
+        failures += 1
+
+    print()
+    print("\n".join(line for line in metrics.render_prometheus().splitlines()
+                    if "admission" in line and not line.startswith("#")))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Benchmark: concurrent /api/chat and /api/find_vets through the ASGI app versus the Flask app
+# served by a fixed thread pool (one gthread worker), with latency-injecting fakes.
+#
+#   python -m benchmarks.bench_async [--concurrency 50 200 500] [--sync-threads 4]
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+    os.environ[_key] = ""
+os.environ.setdefault("ADMISSION_CONTROL", "false") # one client far past the per-user limits
+
+import app as flask_backend
+import asgi_app
+from benchmarks.fakes import FakeLocationClient, build_fake_rag_service
+
+CHAT_BODY = {"message": "My dog keeps scratching his ear", "chat_history": [{"sender": "user", "text": "Hi"}]}
+VETS_BODY = {"latitude": 37.77, "longitude": -122.42}
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _report(label, latencies, elapsed):
+    print(f"{label:<34} {len(latencies) / elapsed:8.1f} req/s  "
+          f"p50={statistics.median(latencies) * 1000:7.0f}ms  p99={_percentile(latencies, 99) * 1000:7.0f}ms")
+
+
+async def _run_async(path, body, concurrency):
+    client = asgi_app.app.test_client()
+
+    async def one():
+        start = time.perf_counter()
+        response = await client.post(path, json=body)
+        assert response.status_code == 200, await response.get_data()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def _run_sync(path, body, concurrency, threads):
+    client = flask_backend.app.test_client()
+
+    def one(submitted_at):
+        response = client.post(path, json=body)
+        assert response.status_code == 200, response.get_data()
+        return time.perf_counter() - submitted_at # includes time queued for a free thread
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(one, [start] * concurrency))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare async and threaded serving under concurrent load')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--sync-threads', type=int, default=4, help='Threads per Flask worker (gunicorn gthread)')
+    parser.add_argument('--bedrock-ms', type=float, default=300)
+    parser.add_argument('--chain-ms', type=float, default=1500)
+    parser.add_argument('--location-ms', type=float, default=150)
+    args = parser.parse_args()
+
+    flask_backend.app.config['TESTING'] = True
+    asgi_app.app.config['TESTING'] = True
+    flask_backend.rag_service_instance = build_fake_rag_service(bedrock_ms=args.bedrock_ms, chain_ms=args.chain_ms)
+    flask_backend.location_client = FakeLocationClient(args.location_ms)
+    flask_backend.LOCATION_PLACE_INDEX_NAME = "bench-place-index"
+
+    for concurrency in args.concurrency:
+        print(f"--- {concurrency} concurrent requests ---")
+        for path, body in (("/api/chat", CHAT_BODY), ("/api/find_vets", VETS_BODY)):
+            latencies, elapsed = asyncio.run(_run_async(path, body, concurrency))
+            _report(f"async  {path}", latencies, elapsed)
+            latencies, elapsed = _run_sync(path, body, concurrency, args.sync_threads)
+            _report(f"flask  {path} ({args.sync_threads} threads)", latencies, elapsed)
+
+
+if __name__ == "__main__":
+    main()
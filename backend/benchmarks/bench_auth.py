@@ -0,0 +1,106 @@
+# Benchmark: per-request Cognito authentication cost, against a local fake user pool / JWKS.
+#
+#   python -m benchmarks.bench_auth [--requests 500] [--jwks-ms 50] [--users 50]
+#
+#   per-request TokenService - what flask_awscognito does: new TokenService (JWKS download) + RS256 check
+#   verifier, same token     - token_cache.CognitoTokenVerifier, one user sending many chat turns
+#   verifier, new tokens     - every request carries a token not seen before (keys cached, signature checked)
+#   verifier, N users        - requests spread over N users' tokens
+# Also checks expired-token rejection, cached claims expiry, and that a failing JWKS endpoint is
+# retried once per retry interval rather than by every request.
+
+import argparse
+import statistics
+import time
+
+from flask_awscognito.exceptions import TokenVerifyError
+
+from benchmarks.fakes import FakeCognito
+from token_cache import CognitoTokenVerifier, JWKSCache
+
+POOL_ID, CLIENT_ID, REGION = "us-east-1_BENCH", "bench-client", "us-east-1"
+
+
+class _AuthSettings:
+    """The attributes of AWSCognitoAuthentication that CognitoTokenVerifier reads."""
+    def __init__(self, token_service_factory):
+        self.user_pool_id, self.user_pool_client_id, self.region = POOL_ID, CLIENT_ID, REGION
+        self.token_service_factory = token_service_factory
+
+
+def _measure(label, tokens, verify):
+    samples = []
+    for token in tokens:
+        start = time.perf_counter()
+        verify(token)
+        samples.append(time.perf_counter() - start)
+    print(f"{label:<28} mean={statistics.mean(samples) * 1e6:10.1f}us  p50={statistics.median(samples) * 1e6:10.1f}us  "
+          f"max={max(samples) * 1e6:10.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure Cognito token verification cost per request')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--jwks-ms', type=float, default=50, help='Simulated JWKS download latency')
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    cognito = FakeCognito(POOL_ID, CLIENT_ID, REGION, latency_ms=args.jwks_ms)
+    same_token = [cognito.issue_token()] * args.requests
+    fresh_tokens = [cognito.issue_token(sub=f"user-{i}") for i in range(args.requests)]
+    user_tokens = [cognito.issue_token(sub=f"user-{i}") for i in range(args.users)]
+    mixed_tokens = [user_tokens[i % args.users] for i in range(args.requests)]
+
+    def per_request_token_service(token):
+        token_service = cognito.token_service_factory(POOL_ID, CLIENT_ID, REGION)
+        token_service.verify(token)
+
+    legacy_requests = max(1, min(args.requests, int(5000 / max(args.jwks_ms, 1)))) # bound the run time
+    _measure("per-request TokenService", same_token[:legacy_requests], per_request_token_service)
+    for label, tokens in (("verifier, same token", same_token), ("verifier, new tokens", fresh_tokens),
+                          (f"verifier, {args.users} users", mixed_tokens)):
+        verifier = CognitoTokenVerifier(_AuthSettings(cognito.token_service_factory))
+        verifier.verify(cognito.issue_token(sub="warm-up")) # first request downloads the keys
+        cognito.jwks_requests = 0
+        _measure(label, tokens, verifier.verify)
+        print(f"{'':<28} JWKS downloads during run: {cognito.jwks_requests}")
+
+    # Correctness: expired tokens are rejected, and a cached token stops matching at its `exp`.
+    verifier = CognitoTokenVerifier(_AuthSettings(cognito.token_service_factory))
+    claims = verifier.verify(same_token[0])
+    try:
+        verifier.verify(cognito.issue_token(ttl_seconds=-10))
+        print("FAIL: expired token accepted")
+    except TokenVerifyError as e:
+        print(f"expired token rejected: {e}")
+    if verifier.tokens.get(same_token[0], now=claims["exp"]) is not None:
+        print("FAIL: cached claims served past the token's exp")
+    else:
+        print("cached claims dropped at the token's exp")
+
+    # JWKS endpoint down: requests keep the stale keys, and the refresh is retried once per interval.
+    fetches = []
+
+    def fetch_keys():
+        fetches.append(time.monotonic())
+        if len(fetches) > 1:
+            raise RuntimeError("JWKS endpoint unavailable")
+        return ["bench-key"]
+
+    jwks = JWKSCache(fetch_keys, refresh_seconds=0, retry_seconds=0.5)
+    jwks.get_keys()
+    end = time.monotonic() + 1.2
+    requests = 0
+    while time.monotonic() < end:
+        requests += jwks.get_keys() == ["bench-key"]
+        time.sleep(0.001)
+    if jwks.force_refresh():
+        print("FAIL: an unknown key id forced a refresh while the JWKS endpoint was backing off")
+    if not 2 <= len(fetches) - 1 <= 4:
+        print(f"FAIL: {len(fetches) - 1} failed JWKS refreshes in 1.2s, expected one per 0.5s retry interval")
+    else:
+        print(f"JWKS outage: {requests} requests served stale keys, {len(fetches) - 1} refresh attempts in 1.2s")
+
+
+if __name__ == "__main__":
+    main()
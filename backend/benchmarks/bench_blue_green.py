@@ -0,0 +1,210 @@
+# Check + benchmark: re-indexing under chat load, in place versus blue/green.
+#
+#   python -m benchmarks.bench_blue_green [--pdfs 3] [--pages 8] [--clients 4]
+#
+# Two RAGService instances stand in for two serving workers: "A" runs the re-index itself, "B"
+# only learns about it through the generation state file (its own GenerationWatcher). Both answer
+# chat requests continuously through the real chain (fake LLM, fake Pinecone shared by both) while
+# the corpus is re-indexed twice:
+#   in place    - the old flow: delete_all on the serving namespace, then index_documents into it
+#   blue/green  - index_documents into a new generation, validate, switch, GC the old one later
+# Reports how many retrievals came back empty or partial during each re-index and how long B
+# took to follow the switch. Checks that blue/green served only complete results, that both
+# workers end up on the new generation, that the old one is garbage-collected after the grace
+# period, and that a generation failing validation is discarded while the old one keeps serving.
+# Exits non-zero if a check fails.
+
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+_work_dir = tempfile.mkdtemp(prefix='bench-blue-green-')
+atexit.register(shutil.rmtree, _work_dir, True)
+os.environ["LEXICAL_INDEX_DIR"] = os.path.join(_work_dir, 'lexical_index')
+os.environ["INDEX_GENERATION_STATE_PATH"] = os.path.join(_work_dir, 'index_generation.json')
+os.environ["UPLOAD_ARCHIVE_DIR"] = os.path.join(_work_dir, 'uploads') # re-embedded by index_documents
+os.environ["PDF_PAGE_CACHE_DIR"] = os.path.join(_work_dir, 'pdf_pages')
+os.environ["INDEX_GENERATION_CHECK_SECONDS"] = "0.2"
+os.environ["INDEX_GENERATION_GC_GRACE_SECONDS"] = "1"
+os.environ["INDEX_GENERATION_VALIDATION_TIMEOUT_SECONDS"] = "1"
+
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+
+import index_generations
+import logging_setup
+import rag_service
+from benchmarks.fake_langchain import FakeChatOpenAI, FakePineconeRetriever
+from benchmarks.fakes import FakeOpenAIClient, build_fake_embedding_manager, build_fake_rag_service
+from benchmarks.synthetic_pdfs import build_pdf_bytes
+
+logging_setup.configure_logging(os.devnull)
+
+HISTORY = [{"sender": "user", "text": "Hi"}] # with history, so requests are not coalesced
+
+
+class RecordingRetriever(FakePineconeRetriever):
+    """Fake Pinecone retriever that records (worker, namespace, documents returned) per query."""
+    worker: str = ""
+    log: Any = None # shared list (a `list` field would be copied on validation)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = super()._get_relevant_documents(query, run_manager=run_manager)
+        self.log.append((time.monotonic(), self.worker, self.namespace, len(docs)))
+        return docs
+
+
+def _write_pdfs(directory, pdfs, pages, seed):
+    os.makedirs(directory)
+    for i in range(pdfs):
+        with open(os.path.join(directory, f"guide_{i}.pdf"), 'wb') as f:
+            f.write(build_pdf_bytes(num_pages=pages, seed=seed * 100 + i))
+    return directory
+
+
+def _build_worker(name, embedding_manager, log, watcher):
+    from pdf_processor import PDFProcessor
+    service = build_fake_rag_service(bedrock_ms=2, sagemaker_ms=0)
+    del service.qa_chain_rag # rebuilt by the real factory around the fakes
+    service.generation_watcher = watcher
+    service.pdf_processor = PDFProcessor()
+    service.embedding_manager = embedding_manager
+    service.llm_rag = FakeChatOpenAI(latency_ms=5)
+    service._generation_retriever = lambda generation: RecordingRetriever(
+        openai_client=FakeOpenAIClient(0), index=embedding_manager.index, namespace=generation.namespace, worker=name, log=log)
+    service.retriever = service._generation_retriever(service.active_generation)
+    return service
+
+
+class ChatLoad:
+    def __init__(self, workers, clients):
+        """Clients sending chat requests to the workers in turn until stop()."""
+        self.workers = workers
+        self.errors = []
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(clients)]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, client):
+        turn = client
+        while not self._stop.is_set():
+            worker = self.workers[turn % len(self.workers)]
+            turn += 1
+            try:
+                response = worker.generate_response("What should I do about ear mites?", HISTORY)
+                if response["data"].get("error_retrieving_details"):
+                    self.errors.append(response["data"]["error_retrieving_details"])
+            except Exception as e:
+                self.errors.append(repr(e))
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+
+def _window(log, start, end):
+    entries = [entry for entry in log if start <= entry[0] <= end]
+    incomplete = sum(1 for _, _, _, docs in entries if docs < 5)
+    return len(entries), incomplete
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-indexing under chat load: in place versus blue/green')
+    parser.add_argument('--pdfs', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--openai-ms', type=float, default=3, help='Latency of each fake embedding call')
+    args = parser.parse_args()
+    failures = 0
+
+    embedding_manager = build_fake_embedding_manager(openai_ms=args.openai_ms)
+    index = embedding_manager.index
+    log = []
+    worker_a = _build_worker("A", embedding_manager, log, index_generations.GenerationWatcher(check_seconds=0.2))
+    chunks = worker_a.index_documents(_write_pdfs(os.path.join(_work_dir, 'v1'), args.pdfs, args.pages, seed=1))
+    worker_b = _build_worker("B", embedding_manager, log, index_generations.GenerationWatcher(check_seconds=0.2))
+    first = index_generations.load_state()[0]
+    print(f"corpus: {chunks} chunks per version; initial generation '{first.name}'\n")
+
+    load = ChatLoad([worker_a, worker_b], args.clients)
+    time.sleep(0.3)
+
+    # The old flow: clear the serving namespace, then index into it.
+    rag_service.BLUE_GREEN_INDEXING = False
+    start = time.monotonic()
+    index.delete(delete_all=True, namespace=first.namespace)
+    worker_a.index_documents(_write_pdfs(os.path.join(_work_dir, 'v2'), args.pdfs, args.pages, seed=2))
+    in_place = (start, time.monotonic())
+    time.sleep(0.3)
+
+    rag_service.BLUE_GREEN_INDEXING = True
+    start = time.monotonic()
+    worker_a.index_documents(_write_pdfs(os.path.join(_work_dir, 'v3'), args.pdfs, args.pages, seed=3))
+    switched = time.monotonic()
+    second = index_generations.load_state()[0]
+    time.sleep(1.0)
+    load.stop()
+
+    followed = [at for at, worker, namespace, _ in log if worker == "B" and namespace == second.namespace]
+    print(f"{'re-index':<12} {'seconds':>8} {'retrievals':>11} {'empty/partial':>14}")
+    # Blue/green is counted until 1s after the switch, covering B's move to the new generation.
+    for label, (begin, end), window_end in (("in place", in_place, in_place[1]), ("blue/green", (start, switched), switched + 1.0)):
+        total, incomplete = _window(log, begin, window_end)
+        print(f"{label:<12} {end - begin:>8.2f} {total:>11} {incomplete:>14}")
+    lag = (followed[0] - switched) * 1000 if followed else float('nan')
+    print(f"\nworker B first served generation '{second.name}' {lag:.0f} ms after the switch "
+          f"(check interval {index_generations.GENERATION_CHECK_SECONDS * 1000:.0f} ms)")
+
+    total, incomplete = _window(log, start, switched + 1.0)
+    if incomplete or not total:
+        print(f"FAIL: {incomplete} of {total} retrievals during the blue/green re-index were empty or partial")
+        failures += 1
+    if load.errors:
+        print(f"FAIL: {len(load.errors)} chat request(s) failed, e.g. {load.errors[0]}")
+        failures += 1
+    if not followed or any(worker.__dict__.get('active_generation') != second for worker in (worker_a, worker_b)):
+        print("FAIL: the workers did not both switch to the new generation")
+        failures += 1
+
+    time.sleep(index_generations.GENERATION_GC_GRACE_SECONDS + 1.5)
+    if first.namespace in index.namespaces or os.path.exists(first.lexical_dir) or index_generations.load_state()[1]:
+        print(f"FAIL: retired generation '{first.name}' was not garbage-collected")
+        failures += 1
+
+    # A generation that loses vectors on the way in must not go live.
+    upsert = index.upsert
+    index.upsert = lambda vectors, namespace="", **kwargs: upsert(vectors[:-1], namespace=namespace, **kwargs)
+    try:
+        worker_a.index_documents(_write_pdfs(os.path.join(_work_dir, 'v4'), args.pdfs, args.pages, seed=4))
+        print("FAIL: a generation missing vectors was activated")
+        failures += 1
+    except index_generations.GenerationValidationError as e:
+        print(f"validation rejected a broken generation: {e}")
+    index.upsert = upsert
+    leftovers = [namespace for namespace in index.namespaces if namespace not in ("", second.namespace)]
+    if index_generations.load_state()[0] != second or leftovers:
+        print(f"FAIL: the broken generation changed the active one or was left behind ({leftovers})")
+        failures += 1
+
+    if failures:
+        sys.exit(1)
+    print("\nok: no empty or partial retrievals during blue/green, both workers switched, old generation collected, "
+          "broken generation discarded")
+
+
+if __name__ == "__main__":
+    main()
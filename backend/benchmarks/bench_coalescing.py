@@ -0,0 +1,141 @@
+# Concurrency check + benchmark: request coalescing of identical in-flight queries.
+#
+#   python -m benchmarks.bench_coalescing [--concurrency 50]
+#
+# Fires a burst of identical requests at the Flask app (threads) and the ASGI app (asyncio) and
+# counts the calls that reached the fake Bedrock, chain (OpenAI + Pinecone) and Amazon Location
+# backends. Exits non-zero if a burst of identical requests made more than one outbound call, or
+# if requests that must not be coalesced (with chat history, different tiles) were, or if the
+# requests joining a chat run whose user was rejected (429) got that rejection instead of an answer.
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+    os.environ[_key] = ""
+os.environ.setdefault("ADMISSION_CONTROL", "false") # one client far past the per-user limits
+
+import admission
+import app as flask_backend
+import asgi_app
+import metrics
+from benchmarks.fakes import FakeLocationClient, FakeQAChain, build_fake_rag_service
+
+FIRST_MESSAGE = "Is the new canine flu outbreak dangerous for my dog?"
+
+
+def _bodies(kind, concurrency):
+    if kind == "chat, identical first message":
+        # Same text modulo case/whitespace: normalised to one key.
+        return "/api/chat", [{"message": FIRST_MESSAGE if i % 2 else f"  {FIRST_MESSAGE.upper()} ", "chat_history": []} for i in range(concurrency)]
+    if kind == "chat, with history":
+        return "/api/chat", [{"message": FIRST_MESSAGE, "chat_history": [{"sender": "user", "text": f"My dog is {i} years old"}]} for i in range(concurrency)]
+    if kind == "find_vets, same tile":
+        return "/api/find_vets", [{"latitude": 37.7712 + i * 1e-5, "longitude": -122.4213} for i in range(concurrency)]
+    if kind == "find_vets, different tiles":
+        return "/api/find_vets", [{"latitude": 37.0 + i * 0.1, "longitude": -122.0} for i in range(concurrency)]
+    return "/api/search_vets_by_text", [{"query": "Springfield" if i % 2 else " springfield"} for i in range(concurrency)]
+
+
+CASES = (
+    # (kind, fake counter, expected outbound calls; None = one per request)
+    ("chat, identical first message", "chain", 1),
+    ("chat, with history", "chain", None),
+    ("find_vets, same tile", "location", 1),
+    ("find_vets, different tiles", "location", None),
+    ("search_vets_by_text, same query", "location", 1),
+)
+
+
+def _install_fakes(latency_ms):
+    service = build_fake_rag_service(bedrock_ms=latency_ms, chain_ms=latency_ms)
+    location_client = FakeLocationClient(latency_ms)
+    flask_backend.rag_service_instance = service
+    flask_backend.location_client = location_client
+    return {"chain": service.qa_chain_rag, "bedrock": service.bedrock_runtime_client, "location": location_client}
+
+
+class RejectFirstChain(FakeQAChain):
+    """Fake chain whose first run is rejected by admission control, as if its user were over the limits."""
+    def __init__(self, latency_ms):
+        super().__init__(latency_ms)
+        self._lock = threading.Lock()
+
+    def _result(self, inputs):
+        with self._lock:
+            self.calls += 1
+            if self.calls == 1:
+                raise admission.AdmissionRejected("Too many requests for this user.", retry_after=1)
+        return {"answer": f"Fake advice for: {inputs['question'][:50]}", "source_documents": []}
+
+
+def _burst_flask(path, bodies):
+    client = flask_backend.app.test_client()
+    barrier = threading.Barrier(len(bodies))
+
+    def one(body):
+        barrier.wait() # release all requests at once
+        return client.post(path, json=body).status_code
+
+    with ThreadPoolExecutor(max_workers=len(bodies)) as pool:
+        return list(pool.map(one, bodies))
+
+
+async def _burst_asgi(path, bodies):
+    client = asgi_app.app.test_client()
+
+    async def one(body):
+        return (await client.post(path, json=body)).status_code
+
+    return await asyncio.gather(*(one(body) for body in bodies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count outbound calls for bursts of identical requests')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=300)
+    args = parser.parse_args()
+
+    flask_backend.app.config['TESTING'] = True
+    asgi_app.app.config['TESTING'] = True
+    flask_backend.LOCATION_PLACE_INDEX_NAME = "bench-place-index"
+
+    failures = 0
+    for server, burst in (("flask", _burst_flask), ("asgi", lambda path, bodies: asyncio.run(_burst_asgi(path, bodies)))):
+        for kind, counter, expected in CASES:
+            fakes = _install_fakes(args.latency_ms)
+            path, bodies = _bodies(kind, args.concurrency)
+            start = time.perf_counter()
+            statuses = burst(path, bodies)
+            elapsed = time.perf_counter() - start
+            calls = fakes[counter].calls
+            expected_calls = args.concurrency if expected is None else expected
+            ok = calls == expected_calls and set(statuses) == {200}
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {server:<5} {kind:<32} {args.concurrency} requests -> {calls:>3} {counter} calls "
+                  f"(expected {expected_calls}), bedrock calls {fakes['bedrock'].calls:>3}, {elapsed * 1000:6.0f}ms")
+
+        # The run's own user is rejected (429); the requests that joined it run again and are answered.
+        fakes = _install_fakes(args.latency_ms)
+        chain = flask_backend.rag_service_instance.qa_chain_rag = RejectFirstChain(args.latency_ms)
+        statuses = burst(*_bodies("chat, identical first message", args.concurrency))
+        ok = sorted(statuses) == [200] * (args.concurrency - 1) + [429] and chain.calls == 2
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {server:<5} {'chat, first run rejected':<32} {args.concurrency} requests -> "
+              f"{statuses.count(429):>3} rejected, {chain.calls:>3} chain calls (expected 1 rejected, 2 calls)")
+
+    print()
+    print("\n".join(line for line in metrics.render_prometheus().splitlines() if "coalesce" in line and not line.startswith("#")))
+    if failures:
+        print(f"FAIL: {failures} case(s) made an unexpected number of outbound calls")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# Check + benchmark: hybrid BM25 + vector retrieval.
+#
+#   python -m benchmarks.bench_hybrid [--chunks 20000] [--repeats 20]
+#
+# Builds the lexical index over a synthetic corpus of veterinary-looking chunks into which two
+# fixed query sets are planted:
+#   rare terms  - chunks naming a drug or condition ("Carprofen is dosed at ..."); queried by name
+#   paraphrase  - chunks written in clinical terms ("pruritus", "emesis"); queried in plain words
+# The dense side is a fake: chunks and queries are embedded as bags of "concepts", where synonyms
+# share a concept and drug/condition names are out of vocabulary - the way general-purpose
+# embeddings blur rare terms. It stands in for Pinecone, so its recall numbers only illustrate
+# the failure mode; the lexical numbers and all latencies are real.
+#
+# Reports recall@5 per query set for vector, lexical and hybrid (RRF) retrieval, lexical query
+# latency, index size and build time. Then checks that with Pinecone failing the hybrid retriever
+# answers from the lexical index alone, and that RAGService.index_documents builds the index and
+# the chat chain picks it up. Exits non-zero if a check fails.
+
+import argparse
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+_work_dir = tempfile.mkdtemp(prefix='bench-lexical-')
+atexit.register(shutil.rmtree, _work_dir, True)
+os.environ["LEXICAL_INDEX_DIR"] = os.path.join(_work_dir, 'index')
+os.environ["INDEX_GENERATION_STATE_PATH"] = os.path.join(_work_dir, 'index_generation.json')
+os.environ["UPLOAD_ARCHIVE_DIR"] = os.path.join(_work_dir, 'uploads') # re-embedded by index_documents
+os.environ["PDF_PAGE_CACHE_DIR"] = os.path.join(_work_dir, 'pdf_pages')
+
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import lexical_index
+import logging_setup
+import metrics
+import rag_service
+from benchmarks.fake_langchain import FakeChatOpenAI, build_fake_retriever
+from benchmarks.fakes import FakeServiceError, build_fake_embedding_manager, build_fake_rag_service
+from benchmarks.synthetic_pdfs import build_pdf_bytes
+from hybrid_retriever import HybridRetriever
+from lexical_index import LexicalIndex, build_lexical_index
+
+logging_setup.configure_logging(os.devnull)
+
+COMMON_WORDS = (
+    "dog cat puppy kitten pet owner skin coat ear eye paw tail appetite weight diet water food "
+    "vet clinic visit exam blood test treatment medication dose daily week month symptoms signs "
+    "mild severe chronic acute monitor rest walk exercise vaccine parasite flea tick worm"
+).split()
+
+# (name, planted sentence, query)
+RARE_TERMS = [
+    ("carprofen", "Carprofen is dosed at 4.4 mg per kg once daily with food.", "carprofen dose for my dog"),
+    ("meloxicam", "Meloxicam oral suspension is given once daily after an initial loading dose.", "how much meloxicam"),
+    ("demodicosis", "Generalised demodicosis in young dogs needs months of treatment.", "is demodicosis curable"),
+    ("apoquel", "Apoquel (oclacitinib) controls allergic itch within a day.", "apoquel side effects"),
+    ("pyometra", "Pyometra is a uterine infection of intact females and an emergency.", "signs of pyometra"),
+    ("leptospirosis", "Leptospirosis spreads through water contaminated by rodent urine.", "leptospirosis risk for my dog"),
+    ("gabapentin", "Gabapentin is often prescribed to cats before stressful visits.", "gabapentin for cats before vet visit"),
+    ("bravecto", "Bravecto chews protect against fleas and ticks for twelve weeks.", "how long does bravecto last"),
+    ("cytopoint", "Cytopoint injections relieve atopic dermatitis for four to eight weeks.", "cytopoint injection"),
+    ("giardia", "Giardia cysts survive for weeks in cold water and cause soft stool.", "giardia in puppies"),
+    ("hyperthyroidism", "Hyperthyroidism in older cats causes weight loss despite a good appetite.", "hyperthyroidism cat"),
+    ("parvovirus", "Parvovirus attacks the gut lining of unvaccinated puppies.", "parvovirus puppy"),
+]
+
+# Clinical term -> plain concept; the chunk uses the clinical terms, the query the plain ones.
+SYNONYMS = {
+    "pruritus": "itching", "itching": "itching", "itchy": "itching",
+    "excoriation": "scratching", "scratching": "scratching", "scratches": "scratching",
+    "alopecia": "hairloss", "bald": "hairloss", "hairless": "hairloss",
+    "emesis": "vomiting", "vomiting": "vomiting", "throwing": "vomiting",
+    "pyrexia": "fever", "fever": "fever", "hot": "fever",
+    "inappetence": "notEating", "anorexia": "notEating", "eating": "notEating",
+    "lethargy": "tired", "tired": "tired", "sleepy": "tired",
+    "polydipsia": "thirst", "thirsty": "thirst", "drinking": "thirst",
+    "dyspnea": "breathing", "breathing": "breathing", "panting": "breathing",
+    "otitis": "earpain", "earache": "earpain",
+    "halitosis": "breath", "smelly": "breath",
+    "lameness": "limping", "limping": "limping", "limps": "limping",
+}
+
+PARAPHRASES = [
+    ("Pruritus with excoriation and patchy alopecia suggests mites.", "itchy and scratches, going bald"),
+    ("Emesis with pyrexia after a diet change should be assessed.", "throwing up and hot"),
+    ("Inappetence and lethargy lasting over two days need an exam.", "not eating and sleepy"),
+    ("Polydipsia may point to kidney disease or diabetes.", "always thirsty and drinking"),
+    ("Dyspnea at rest is an emergency.", "weird breathing and panting"),
+    ("Otitis externa presents with head shaking.", "earache"),
+    ("Halitosis usually reflects periodontal disease.", "smelly breath"),
+    ("Lameness after exercise may indicate a cruciate tear.", "limping after walk"),
+]
+
+CONCEPTS = sorted(set(COMMON_WORDS) | set(SYNONYMS.values()))
+CONCEPT_INDEX = {concept: i for i, concept in enumerate(CONCEPTS)}
+
+
+def _concept_vector(text):
+    vector = np.zeros(len(CONCEPTS), dtype=np.float32)
+    for token in lexical_index._TOKEN_RE.findall(text.lower()):
+        concept = SYNONYMS.get(token, token)
+        if concept in CONCEPT_INDEX:
+            vector[CONCEPT_INDEX[concept]] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ConceptRetriever(BaseRetriever):
+    """Dense-retrieval stand-in: cosine similarity of concept bags (see the header)."""
+    matrix: Any
+    documents: List[Document]
+    k: int = 5
+    fail: bool = False
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.fail:
+            raise FakeServiceError("pinecone unavailable")
+        scores = self.matrix @ _concept_vector(query)
+        best = np.argsort(scores)[::-1][:self.k]
+        return [self.documents[i] for i in best]
+
+
+def _build_corpus(num_chunks, seed=0):
+    """Returns (documents, [(query, relevant text, query set)])."""
+    rng = random.Random(seed)
+    documents = [
+        Document(page_content=" ".join(rng.choice(COMMON_WORDS) for _ in range(rng.randint(60, 160))),
+                 metadata={"source": f"bench_{i // 50}.pdf", "page": i % 50})
+        for i in range(num_chunks)
+    ]
+    queries = []
+    planted = rng.sample(range(num_chunks), len(RARE_TERMS) + len(PARAPHRASES))
+    for number, (_, sentence, query) in zip(planted, RARE_TERMS):
+        documents[number].page_content = f"{documents[number].page_content} {sentence}"
+        queries.append((query, documents[number].page_content, "rare terms"))
+    for number, (sentence, query) in zip(planted[len(RARE_TERMS):], PARAPHRASES):
+        documents[number].page_content = f"{sentence} {documents[number].page_content[:200]}"
+        queries.append((query, documents[number].page_content, "paraphrase"))
+    return documents, queries
+
+
+def _recall(retrieve, queries):
+    by_set = {}
+    for query, relevant, query_set in queries:
+        hits = by_set.setdefault(query_set, [])
+        hits.append(any(doc.page_content == relevant for doc in retrieve(query)))
+    return {query_set: sum(hits) / len(hits) for query_set, hits in by_set.items()}
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def _check_service(work_dir, failures):
+    # index_documents -> lexical index on disk -> chain rebuilt around a HybridRetriever
+    pdf_dir = os.path.join(work_dir, 'pdfs')
+    os.makedirs(pdf_dir)
+    for i in range(2):
+        with open(os.path.join(pdf_dir, f"guide_{i}.pdf"), 'wb') as f:
+            f.write(build_pdf_bytes(num_pages=4, seed=i))
+    service = build_fake_rag_service(bedrock_ms=0, sagemaker_ms=0)
+    from pdf_processor import PDFProcessor
+    service.pdf_processor = PDFProcessor()
+    service.embedding_manager = build_fake_embedding_manager()
+    service.llm_rag = FakeChatOpenAI(latency_ms=0)
+    # The chain switches to the new index generation with a Pinecone retriever that always fails.
+    service._generation_retriever = lambda generation: build_fake_retriever(embedding_ms=0, pinecone_ms=0, pinecone_failure_rate=1.0)
+    indexed = service.index_documents(pdf_dir)
+    index = service.lexical_index
+    if index is None or index.num_docs != indexed:
+        print(f"FAIL: index_documents upserted {indexed} chunks but the lexical index has {index and index.num_docs}")
+        return failures + 1
+    if not isinstance(service.qa_chain_rag.retriever, HybridRetriever):
+        print("FAIL: the chat chain was not rebuilt around the hybrid retriever")
+        failures += 1
+    # Pinecone fails every call: the chat must still answer, from the lexical index.
+    rag_service.RETRIEVAL_BREAKER.reset()
+    response = service.generate_response("demodicosis treatment for my dog", [{"sender": "user", "text": "Hi"}])
+    if response["data"].get("error_retrieving_details") or not metrics.REGISTRY.counter_value("hybrid_retrievals_total", mode="lexical_only"):
+        print(f"FAIL: with Pinecone down the chat did not answer from the lexical index: {response}")
+        failures += 1
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hybrid BM25 + vector retrieval: recall and latency')
+    parser.add_argument('--chunks', type=int, default=20000)
+    parser.add_argument('--repeats', type=int, default=20, help='Timed passes over the query set')
+    args = parser.parse_args()
+    failures = 0
+
+    documents, queries = _build_corpus(args.chunks)
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_dir = os.path.join(work_dir, 'lexical')
+        start = time.perf_counter()
+        build_lexical_index(documents, index_dir)
+        build_seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir))
+        start = time.perf_counter()
+        index = LexicalIndex(index_dir)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        vector = ConceptRetriever(matrix=np.stack([_concept_vector(doc.page_content) for doc in documents]), documents=documents)
+        hybrid = HybridRetriever(vector=vector, lexical=index, k=5)
+        retrievers = {
+            "vector (fake)": lambda q: vector.invoke(q),
+            "lexical": lambda q: [index.document(n) for n, _ in index.search(q, 5)],
+            "hybrid (RRF)": lambda q: hybrid.invoke(q),
+        }
+
+        print(f"corpus: {args.chunks} chunks, {len(queries)} queries; index built in {build_seconds:.2f}s, "
+              f"{size / 2 ** 20:.1f} MiB on disk, opened in {load_ms:.1f} ms\n")
+        print(f"{'retriever':<15} {'recall@5 rare terms':>20} {'recall@5 paraphrase':>20}")
+        recalls = {}
+        for label, retrieve in retrievers.items():
+            recalls[label] = _recall(retrieve, queries)
+            print(f"{label:<15} {recalls[label]['rare terms']:>20.2f} {recalls[label]['paraphrase']:>20.2f}")
+
+        latencies = []
+        for _ in range(args.repeats):
+            for query, _, _ in queries:
+                start = time.perf_counter()
+                index.search(query, 10)
+                latencies.append(time.perf_counter() - start)
+        print(f"\nlexical search: p50 {_percentile(latencies, 50) * 1000:.2f} ms, p99 {_percentile(latencies, 99) * 1000:.2f} ms "
+              f"over {len(latencies)} queries")
+
+        hybrid_recall = recalls["hybrid (RRF)"]
+        if hybrid_recall["rare terms"] < recalls["lexical"]["rare terms"] or hybrid_recall["paraphrase"] < recalls["vector (fake)"]["paraphrase"]:
+            print("FAIL: fusion lost results that one of its inputs found")
+            failures += 1
+
+        vector.fail = True
+        fallback = _recall(lambda q: hybrid.invoke(q), [q for q in queries if q[2] == "rare terms"])
+        print(f"hybrid with vector retrieval failing: recall@5 rare terms {fallback['rare terms']:.2f}")
+        if fallback["rare terms"] < recalls["lexical"]["rare terms"]:
+            print("FAIL: the hybrid retriever did not fall back to the lexical results")
+            failures += 1
+        index.close()
+
+        failures = _check_service(work_dir, failures)
+
+    if failures:
+        sys.exit(1)
+    print("\nok: fusion keeps both inputs' hits, lexical-only fallback and index_documents integration checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Benchmark: cost of logging on the indexing hot path (EmbeddingManager.upsert_documents).
+#
+#   python -m benchmarks.bench_logging [--chunks 5000]
+#
+# Each mode runs the real upsert loop against in-memory OpenAI/Pinecone fakes, so the measured
+# time is the loop itself plus logging:
+#   off            - root at WARNING
+#   sync-debug     - DEBUG written synchronously to a file and the console, every chunk logged
+#                    (the previous setup)
+#   queued-info    - INFO through the QueueHandler/listener pipeline (the new default)
+#   queued-debug   - DEBUG through the queue, per-chunk records sampled 1 in LOG_CHUNK_SAMPLE_EVERY
+
+import argparse
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from langchain_core.documents import Document
+
+import embedding_manager
+import logging_setup
+from benchmarks.fakes import build_fake_embedding_manager
+
+
+def _reset_root():
+    logging_setup.stop_listener()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    return root
+
+
+def _configure(mode, log_file):
+    root = _reset_root()
+    console = io.StringIO() # stands in for stderr so the benchmark output stays readable
+    if mode == "off":
+        root.setLevel(logging.WARNING)
+        root.addHandler(logging.StreamHandler(console))
+    elif mode == "sync-debug":
+        embedding_manager._sample_embedding_debug = logging_setup.EveryNth(1)
+        formatter = logging.Formatter(logging_setup.LOG_FORMAT)
+        for handler in (logging.FileHandler(log_file, encoding='utf-8'), logging.StreamHandler(console)):
+            handler.setFormatter(formatter)
+            root.addHandler(handler)
+        root.setLevel(logging.DEBUG)
+    else:
+        os.environ["LOG_LEVEL"] = "DEBUG" if mode == "queued-debug" else "INFO"
+        embedding_manager._sample_embedding_debug = logging_setup.EveryNth(logging_setup.CHUNK_LOG_SAMPLE_EVERY)
+        logging_setup.configure_logging(log_file)
+        for handler in logging_setup._handlers:
+            if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+                handler.setStream(console)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure logging overhead on the indexing loop')
+    parser.add_argument('--chunks', type=int, default=5000)
+    args = parser.parse_args()
+
+    documents = [Document(page_content=f"Chunk {i}: " + "lorem ipsum dolor sit amet " * 30,
+                          metadata={"source": "bench.pdf", "page": i // 5}) for i in range(args.chunks)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ("off", "sync-debug", "queued-info", "queued-debug"):
+            _configure(mode, os.path.join(tmp_dir, f"{mode}.log"))
+            manager = build_fake_embedding_manager()
+            start = time.perf_counter()
+            manager.upsert_documents(documents)
+            elapsed = time.perf_counter() - start # time the caller is blocked; the listener drains afterwards
+            logging_setup.stop_listener()
+            results[mode] = elapsed
+        _reset_root()
+    os.environ.pop("LOG_LEVEL", None)
+
+    baseline = results["off"]
+    for mode, elapsed in results.items():
+        print(f"{mode:<13} {args.chunks / elapsed:>10.0f} chunks/s  ({elapsed * 1000:.0f}ms, {elapsed / baseline:.2f}x off)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
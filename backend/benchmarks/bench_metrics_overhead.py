@@ -0,0 +1,66 @@
+# Benchmark + guard: per-request cost of the stage instrumentation.
+#
+#   python -m benchmarks.bench_metrics_overhead [--iterations 20000] [--max-us 50]
+#
+# Replays what one image /api/chat records (auth, whole request, Bedrock, SageMaker, the three
+# chain callbacks, one cache lookup) and exits non-zero if the cost exceeds --max-us per request.
+
+import argparse
+import sys
+import time
+import uuid
+
+import metrics
+from chain_metrics import StageTimingCallbackHandler
+
+
+def _one_request(registry, handler, run_ids):
+    with metrics.StageTimer(registry, "cognito_auth"):
+        pass
+    with metrics.StageTimer(registry, "chat_generate_response"):
+        with metrics.StageTimer(registry, "bedrock_classification"):
+            pass
+        with metrics.StageTimer(registry, "sagemaker_analysis"):
+            pass
+        rewrite_id, retrieval_id, generation_id = run_ids
+        handler.on_chat_model_start(None, [], run_id=rewrite_id, tags=["question_rewrite"])
+        handler.on_llm_end(None, run_id=rewrite_id)
+        handler.on_retriever_start(None, "q", run_id=retrieval_id)
+        handler.on_retriever_end([], run_id=retrieval_id)
+        handler.on_chat_model_start(None, [], run_id=generation_id, tags=None)
+        handler.on_llm_end(None, run_id=generation_id)
+    registry.record_cache("pdf_page_cache", hit=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure metrics overhead per chat request')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--max-us', type=float, default=50.0, help='Fail if overhead per request exceeds this')
+    args = parser.parse_args()
+
+    registry = metrics.MetricsRegistry()
+    metrics.REGISTRY = registry # the callback handler records into the module registry
+    handler = StageTimingCallbackHandler()
+    run_ids = [tuple(uuid.uuid4() for _ in range(3)) for _ in range(args.iterations)]
+
+    for ids in run_ids[:1000]: # warm-up
+        _one_request(registry, handler, ids)
+    start = time.perf_counter()
+    for ids in run_ids:
+        _one_request(registry, handler, ids)
+    per_request_us = (time.perf_counter() - start) / args.iterations * 1e6
+
+    render_start = time.perf_counter()
+    registry.render_prometheus()
+    render_ms = (time.perf_counter() - render_start) * 1000
+
+    print(f"instrumentation overhead: {per_request_us:.2f}us per request (bound {args.max_us}us)")
+    print(f"/metrics render: {render_ms:.2f}ms")
+    if per_request_us > args.max_us:
+        print("FAIL: metrics overhead exceeds bound")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Check + benchmark: on-demand per-request profiling of /api/chat.
+#
+#   python -m benchmarks.bench_profiling [--requests 30]
+#
+# Sends chat requests through the Flask app (real chain with a fake LLM and fake Pinecone
+# retriever, zero-latency Bedrock/SageMaker fakes) with PROFILE_REQUEST_TOKEN set and the profiles
+# written to a temporary directory. Reports the latency of plain and profiled requests and the
+# hottest functions of one profile. Checks that only requests with the right token (or picked by
+# the sample rate) are profiled, that the profile covers the chain's pool threads, that the
+# .prof/.json files carry the request ID and old ones are pruned, that the summary endpoint needs
+# the token, and that with profiling not configured the views are not wrapped.
+# Exits non-zero if a check fails.
+
+import argparse
+import atexit
+import os
+import pstats
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+_work_dir = tempfile.mkdtemp(prefix='bench-profiling-')
+atexit.register(shutil.rmtree, _work_dir, True)
+os.environ["INDEX_GENERATION_STATE_PATH"] = os.path.join(_work_dir, 'index_generation.json')
+os.environ["PROFILE_DIR"] = os.path.join(_work_dir, 'logs')
+os.environ["PROFILE_REQUEST_TOKEN"] = "bench-profile-token"
+os.environ["PROFILE_SAMPLE_RATE"] = "0"
+
+import app as flask_backend
+import request_profiler
+from benchmarks.fake_langchain import FakeChatOpenAI, build_fake_retriever
+from benchmarks.fakes import build_fake_rag_service
+
+TOKEN = os.environ["PROFILE_REQUEST_TOKEN"]
+HISTORY = [{"sender": "ai", "text": "Hello! I'm PetHealth AI. How can I help you and your pet today?"},
+           {"sender": "user", "text": "Hi"}] # with history, so requests are not coalesced
+
+
+def _install():
+    service = build_fake_rag_service(bedrock_ms=0, sagemaker_ms=0)
+    del service.qa_chain_rag # rebuilt by the real factory around the fakes
+    service.llm_rag = FakeChatOpenAI(latency_ms=2)
+    service.retriever = build_fake_retriever(embedding_ms=2, pinecone_ms=2)
+    service.lexical_index = None
+    flask_backend.rag_service_instance = service
+
+
+def _chat(client, headers=None):
+    start = time.perf_counter()
+    response = client.post("/api/chat", json={"message": "My dog keeps scratching his ears", "chat_history": HISTORY},
+                           headers=headers or {})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.get_data()
+    return response, elapsed
+
+
+def _profiles():
+    directory = request_profiler.PROFILE_DIR
+    return sorted(name for name in os.listdir(directory) if name.endswith('.prof')) if os.path.isdir(directory) else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-request profiling of /api/chat')
+    parser.add_argument('--requests', type=int, default=30)
+    args = parser.parse_args()
+    failures = 0
+
+    flask_backend.app.config['TESTING'] = True
+    client = flask_backend.app.test_client()
+    _install()
+    _chat(client) # builds the chain
+
+    plain = [_chat(client)[1] for _ in range(args.requests)]
+    wrong = [_chat(client, {request_profiler.PROFILE_HEADER: "guess"}) for _ in range(3)]
+    if _profiles() or any(request_profiler.REQUEST_ID_HEADER in response.headers for response, _ in wrong):
+        print(f"FAIL: requests without the right token were profiled: {_profiles()}")
+        failures += 1
+
+    profiled = []
+    for i in range(args.requests):
+        response, elapsed = _chat(client, {request_profiler.PROFILE_HEADER: TOKEN, request_profiler.REQUEST_ID_HEADER: f"bench-{i}"})
+        profiled.append(elapsed)
+        if response.headers.get(request_profiler.REQUEST_ID_HEADER) != f"bench-{i}":
+            print(f"FAIL: profiled response carries X-Request-ID {response.headers.get(request_profiler.REQUEST_ID_HEADER)!r}")
+            failures += 1
+            break
+
+    print(f"{'requests':<10} {'median ms':>10} {'p90 ms':>8}")
+    for label, times in (("plain", plain), ("profiled", profiled)):
+        print(f"{label:<10} {statistics.median(times) * 1000:>10.2f} {statistics.quantiles(times, n=10)[-1] * 1000:>8.2f}")
+
+    last = f"bench-{args.requests - 1}"
+    base = os.path.join(request_profiler.PROFILE_DIR, f"profile-chat-{last}")
+    summary = client.get(f"/api/profiles/chat/{last}", headers={request_profiler.PROFILE_HEADER: TOKEN}).get_json()
+    if not os.path.exists(f"{base}.prof") or not os.path.exists(f"{base}.json") or not summary:
+        print(f"FAIL: no profile files or summary for request {last}")
+        failures += 1
+    else:
+        print(f"\nrequest {last}: {summary['wall_ms']:.1f} ms wall, {summary['threads']} thread(s); top functions by self time:")
+        for row in summary["top_functions"][:8]:
+            print(f"  {row['self_ms']:>8.3f} ms  {row['calls']:>6}  {row['function']}")
+        stats = pstats.Stats(f"{base}.prof")
+        names = {name for _, _, name in stats.stats}
+        # The answer LLM runs on a resilience pool thread; the JSON parsing in the request thread.
+        if summary["threads"] < 2 or "_generate" not in names or "chat_endpoint" not in names:
+            print(f"FAIL: the profile does not cover both the request thread and the chain's pool thread ({summary['threads']} threads)")
+            failures += 1
+    if client.get(f"/api/profiles/chat/{last}").status_code != 404:
+        print("FAIL: the profile summary was served without the token")
+        failures += 1
+
+    request_profiler.PROFILE_MAX_FILES = 5
+    request_profiler.PROFILE_SAMPLE_RATE = 1.0
+    response, _ = _chat(client)
+    request_profiler.PROFILE_SAMPLE_RATE = 0.0
+    sampled_id = response.headers.get(request_profiler.REQUEST_ID_HEADER)
+    if not sampled_id or f"profile-chat-{sampled_id}.prof" not in _profiles():
+        print("FAIL: a request picked by the sample rate was not profiled")
+        failures += 1
+    if len(_profiles()) != 5:
+        print(f"FAIL: {len(_profiles())} profiles kept, expected PROFILE_MAX_FILES=5")
+        failures += 1
+
+    request_profiler.PROFILING_ENABLED = False
+    view = lambda: None
+    if flask_backend.profiled("chat")(view) is not view:
+        print("FAIL: with profiling not configured the view is still wrapped")
+        failures += 1
+
+    if failures:
+        sys.exit(1)
+    print("\nok: token/sample gating, pool threads covered, request-ID files pruned, summary needs the token, "
+          "unwrapped when disabled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# Check + benchmark: prompt layout and provider-side prefix caching.
+#
+#   python -m benchmarks.bench_prompt_cache [--conversations 4] [--turns 8] [--answer-chars 1200]
+#
+# Plays several conversations through the real ConversationalRetrievalChain (fake LLM, fake
+# retriever returning different chunks per question) with the current prompt layout and with the
+# previous one (context before chat history). The fake LLM records every prompt and simulates
+# OpenAI's prefix cache (~4 characters per token, cached from 1024 tokens on, in 128-token steps):
+# it reports the longest prefix shared with an earlier prompt as cached tokens in the response's
+# usage metadata, the way the API does. Reports the shared prefix and the cache hit rate of both
+# layouts, and checks that the answer prompts of every request start with the byte-identical
+# RAG_PROMPT_INSTRUCTIONS, that a turn's prompt starts with the previous turn's history, and that
+# the cached/uncached tokens reach llm_prompt_tokens_total and the per-request usage.
+# Exits non-zero if a check fails.
+
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+_work_dir = tempfile.mkdtemp(prefix='bench-prompt-cache-')
+atexit.register(shutil.rmtree, _work_dir, True)
+os.environ["INDEX_GENERATION_STATE_PATH"] = os.path.join(_work_dir, 'index_generation.json')
+
+import zlib
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.retrievers import BaseRetriever
+
+import chain_metrics
+import logging_setup
+import metrics
+import rag_service
+from benchmarks.fake_langchain import FakeChatOpenAI
+from benchmarks.fakes import build_fake_rag_service
+
+logging_setup.configure_logging(os.devnull)
+
+# The layout before prompts were ordered for caching: retrieved context ahead of the chat history.
+PREVIOUS_RAG_PROMPT_TEMPLATE = rag_service.RAG_PROMPT_INSTRUCTIONS + """Retrieved Context from documents:
+{context}
+
+Chat History:
+{chat_history}
+
+Human's Question:
+{question}
+
+PetHealth AI's Non-Urgent Advice (synthesizing all available information):"""
+
+CHARS_PER_TOKEN = 4
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+
+TOPICS = ["ear mites", "itchy skin", "vomiting", "limping", "bad breath", "hair loss", "weight gain", "sneezing"]
+
+
+class PrefixCache:
+    def __init__(self):
+        """Simulated provider prompt cache: every prompt seen is cached, lookups find the longest shared prefix."""
+        self.prompts = []
+
+    def lookup(self, prompt):
+        """Returns: (cached tokens, prompt tokens) as the API would report them."""
+        tokens = -(-len(prompt) // CHARS_PER_TOKEN)
+        shared = max((len(os.path.commonprefix([prompt, seen])) for seen in self.prompts), default=0)
+        self.prompts.append(prompt)
+        shared_tokens = shared // CHARS_PER_TOKEN
+        if shared_tokens < CACHE_MIN_TOKENS:
+            return 0, tokens
+        return CACHE_MIN_TOKENS + (shared_tokens - CACHE_MIN_TOKENS) // CACHE_STEP_TOKENS * CACHE_STEP_TOKENS, tokens
+
+
+class CachingChatModel(FakeChatOpenAI):
+    """Zero-latency chat model that records answer prompts and reports simulated prefix-cache usage."""
+    prefix_cache: Any = None # shared with the tagged condense copy (model_copy is shallow)
+    prompts: Any = None
+    answer_chars: int = 1200
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        cached, tokens = self.prefix_cache.lookup(prompt)
+        if self.tags and chain_metrics.QUESTION_REWRITE_TAG in self.tags:
+            answer = "Standalone question: " + prompt.rsplit("Follow Up Input:", 1)[-1].split("\n")[0].strip()
+        else:
+            self.prompts.append(prompt)
+            answer = f"Advice {len(self.prompts)}: " + "keep an eye on your pet and consult a veterinarian. " * (self.answer_chars // 52)
+        message = AIMessage(content=answer, usage_metadata={
+            "input_tokens": tokens, "output_tokens": len(answer) // CHARS_PER_TOKEN,
+            "total_tokens": tokens + len(answer) // CHARS_PER_TOKEN, "input_token_details": {"cache_read": cached}})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class ChunkRetriever(BaseRetriever):
+    """Returns five of 40 chunks picked by the question, so the context changes from turn to turn."""
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        first = zlib.crc32(query.encode()) % 40
+        return [Document(page_content=f"Chunk {(first + i) % 40}: " + f"veterinary guidance on {TOPICS[(first + i) % len(TOPICS)]}. " * 12,
+                         metadata={"source": "bench.pdf", "page": (first + i) % 40}) for i in range(5)]
+
+
+def _play(template, conversations, turns, answer_chars):
+    """Returns (answer prompts per conversation, cached tokens, prompt tokens, per-request usages)."""
+    rag_service.RAG_PROMPT_TEMPLATE = template
+    service = build_fake_rag_service(bedrock_ms=0, sagemaker_ms=0)
+    del service.qa_chain_rag # rebuilt by the real factory around the fakes
+    service.llm_rag = CachingChatModel(latency_ms=0, prefix_cache=PrefixCache(), prompts=[], answer_chars=answer_chars)
+    service.retriever = ChunkRetriever()
+    service.lexical_index = None
+    usages = []
+    log_prompt_usage = service._log_prompt_usage
+    service._log_prompt_usage = lambda usage: (usages.append(usage), log_prompt_usage(usage))
+
+    per_conversation = []
+    for conversation in range(conversations):
+        history = [{"sender": "ai", "text": "Hello! I'm PetHealth AI. How can I help you and your pet today?"}]
+        start = len(service.llm_rag.prompts)
+        for turn in range(turns):
+            question = f"My pet has {TOPICS[(conversation + turn) % len(TOPICS)]}, day {turn} - what should I do?"
+            response = service.generate_response(question, history)
+            history += [{"sender": "user", "text": question}, {"sender": "ai", "text": response["response"]}]
+        per_conversation.append(service.llm_rag.prompts[start:])
+    cached = sum(usage.cached for usage in usages)
+    total = sum(usage.total for usage in usages)
+    return per_conversation, cached, total, usages
+
+
+def _mean_shared_prefix(per_conversation):
+    """Mean characters each answer prompt shares with the conversation's previous one."""
+    shared = [len(os.path.commonprefix([previous, prompt]))
+              for prompts in per_conversation for previous, prompt in zip(prompts, prompts[1:])]
+    return sum(shared) / len(shared) if shared else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prompt layout versus provider prefix caching')
+    parser.add_argument('--conversations', type=int, default=4)
+    parser.add_argument('--turns', type=int, default=8)
+    parser.add_argument('--answer-chars', type=int, default=1200)
+    args = parser.parse_args()
+    failures = 0
+    current_template = rag_service.RAG_PROMPT_TEMPLATE
+
+    results = {}
+    for label, template in (("previous", PREVIOUS_RAG_PROMPT_TEMPLATE), ("current", current_template)):
+        before = {cache: metrics.REGISTRY.counter_value("llm_prompt_tokens_total", stage="llm_generation", cache=cache) for cache in ("hit", "miss")}
+        per_conversation, cached, total, usages = _play(template, args.conversations, args.turns, args.answer_chars)
+        counted = {cache: metrics.REGISTRY.counter_value("llm_prompt_tokens_total", stage="llm_generation", cache=cache) - before[cache]
+                   for cache in ("hit", "miss")}
+        results[label] = (per_conversation, cached, total, usages, counted)
+    rag_service.RAG_PROMPT_TEMPLATE = current_template
+
+    print(f"{args.conversations} conversations x {args.turns} turns, {args.answer_chars}-character answers\n")
+    print(f"{'layout':<10} {'shared prefix (chars)':>22} {'prompt tokens':>14} {'cached':>10} {'hit rate':>9}")
+    for label, (per_conversation, cached, total, _, _) in results.items():
+        print(f"{label:<10} {_mean_shared_prefix(per_conversation):>22.0f} {total:>14} {cached:>10} {cached / total:>9.1%}")
+
+    per_conversation, cached, total, usages, counted = results["current"]
+    prompts = [prompt for conversation in per_conversation for prompt in conversation]
+    if not all(prompt.startswith(rag_service.RAG_PROMPT_INSTRUCTIONS) for prompt in prompts) or "{" in rag_service.RAG_PROMPT_INSTRUCTIONS:
+        print("FAIL: answer prompts do not all start with the byte-identical static instructions")
+        failures += 1
+    for conversation in per_conversation:
+        for previous, prompt in zip(conversation, conversation[1:]):
+            history_end = previous.index("Retrieved Context from documents:")
+            # The previous turn's history, without its trailing newline, is a prefix of this turn's prompt.
+            if not prompt.startswith(previous[:history_end].rstrip("\n")):
+                print("FAIL: a turn's prompt does not start with the previous turn's instructions and history")
+                failures += 1
+                break
+    if cached <= results["previous"][1]:
+        print(f"FAIL: the current layout cached {cached} tokens, no more than the previous layout's {results['previous'][1]}")
+        failures += 1
+    if len(usages) != args.conversations * args.turns or any(usage.calls < 1 for usage in usages):
+        print("FAIL: per-request prompt usage was not recorded for every request")
+        failures += 1
+    answer_cached = counted["hit"]
+    if answer_cached + counted["miss"] <= 0 or answer_cached > cached:
+        print(f"FAIL: llm_prompt_tokens_total does not match the reported usage ({counted})")
+        failures += 1
+
+    if failures:
+        sys.exit(1)
+    print("\nok: static instructions byte-identical, history kept ahead of per-turn content, cached tokens counted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Benchmark: chat tail latency with slow, failing and hung dependencies.
+#
+#   python -m benchmarks.bench_resilience [--requests 200] [--concurrency 8]
+#
+# Runs RAGService.generate_response (real ConversationalRetrievalChain over fake OpenAI/Pinecone)
+# against fakes whose latency has a slow tail, or that fail or hang, and reports p50/p99 plus the
+# outbound call counts:
+#   slow tail, no hedging   - 2% of Bedrock and Pinecone calls take --slow-ms
+#   slow tail, hedged       - same, with hedging at the observed p95
+#   Bedrock failing         - every call fails after its normal latency; the breaker opens
+#   Bedrock hung            - calls never return in time; deadline + breaker bound the wait
+# Exits non-zero if the hedged p99 is not below the unhedged one, the retrieval hedge threshold
+# does not follow single Pinecone attempts (pinecone_query), or a broken Bedrock is not skipped
+# by the breaker.
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+import logging_setup
+import metrics
+import rag_service
+from benchmarks.fake_langchain import FakeChatOpenAI, build_fake_retriever
+from benchmarks.fakes import build_fake_rag_service
+
+logging_setup.configure_logging(os.devnull)
+
+MESSAGE = "My dog keeps scratching his ear"
+HISTORY = [{"sender": "user", "text": "Hi"}] # with history, so requests are not coalesced
+
+
+def _build_service(args):
+    service = build_fake_rag_service(bedrock_ms=args.bedrock_ms)
+    del service.qa_chain_rag # rebuilt by the real factory around the fake LLM and retriever
+    service.llm_rag = FakeChatOpenAI(latency_ms=args.openai_ms)
+    service.retriever = build_fake_retriever(embedding_ms=0, pinecone_ms=args.pinecone_ms)
+    return service
+
+
+def _reset():
+    metrics.REGISTRY.reset()
+    for breaker in (rag_service.BEDROCK_BREAKER, rag_service.SAGEMAKER_BREAKER, rag_service.RETRIEVAL_BREAKER, rag_service.RAG_CHAIN_BREAKER):
+        breaker.reset()
+
+
+def _run(service, requests, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        response = service.generate_response(MESSAGE, HISTORY)
+        return time.perf_counter() - start, response
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    latencies = sorted(latency for latency, _ in results)
+    degraded = sum(1 for _, response in results if response["data"].get("error_retrieving_details"))
+    return latencies, degraded
+
+
+def _p(latencies, pct):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chat tail latency with slow/failing dependencies')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--bedrock-ms', type=float, default=100)
+    parser.add_argument('--pinecone-ms', type=float, default=50)
+    parser.add_argument('--openai-ms', type=float, default=100)
+    parser.add_argument('--slow-ms', type=float, default=2000)
+    parser.add_argument('--slow-rate', type=float, default=0.02, help='Share of slow calls; keep it below 1 - HEDGE_QUANTILE')
+    args = parser.parse_args()
+
+    rows, failures = [], 0
+    hedge_policies = (rag_service.CLASSIFICATION_HEDGE, rag_service.RETRIEVAL_HEDGE)
+    default_min_delays = [policy.min_delay for policy in hedge_policies]
+
+    for label, hedging in (("slow tail, no hedging", False), ("slow tail, hedged", True)):
+        _reset()
+        service = _build_service(args)
+        for policy, min_delay in zip(hedge_policies, default_min_delays):
+            policy.min_delay = min_delay if hedging else float("inf")
+        _run(service, 3 * rag_service.resilience.HEDGE_MIN_SAMPLES, args.concurrency) # fill the latency histograms
+        for fake in (service.bedrock_runtime_client, service.retriever.index):
+            fake.slow_rate, fake.slow_ms = args.slow_rate, args.slow_ms
+        latencies, degraded = _run(service, args.requests, args.concurrency)
+        rows.append((label, latencies, degraded, service.bedrock_runtime_client.calls, service.retriever.index.queries))
+        policy = rag_service.RETRIEVAL_HEDGE
+        attempt_p95 = metrics.REGISTRY.stage_percentile("pinecone_query", policy.quantile, policy.min_samples)
+        if hedging and (attempt_p95 is None or policy.delay() > 2 * args.pinecone_ms / 1000):
+            print(f"FAIL: retrieval hedge threshold {policy.delay() * 1000:.0f}ms does not follow single Pinecone attempts "
+                  f"(p95 {(attempt_p95 or 0) * 1000:.0f}ms, {args.pinecone_ms:.0f}ms each)")
+            failures += 1
+    for policy, min_delay in zip(hedge_policies, default_min_delays):
+        policy.min_delay = min_delay
+    if _p(rows[1][1], 99) >= _p(rows[0][1], 99):
+        print("FAIL: hedging did not reduce p99")
+        failures += 1
+
+    for label, fail_rate, latency_ms in (("Bedrock failing", 1.0, args.bedrock_ms), ("Bedrock hung", 0.0, 5000)):
+        _reset()
+        service = _build_service(args)
+        service.bedrock_runtime_client.failure_rate = fail_rate
+        service.bedrock_runtime_client.latency_ms = latency_ms
+        bedrock_timeout = rag_service.BEDROCK_TIMEOUT_SECONDS
+        rag_service.BEDROCK_TIMEOUT_SECONDS = 1.0
+        try:
+            latencies, degraded = _run(service, args.requests, args.concurrency)
+        finally:
+            rag_service.BEDROCK_TIMEOUT_SECONDS = bedrock_timeout
+        rows.append((label, latencies, degraded, service.bedrock_runtime_client.calls, service.retriever.index.queries))
+        if service.bedrock_runtime_client.calls > args.requests / 2:
+            print(f"FAIL: {label}: breaker did not stop calls to Bedrock")
+            failures += 1
+
+    print(f"{'scenario':<24} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'degraded':>9} {'bedrock calls':>14} {'pinecone queries':>17}")
+    for label, latencies, degraded, bedrock_calls, pinecone_queries in rows:
+        print(f"{label:<24} {statistics.median(latencies) * 1000:>8.0f} {_p(latencies, 99):>8.0f} {latencies[-1] * 1000:>8.0f} "
+              f"{degraded:>9} {bedrock_calls:>14} {pinecone_queries:>17}")
+    print()
+    print("\n".join(line for line in metrics.render_prometheus().splitlines()
+                    if ("hedged" in line or "circuit" in line or "deadline" in line) and not line.startswith("#")))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
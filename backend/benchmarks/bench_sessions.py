@@ -0,0 +1,180 @@
+# Check + benchmark: server-side chat sessions versus resending the full chat history.
+#
+#   python -m benchmarks.bench_sessions [--turns 30] [--answer-chars 1500]
+#
+# Plays the same conversation against the Flask app twice with zero-latency fakes: once the way
+# the frontend used to talk (multipart form, whole `chat_history` as a JSON string every turn)
+# and once with a `conversation_id`. Reports request size and server time per turn, and checks
+# that the chain saw the same history both ways. Then checks the SessionStore itself: another
+# user cannot open a conversation, history stays within its bounds, idle conversations expire,
+# and a SQLite-backed store survives a restart. Also checks that an unknown conversation ID sent
+# without history gets 409 + "conversation_reset" and that resending the history starts it over,
+# and that gunicorn.conf.py defaults SESSION_STORE_PATH. Exits non-zero if a check fails.
+
+import argparse
+import json
+import os
+import runpy
+import statistics
+import sys
+import tempfile
+import time
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+    os.environ[_key] = ""
+os.environ.setdefault("ADMISSION_CONTROL", "false") # one client far past the per-user limits
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+
+import app as flask_backend
+import sessions
+from benchmarks.fakes import build_fake_rag_service
+
+GREETING = "Hello! I'm PetHealth AI. How can I help you and your pet today?"
+
+
+class RecordingChain:
+    def __init__(self):
+        """Zero-latency chain that records the history it was given and answers with a long text."""
+        self.histories = []
+        self.answer_chars = 0
+
+    def invoke(self, inputs, config=None):
+        self.histories.append([(type(message).__name__, message.content) for message in inputs["chat_history"]])
+        turn = len(self.histories)
+        return {"answer": f"Answer {turn}: " + "x" * self.answer_chars, "source_documents": []}
+
+
+def _install(answer_chars):
+    service = build_fake_rag_service(bedrock_ms=0, sagemaker_ms=0)
+    service.qa_chain_rag = RecordingChain()
+    service.qa_chain_rag.answer_chars = answer_chars
+    flask_backend.rag_service_instance = service
+    return service.qa_chain_rag
+
+
+def _play(client, turns, answer_chars, use_session):
+    chain = _install(answer_chars)
+    history = [{"sender": "ai", "text": GREETING}]
+    conversation_id = ""
+    sizes, times = [], []
+    for turn in range(turns):
+        message = f"Question {turn}: my dog has been scratching for {turn} days"
+        form = {"message": message}
+        if use_session:
+            form["conversation_id"] = conversation_id
+            if not conversation_id:
+                form["chat_history"] = json.dumps(history)
+        else:
+            form["chat_history"] = json.dumps(history)
+        sizes.append(sum(len(key) + len(value.encode()) for key, value in form.items()))
+        start = time.perf_counter()
+        response = client.post("/api/chat", data=form, content_type="multipart/form-data")
+        times.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_data()
+        data = response.get_json()
+        conversation_id = data.get("conversation_id", "")
+        history += [{"sender": "user", "text": message}, {"sender": "ai", "text": data["response"]}]
+    return chain.histories, sizes, times
+
+
+def _check_store(failures):
+    store = sessions.SessionStore(max_messages=6)
+    conversation = store.create("alice", [{"sender": "ai", "text": GREETING}])
+    for turn in range(10):
+        store.record_turn(conversation, f"q{turn}", f"a{turn}", "NON_URGENT")
+    history = store.get("alice", conversation.id).history()
+    if len(history) != 6 or history.messages[-1] != (False, "a9") or len(history.langchain_messages()) != 6:
+        print(f"FAIL: history not bounded to 6 messages: {history.messages}")
+        failures += 1
+    if store.get("mallory", conversation.id) is not None:
+        print("FAIL: another user opened the conversation")
+        failures += 1
+
+    store = sessions.SessionStore(ttl_seconds=0.05)
+    conversation = store.create("alice")
+    time.sleep(0.1)
+    if store.get("alice", conversation.id) is not None:
+        print("FAIL: idle conversation did not expire")
+        failures += 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'sessions.sqlite3')
+        store = sessions.SessionStore(path)
+        conversation = store.create("alice")
+        store.record_turn(conversation, "Is chocolate toxic to dogs?", "Yes, call your vet.", "URGENT")
+        restarted = sessions.SessionStore(path).get("alice", conversation.id)
+        if restarted is None or restarted.history().messages != conversation.history().messages or restarted.last_classification != "URGENT":
+            print("FAIL: SQLite-backed session did not survive a restart")
+            failures += 1
+        # A second worker records a turn; the first one must see it before appending its own.
+        sessions.SessionStore(path).record_turn(restarted, "And grapes?", "Also toxic.", "URGENT")
+        store.record_turn(conversation, "Thanks", "You're welcome.", "GENERAL_CONVERSATION")
+        texts = [text for _, text in sessions.SessionStore(path).get("alice", conversation.id).history().messages]
+        if texts != ["Is chocolate toxic to dogs?", "Yes, call your vet.", "And grapes?", "Also toxic.", "Thanks", "You're welcome."]:
+            print(f"FAIL: turns recorded by two workers were not merged: {texts}")
+            failures += 1
+    return failures
+
+
+def _check_reset(client, failures):
+    chain = _install(100)
+    # e.g. the conversation expired, or the server restarted with in-memory sessions
+    response = client.post("/api/chat", data={"message": "Still itchy?", "conversation_id": "forgotten-id"},
+                           content_type="multipart/form-data")
+    if response.status_code != 409 or not response.get_json().get("conversation_reset") or chain.histories:
+        print(f"FAIL: an unknown conversation ID without history answered {response.status_code}, not 409 + conversation_reset")
+        failures += 1
+    history = [{"sender": "ai", "text": GREETING}, {"sender": "user", "text": "My dog scratches"}, {"sender": "ai", "text": "Check for fleas."}]
+    response = client.post("/api/chat", data={"message": "Still itchy?", "conversation_id": "", "chat_history": json.dumps(history)},
+                           content_type="multipart/form-data")
+    conversation_id = response.get_json().get("conversation_id")
+    if response.status_code != 200 or not conversation_id or conversation_id == "forgotten-id" or len(chain.histories[-1]) != len(history):
+        print("FAIL: resending the history after a reset did not start the conversation over with it")
+        failures += 1
+
+    # Workers of one gunicorn server share their sessions unless SESSION_STORE_PATH says otherwise.
+    configured = os.environ.pop("SESSION_STORE_PATH", None)
+    runpy.run_path(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py'))
+    gunicorn_default = os.environ.pop("SESSION_STORE_PATH", None)
+    if configured is not None:
+        os.environ["SESSION_STORE_PATH"] = configured
+    if not gunicorn_default or not gunicorn_default.endswith('sessions.sqlite3'):
+        print(f"FAIL: gunicorn.conf.py does not default SESSION_STORE_PATH to a shared SQLite store ({gunicorn_default})")
+        failures += 1
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Server-side chat sessions versus resending chat_history')
+    parser.add_argument('--turns', type=int, default=30)
+    parser.add_argument('--answer-chars', type=int, default=1500)
+    args = parser.parse_args()
+
+    flask_backend.app.config['TESTING'] = True
+    # Unbounded for the comparison, so both runs hand the chain the same history.
+    sessions.SESSION_STORE = sessions.SessionStore(max_messages=10 * args.turns, max_chars=10 ** 9)
+    client = flask_backend.app.test_client()
+    failures = 0
+
+    legacy_histories, legacy_sizes, legacy_times = _play(client, args.turns, args.answer_chars, use_session=False)
+    session_histories, session_sizes, session_times = _play(client, args.turns, args.answer_chars, use_session=True)
+    if legacy_histories != session_histories:
+        print("FAIL: the chain saw a different history with server-side sessions")
+        failures += 1
+
+    print(f"{'mode':<20} {'last request KiB':>17} {'total KiB':>10} {'median ms':>10} {'last 5 turns ms':>16}")
+    for label, sizes, times in (("chat_history", legacy_sizes, legacy_times), ("conversation_id", session_sizes, session_times)):
+        print(f"{label:<20} {sizes[-1] / 1024:>17.1f} {sum(sizes) / 1024:>10.1f} "
+              f"{statistics.median(times) * 1000:>10.2f} {statistics.mean(times[-5:]) * 1000:>16.2f}")
+    print()
+
+    failures = _check_store(failures)
+    failures = _check_reset(client, failures)
+    if failures:
+        sys.exit(1)
+    print("ok: same chain history both ways; session bounds, ownership, TTL, persistence and reset checks passed")
+
+
+if __name__ == "__main__":
+    main()
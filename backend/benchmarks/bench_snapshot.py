@@ -0,0 +1,161 @@
+# Check + benchmark: vector snapshot export/import against the in-memory Pinecone fake.
+#
+#   python -m benchmarks.bench_snapshot [--vectors 5000] [--dimension 3072] [--pinecone-ms 50]
+#
+# Fills a FakePineconeIndex (every list/fetch/upsert call takes --pinecone-ms) with random unit
+# vectors and chunk metadata, exports it as float32 and float16 snapshots and imports them into
+# another namespace, sequentially and with parallel requests. Reports vectors/sec and snapshot
+# size (export throughput is bounded by listing IDs, which pages sequentially; fetches overlap it),
+# and checks that the float32 round trip is exact, the float16 one keeps cosine similarity,
+# the vector files load memory-mapped, and a pod-style index (no list support) exports through
+# the doc_<n> IDs. Also checks that an import as a new index generation activates it with its
+# lexical index, and that a failed one is deleted while the previous generation stays active.
+# Exits non-zero if a check fails.
+
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+_work_dir = tempfile.mkdtemp(prefix='bench-snapshot-')
+atexit.register(shutil.rmtree, _work_dir, True)
+os.environ["LEXICAL_INDEX_DIR"] = os.path.join(_work_dir, 'lexical_index')
+os.environ["INDEX_GENERATION_STATE_PATH"] = os.path.join(_work_dir, 'index_generation.json')
+os.environ["INDEX_GENERATION_VALIDATION_TIMEOUT_SECONDS"] = "1"
+
+import numpy as np
+
+import index_generations
+import logging_setup
+import vector_snapshot
+from benchmarks.fakes import FakePineconeIndex
+
+logging_setup.configure_logging(os.devnull)
+
+
+class PodIndex(FakePineconeIndex):
+    """Pod-based indexes do not support listing IDs."""
+    def list(self, namespace="", limit=100, **kwargs):
+        raise NotImplementedError("list is only supported on serverless indexes")
+
+
+def _fill(index, count, dimension, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.standard_normal((count, dimension), dtype=np.float32)
+    values /= np.linalg.norm(values, axis=1, keepdims=True)
+    for i in range(count):
+        index.vectors[f"doc_{i}"] = {"id": f"doc_{i}", "values": values[i].tolist(),
+                                     "metadata": {"text": f"Chunk {i} about ear infections in dogs.", "source": f"guide_{i // 40}.pdf", "page": float(i % 40)}}
+
+
+def _compare(source, target, namespace, exact):
+    """Returns (problem or None, minimum cosine similarity)."""
+    restored = target.namespaces.get(namespace, {})
+    if set(restored) != set(source.vectors):
+        return f"{len(restored)} of {len(source.vectors)} vectors restored", 0.0
+    ids = sorted(source.vectors)
+    original = np.asarray([source.vectors[i]["values"] for i in ids], dtype=np.float32)
+    copy = np.asarray([restored[i]["values"] for i in ids], dtype=np.float32)
+    if any(restored[i]["metadata"] != source.vectors[i]["metadata"] for i in ids):
+        return "metadata differs", 0.0
+    cosine = float(np.min(np.sum(original * copy, axis=1) / (np.linalg.norm(original, axis=1) * np.linalg.norm(copy, axis=1))))
+    if exact and not np.array_equal(original, copy):
+        return "float32 values differ", cosine
+    return None, cosine
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vector snapshot export/import throughput')
+    parser.add_argument('--vectors', type=int, default=5000)
+    parser.add_argument('--dimension', type=int, default=3072)
+    parser.add_argument('--pinecone-ms', type=float, default=50, help="Latency of each fake Pinecone call")
+    parser.add_argument('--threads', type=int, default=vector_snapshot.SNAPSHOT_THREADS)
+    args = parser.parse_args()
+    failures = 0
+
+    source = FakePineconeIndex(args.pinecone_ms, dimension=args.dimension)
+    _fill(source, args.vectors, args.dimension)
+    print(f"{args.vectors} vectors x {args.dimension} dims, {args.pinecone_ms:.0f} ms per Pinecone call\n")
+    print(f"{'operation':<10} {'dtype':<8} {'threads':>7} {'seconds':>8} {'vectors/sec':>12} {'MiB':>7} {'min cosine':>11}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for dtype in ("float32", "float16"):
+            snapshot_dir = os.path.join(work_dir, dtype)
+            for threads in (1, args.threads):
+                stats = vector_snapshot.export_snapshot(source, snapshot_dir, dtype=dtype, chunk_rows=2000, threads=threads)
+                print(f"{'export':<10} {dtype:<8} {threads:>7} {stats['seconds']:>8.2f} {stats['vectors_per_second']:>12.0f} "
+                      f"{stats['bytes'] / 2 ** 20:>7.1f}")
+            for threads in (1, args.threads):
+                target = FakePineconeIndex(args.pinecone_ms, dimension=args.dimension)
+                stats = vector_snapshot.import_snapshot(target, snapshot_dir, namespace="restored", threads=threads)
+                problem, cosine = _compare(source, target, "restored", exact=dtype == "float32")
+                print(f"{'import':<10} {dtype:<8} {threads:>7} {stats['seconds']:>8.2f} {stats['vectors_per_second']:>12.0f} "
+                      f"{'':>7} {cosine:>11.6f}")
+                if problem or cosine < 0.9999:
+                    print(f"FAIL: {dtype} round trip with {threads} thread(s): {problem or f'cosine similarity {cosine}'}")
+                    failures += 1
+
+            manifest = vector_snapshot.load_manifest(snapshot_dir)
+            mapped = np.load(os.path.join(snapshot_dir, manifest["chunks"][0]["vectors"]), mmap_mode='r')
+            if not isinstance(mapped, np.memmap) or mapped.dtype != np.dtype(dtype) or manifest["count"] != args.vectors:
+                print(f"FAIL: {dtype} snapshot is not a memory-mappable {dtype} array of {args.vectors} vectors")
+                failures += 1
+
+        pod = PodIndex(0, dimension=args.dimension)
+        _fill(pod, 250, args.dimension)
+        stats = vector_snapshot.export_snapshot(pod, os.path.join(work_dir, 'pod'))
+        if stats["vectors"] != 250:
+            print(f"FAIL: pod-style index exported {stats['vectors']} of 250 vectors")
+            failures += 1
+
+        wrong = FakePineconeIndex(0, dimension=args.dimension // 2)
+        try:
+            vector_snapshot.import_snapshot(wrong, os.path.join(work_dir, 'float32'))
+            print("FAIL: a snapshot was imported into an index of a different dimension")
+            failures += 1
+        except ValueError:
+            pass
+
+        failures += _check_generation_import(os.path.join(work_dir, 'float32'), args.vectors, args.dimension)
+
+    if failures:
+        sys.exit(1)
+    print("\nok: exact float32 round trip, float16 cosine >= 0.9999, memory-mapped chunks, pod fallback, dimension check, "
+          "import as an activated generation, failed import discarded")
+
+
+def _check_generation_import(snapshot_dir, count, dimension):
+    from lexical_index import LexicalIndex
+    failures = 0
+    target = FakePineconeIndex(0, dimension=dimension)
+    _, generation = vector_snapshot.import_snapshot_as_generation(target, snapshot_dir)
+    lexical = LexicalIndex(generation.lexical_dir)
+    hits = lexical.search("ear infections", k=1)
+    lexical.close()
+    if (index_generations.load_state()[0] != generation or len(target.namespaces.get(generation.namespace, {})) != count
+            or lexical.num_docs != count or not hits):
+        print(f"FAIL: snapshot import as generation '{generation.name}' was not activated complete with its lexical index")
+        failures += 1
+
+    broken = FakePineconeIndex(0, dimension=dimension)
+    upsert = broken.upsert
+    broken.upsert = lambda vectors, namespace="", **kwargs: upsert(vectors[:-1], namespace=namespace, **kwargs)
+    try:
+        vector_snapshot.import_snapshot_as_generation(broken, snapshot_dir)
+        print("FAIL: an incomplete snapshot import was activated")
+        failures += 1
+    except index_generations.GenerationValidationError:
+        if index_generations.load_state()[0] != generation or any(broken.namespaces.values()):
+            print("FAIL: an incomplete snapshot import was not discarded")
+            failures += 1
+    return failures
+
+
+if __name__ == "__main__":
+    main()
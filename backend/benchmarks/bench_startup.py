@@ -0,0 +1,76 @@
+# Benchmark: cold start time of the serving and indexing entry points, with an import-time breakdown.
+#
+#   python -m benchmarks.bench_startup [--top 15] [--runs 3]
+#
+# Each measurement runs in a fresh interpreter (`python -X importtime`), so nothing is cached in-process.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dummy credentials let RAGService pass its configuration check without reaching any service.
+STARTUP_ENV = {
+    "OPENAI_API_KEY": "sk-startup-bench",
+    "PINECONE_API_KEY": "startup-bench",
+    "PINECONE_INDEX_NAME": "startup-bench",
+    "AWS_LOCATION_PLACE_INDEX_NAME": "startup-bench",
+}
+
+SCENARIOS = {
+    "serving (import app)": "import app",
+    # Components that build without a network round trip; Pinecone connects during construction.
+    "serving + build LLM/Bedrock clients": "import app; s = app.rag_service_instance; s.llm_rag; s.bedrock_runtime_client",
+    "indexing (import index_document)": "import index_document",
+    "indexing + build PDFProcessor": "import index_document, rag_service; rag_service.RAGService().pdf_processor",
+}
+
+
+def _run(code, importtime=False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    env = dict(os.environ, **STARTUP_ENV)
+    start = time.perf_counter()
+    result = subprocess.run(cmd, cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"'{code}' failed:\n{result.stderr[-2000:]}")
+    return elapsed, result.stderr
+
+
+def _entry_point_imports(importtime_output, top):
+    """Parse `-X importtime` output into (cumulative_us, module) for modules imported directly by the entry point."""
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level after the "| " separator.
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 1:
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure backend startup time')
+    parser.add_argument('--top', type=int, default=15, help='Number of top-level imports to list')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    for label, code in SCENARIOS.items():
+        timings = [_run(code)[0] for _ in range(args.runs)]
+        print(f"{label:<36} median {statistics.median(timings) * 1000:7.0f}ms  (min {min(timings) * 1000:.0f}ms)")
+
+    for label in ("serving (import app)", "indexing (import index_document)"):
+        _, output = _run(SCENARIOS[label], importtime=True)
+        print(f"\n--- slowest imports made by {label} ---")
+        for cumulative_us, name in _entry_point_imports(output, args.top):
+            print(f"{cumulative_us / 1000:8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# Check + benchmark: PDF upload ingestion (/api/index/upload).
+#
+#   python -m benchmarks.bench_upload [--files 6] [--pages 12] [--openai-ms 5] [--pinecone-ms 20]
+#
+# Uploads generated PDFs through the Flask app into a real RAGService whose PDFProcessor is real
+# and whose EmbeddingManager talks to the in-memory OpenAI/Pinecone fakes (latency per call).
+# Reports per-upload chunks and stage timings, and the wall time of a multi-file upload with
+# UPLOAD_INDEX_CONCURRENCY 1 versus the configured value. Checks that:
+#   - each upload's chunks match PDFProcessor's own chunking and land as "upload-<hash>_<n>"
+#     vectors in the active generation, leaving the corpus' doc_<n> vectors alone
+#   - no more uploads are embedded at once than UPLOAD_INDEX_CONCURRENCY
+#   - file parts are spooled: kept in memory up to UPLOAD_SPOOL_MAX_BYTES, on disk past it
+#   - a shorter re-upload of a file replaces its chunks, surplus ones deleted; another user's
+#     file of the same name gets vectors of its own
+#   - a broken PDF fails alone (207); non-PDF, empty and oversized requests get 400/413
+#   - the ASGI endpoint indexes an upload the same way
+#   - a blue/green re-index embeds every archived upload into the new generation under the same
+#     vector IDs; an upload during the build gets 409, one after it lands in the new generation
+# Exits non-zero if a check fails.
+
+import argparse
+import asyncio
+import atexit
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+    os.environ[_key] = ""
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("ADMISSION_CONTROL", "false")
+_work_dir = tempfile.mkdtemp(prefix='bench-upload-')
+atexit.register(shutil.rmtree, _work_dir, True)
+os.environ["LEXICAL_INDEX_DIR"] = os.path.join(_work_dir, 'lexical_index')
+os.environ["INDEX_GENERATION_STATE_PATH"] = os.path.join(_work_dir, 'index_generation.json')
+os.environ["PDF_PAGE_CACHE_DIR"] = os.path.join(_work_dir, 'pdf_pages')
+os.environ["UPLOAD_ARCHIVE_DIR"] = os.path.join(_work_dir, 'uploads')
+os.environ["UPLOAD_SPOOL_MAX_BYTES"] = str(64 * 1024)
+
+import app as flask_backend
+import asgi_app
+import index_generations
+import pdf_uploads
+import rag_service
+from benchmarks.fakes import build_fake_embedding_manager, build_fake_rag_service
+from benchmarks.synthetic_pdfs import build_pdf_bytes
+from pdf_processor import PDFProcessor
+
+
+class ConcurrencyProbe:
+    def __init__(self, upsert_documents):
+        """Wraps EmbeddingManager.upsert_documents to record how many run at once."""
+        self._upsert_documents = upsert_documents
+        self._lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            return self._upsert_documents(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def _install(openai_ms, pinecone_ms):
+    service = build_fake_rag_service(bedrock_ms=0, sagemaker_ms=0)
+    service.pdf_processor = PDFProcessor(use_page_cache=False)
+    service.embedding_manager = build_fake_embedding_manager(openai_ms=openai_ms, pinecone_ms=pinecone_ms)
+    probe = ConcurrencyProbe(service.embedding_manager.upsert_documents)
+    service.embedding_manager.upsert_documents = probe
+    # The existing corpus, indexed from the PDF folder.
+    for i in range(20):
+        service.embedding_manager.index.vectors[f"doc_{i}"] = {"id": f"doc_{i}", "values": [], "metadata": {"text": f"corpus chunk {i}", "source": "corpus.pdf"}}
+    flask_backend.rag_service_instance = service
+    return service, probe
+
+
+USER = "ip:127.0.0.1" # the test client's address is the user while authentication is disabled
+
+
+def _upload(client, files, remote_addr="127.0.0.1"):
+    data = {pdf_uploads.UPLOAD_FIELD: [(io.BytesIO(content), name) for name, content in files]}
+    start = time.perf_counter()
+    response = client.post("/api/index/upload", data=data, content_type="multipart/form-data",
+                           environ_base={"REMOTE_ADDR": remote_addr})
+    return response, time.perf_counter() - start
+
+
+def _stored(index, user, name):
+    prefix = pdf_uploads.vector_id_prefix(user, name)
+    return [vector_id for vector_id in index.vectors if vector_id.startswith(f"{prefix}_")]
+
+
+def _expected_chunks(content):
+    processor = PDFProcessor(use_page_cache=False)
+    return len(processor.create_chunks("".join(processor.extract_pages_from_stream(io.BytesIO(content)))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PDF upload ingestion throughput and checks')
+    parser.add_argument('--files', type=int, default=6)
+    parser.add_argument('--pages', type=int, default=12)
+    parser.add_argument('--openai-ms', type=float, default=5, help='Latency of each fake embedding call')
+    parser.add_argument('--pinecone-ms', type=float, default=20, help='Latency of each fake Pinecone call')
+    args = parser.parse_args()
+    failures = 0
+
+    flask_backend.app.config['TESTING'] = True
+    client = flask_backend.app.test_client()
+    pdfs = [(f"guide_{i}.pdf", build_pdf_bytes(num_pages=args.pages, seed=i)) for i in range(args.files)]
+
+    spooled = []
+    spooled_stream = pdf_uploads.spooled_stream
+    pdf_uploads.spooled_stream = lambda *a, **kw: spooled.append(spooled_stream()) or spooled[-1]
+
+    print(f"{args.files} PDFs x {args.pages} pages ({sum(len(content) for _, content in pdfs) / 1024:.0f} KiB), "
+          f"{args.openai_ms:.0f} ms per embedding, {args.pinecone_ms:.0f} ms per Pinecone call\n")
+    print(f"{'concurrency':>11} {'seconds':>8} {'chunks':>7} {'peak':>5}")
+    configured = pdf_uploads.UPLOAD_INDEX_CONCURRENCY
+    for concurrency in sorted({1, max(2, configured)}):
+        pdf_uploads.UPLOAD_INDEX_CONCURRENCY = concurrency
+        service, probe = _install(args.openai_ms, args.pinecone_ms)
+        response, elapsed = _upload(client, pdfs)
+        body = response.get_json()
+        print(f"{concurrency:>11} {elapsed:>8.2f} {body.get('chunks', 0):>7} {probe.peak:>5}")
+        if response.status_code != 200 or len(body["uploads"]) != args.files:
+            print(f"FAIL: upload of {args.files} PDFs answered {response.status_code}: {body}")
+            failures += 1
+            continue
+        if probe.peak > concurrency:
+            print(f"FAIL: {probe.peak} uploads embedded at once with UPLOAD_INDEX_CONCURRENCY={concurrency}")
+            failures += 1
+    pdf_uploads.UPLOAD_INDEX_CONCURRENCY = configured
+
+    print(f"\n{'file':<14} {'KiB':>6} {'pages':>6} {'chunks':>7} {'extract s':>10} {'chunk s':>8} {'embed+upsert s':>15}")
+    for result in body["uploads"]:
+        seconds = result["seconds"]
+        print(f"{result['filename']:<14} {result['bytes'] / 1024:>6.0f} {result['pages']:>6} {result['chunks']:>7} "
+              f"{seconds['extract']:>10.3f} {seconds['chunk']:>8.3f} {seconds['embed_upsert']:>15.3f}")
+
+    index = service.embedding_manager.index
+    for (name, content), result in zip(pdfs, body["uploads"]):
+        stored = _stored(index, USER, name)
+        if result["chunks"] != _expected_chunks(content) or len(stored) != result["chunks"] or result["pages"] != args.pages:
+            print(f"FAIL: '{name}' indexed as {len(stored)} vectors / {result['chunks']} chunks, expected {_expected_chunks(content)}")
+            failures += 1
+        if any(index.vectors[vector_id]["metadata"]["source"] != name for vector_id in stored):
+            print(f"FAIL: '{name}' chunks carry the wrong source")
+            failures += 1
+    if sum(1 for vector_id in index.vectors if vector_id.startswith("doc_")) != 20:
+        print("FAIL: uploads overwrote or removed vectors of the existing corpus")
+        failures += 1
+    # Parts up to UPLOAD_SPOOL_MAX_BYTES stay in memory, larger ones go to disk.
+    spooled.clear()
+    large = build_pdf_bytes(num_pages=args.pages * 4, seed=50)
+    response, _ = _upload(client, [("small.pdf", build_pdf_bytes(num_pages=2, seed=51)), ("large.pdf", large)])
+    if response.status_code != 200 or [stream._rolled for stream in spooled] != [False, True]:
+        print(f"FAIL: upload parts were not spooled to disk past {pdf_uploads.UPLOAD_SPOOL_MAX_BYTES} bytes "
+              f"(rolled over: {[stream._rolled for stream in spooled]}, large part {len(large)} bytes)")
+        failures += 1
+
+    # A shorter new version of guide_0.pdf replaces the old chunks.
+    name = pdfs[0][0]
+    shorter = build_pdf_bytes(num_pages=max(1, args.pages // 3), seed=99)
+    response, _ = _upload(client, [(name, shorter)])
+    result = response.get_json()["uploads"][0]
+    stored = _stored(index, USER, name)
+    if response.status_code != 200 or len(stored) != result["chunks"] or not result["stale_vectors_deleted"]:
+        print(f"FAIL: re-upload left {len(stored)} vectors for {result['chunks']} chunks")
+        failures += 1
+    # Another user's guide_0.pdf is a different document: it must not replace or trim the first one.
+    response, _ = _upload(client, [(name, pdfs[1][1])], remote_addr="10.0.0.2")
+    other = response.get_json()["uploads"][0]
+    if (response.status_code != 200 or len(_stored(index, "ip:10.0.0.2", name)) != other["chunks"]
+            or len(_stored(index, USER, name)) != result["chunks"] or other["stale_vectors_deleted"]):
+        print("FAIL: another user's upload of the same file name replaced the first user's chunks")
+        failures += 1
+
+    response, _ = _upload(client, [("good.pdf", pdfs[1][1]), ("broken.pdf", b"%PDF-1.4 this is not really a PDF")])
+    body = response.get_json()
+    if response.status_code != 207 or "error" not in body["uploads"][1] or "error" in body["uploads"][0]:
+        print(f"FAIL: a broken PDF did not fail on its own ({response.status_code}: {body})")
+        failures += 1
+
+    for label, files, expected in (("not a PDF", [("notes.pdf", b"plain text")], 400), ("no file", [], 400)):
+        response, _ = _upload(client, files)
+        if response.status_code != expected:
+            print(f"FAIL: {label} answered {response.status_code}, expected {expected}")
+            failures += 1
+    limit = pdf_uploads.UPLOAD_MAX_BYTES
+    pdf_uploads.UPLOAD_MAX_BYTES = 1024
+    response, _ = _upload(client, pdfs[:1])
+    pdf_uploads.UPLOAD_MAX_BYTES = limit
+    if response.status_code != 413:
+        print(f"FAIL: an oversized upload answered {response.status_code}, expected 413")
+        failures += 1
+
+    asgi_app.app.config['TESTING'] = True
+    response = asyncio.run(_asgi_post(pdfs[2]))
+    if response[0] != 200 or response[1]["uploads"][0]["chunks"] != _expected_chunks(pdfs[2][1]):
+        print(f"FAIL: the ASGI endpoint answered {response}")
+        failures += 1
+
+    failures += _check_reindex(client, service, args.pages)
+
+    if failures:
+        sys.exit(1)
+    print("\nok: chunks match PDFProcessor, corpus untouched, bounded concurrency, spooled to disk, re-upload replaces, "
+          "same name from another user kept apart, broken PDF isolated, 400/413 checks, ASGI endpoint, "
+          "uploads kept across a blue/green re-index and refused during it")
+
+
+def _upload_ids(vectors):
+    return {vector_id for vector_id in vectors if vector_id.startswith("upload-")}
+
+
+def _check_reindex(client, service, pages):
+    failures = 0
+    index = service.embedding_manager.index
+    uploaded = _upload_ids(index.vectors)
+    corpus_dir = os.path.join(_work_dir, 'corpus')
+    os.makedirs(corpus_dir)
+    with open(os.path.join(corpus_dir, 'corpus.pdf'), 'wb') as f:
+        f.write(build_pdf_bytes(num_pages=pages, seed=200))
+
+    # An upload while a new generation is being built would be lost with the old one: refused.
+    with index_generations.generation_build():
+        response, _ = _upload(client, [("during.pdf", build_pdf_bytes(num_pages=2, seed=201))])
+    if response.status_code != 409 or not response.headers.get("Retry-After"):
+        print(f"FAIL: an upload during a generation build answered {response.status_code}, expected 409 with Retry-After")
+        failures += 1
+
+    rag_service.BLUE_GREEN_INDEXING = True
+    del service.qa_chain_rag # nothing of the chat stack to rebuild for the new generation
+    try:
+        service.index_documents(corpus_dir)
+        generation = index_generations.load_state()[0]
+        rebuilt = _upload_ids(index.namespaces.get(generation.namespace, {}))
+        if generation.namespace == "" or rebuilt != uploaded:
+            print(f"FAIL: the re-index into '{generation.name}' kept {len(rebuilt & uploaded)} of {len(uploaded)} uploaded "
+                  f"chunks ({len(rebuilt - uploaded)} unexpected)")
+            failures += 1
+        response, _ = _upload(client, [("after.pdf", build_pdf_bytes(num_pages=2, seed=202))])
+        if response.status_code != 200 or not _stored_in(index, generation.namespace, USER, "after.pdf"):
+            print(f"FAIL: an upload after the re-index did not land in the new generation ({response.status_code})")
+            failures += 1
+    finally:
+        rag_service.BLUE_GREEN_INDEXING = False
+    return failures
+
+
+def _stored_in(index, namespace, user, name):
+    prefix = pdf_uploads.vector_id_prefix(user, name)
+    return [vector_id for vector_id in index.namespaces.get(namespace, {}) if vector_id.startswith(f"{prefix}_")]
+
+
+async def _asgi_post(pdf):
+    from werkzeug.datastructures import FileStorage
+    name, content = pdf
+    client = asgi_app.app.test_client()
+    response = await client.post("/api/index/upload", files={pdf_uploads.UPLOAD_FIELD: FileStorage(io.BytesIO(content), filename=name)})
+    return response.status_code, await response.get_json()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Benchmark: /api/chat requests/sec under gunicorn as the worker count grows, against stubbed backends.
+#
+#   python -m benchmarks.bench_workers [--workers 1 2 4] [--threads 1] [--latency-ms 50 --cpu-ms 5]
+
+import argparse
+import atexit
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _wait_for_port(port, timeout_s=30.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"gunicorn did not start listening on port {port}")
+
+
+def _client_loop(port, num_requests):
+    body = json.dumps({"message": "My dog keeps scratching his ear", "chat_history": []})
+    headers = {"Content-Type": "application/json"}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    failures = 0
+    for _ in range(num_requests):
+        conn.request("POST", "/api/chat", body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            failures += 1
+    conn.close()
+    return failures
+
+
+def run_load(port, total_requests, concurrency):
+    per_client = max(1, total_requests // concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        failures = sum(pool.map(lambda _: _client_loop(port, per_client), range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return per_client * concurrency / elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure requests/sec scaling with gunicorn worker count')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--cpu-ms', type=float, default=5)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-workers-')
+    atexit.register(shutil.rmtree, work_dir, True)
+    # gunicorn.conf.py would otherwise share the chat sessions through backend/cache.
+    env = dict(os.environ, BENCH_LATENCY_MS=str(args.latency_ms), BENCH_CPU_MS=str(args.cpu_ms),
+               SESSION_STORE_PATH=os.path.join(work_dir, 'sessions.sqlite3'))
+    results = []
+    for num_workers in args.workers:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+             "--workers", str(num_workers), "--threads", str(args.threads),
+             "--bind", f"127.0.0.1:{args.port}", "--log-level", "warning",
+             "benchmarks.stub_wsgi:app"],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_for_port(args.port)
+            run_load(args.port, args.concurrency * 2, args.concurrency) # warm-up
+            rps, failures = run_load(args.port, args.requests, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        results.append((num_workers, rps, failures))
+        print(f"workers={num_workers:<3} threads={args.threads:<3} {rps:8.1f} req/s  failures={failures}")
+
+    base_rps = results[0][1]
+    for num_workers, rps, _ in results[1:]:
+        print(f"scaling {results[0][0]} -> {num_workers} workers: {rps / base_rps:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# LangChain-level fakes for the chat chain: an OpenAI chat model and a Pinecone-backed retriever
+# that go through the real ConversationalRetrievalChain, so LangChain's own overhead is measured.
+# Kept apart from fakes.py because importing langchain_core is slow.
+
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.retrievers import BaseRetriever
+
+from benchmarks.fakes import FakeOpenAIClient, FakePineconeIndex, asimulate_call, simulate_call
+
+
+class FakeChatOpenAI(BaseChatModel):
+    """Stand-in for ChatOpenAI: answers after `latency_ms`, failing with probability `failure_rate`."""
+    latency_ms: float = 600
+    failure_rate: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-openai-chat"
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        answer = f"Fake advice based on a {prompt_chars}-character prompt. Consult a veterinarian if symptoms worsen."
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        simulate_call("openai", self.latency_ms, self.failure_rate)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asimulate_call("openai", self.latency_ms, self.failure_rate)
+        return self._result(messages)
+
+
+class FakePineconeRetriever(BaseRetriever):
+    """Embeds the question with a fake OpenAI client and queries a fake Pinecone index, like the real retriever."""
+    openai_client: Any
+    index: Any
+    k: int = 5
+    namespace: str = ""
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        embedding = self.openai_client.embeddings.create(model="text-embedding-3-large", input=query).data[0].embedding
+        result = self.index.query(vector=embedding, top_k=self.k, include_metadata=True, namespace=self.namespace)
+        return [Document(page_content=match["metadata"].get("text", ""), metadata=match["metadata"]) for match in result["matches"]]
+
+
+def build_fake_retriever(embedding_ms=100, pinecone_ms=50, openai_failure_rate=0.0, pinecone_failure_rate=0.0, num_chunks=20):
+    """Build a FakePineconeRetriever whose index is pre-filled with `num_chunks` veterinary-looking chunks."""
+    index = FakePineconeIndex(pinecone_ms, failure_rate=pinecone_failure_rate)
+    for i in range(num_chunks):
+        text = f"Chunk {i}: ear infections in dogs often present with scratching, head shaking and odour. " * 8
+        index.vectors[f"doc_{i}"] = {"id": f"doc_{i}", "values": [], "metadata": {"text": text, "source": "bench.pdf", "page": i}}
+    return FakePineconeRetriever(openai_client=FakeOpenAIClient(embedding_ms, failure_rate=openai_failure_rate), index=index)
@@ -0,0 +1,324 @@
+# In-process fakes for the external services, with injectable latency, used by the benchmarks.
+
+import asyncio
+import functools
+import json
+import random
+import time
+from types import SimpleNamespace
+
+
+class FakeServiceError(Exception):
+    """Raised by a fake to simulate a failed call to the service it stands in for."""
+
+
+def _call_latency_ms(latency_ms, slow_rate, slow_ms, rng):
+    return slow_ms if slow_rate and rng.random() < slow_rate else latency_ms
+
+
+def simulate_call(service, latency_ms, failure_rate=0.0, rng=random, slow_rate=0.0, slow_ms=0):
+    """Wait `latency_ms` (`slow_ms` with probability `slow_rate`), then fail with probability `failure_rate`."""
+    latency_ms = _call_latency_ms(latency_ms, slow_rate, slow_ms, rng)
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000.0)
+    if failure_rate and rng.random() < failure_rate:
+        raise FakeServiceError(f"Injected {service} failure")
+
+
+async def asimulate_call(service, latency_ms, failure_rate=0.0, rng=random, slow_rate=0.0, slow_ms=0):
+    latency_ms = _call_latency_ms(latency_ms, slow_rate, slow_ms, rng)
+    if latency_ms > 0:
+        await asyncio.sleep(latency_ms / 1000.0)
+    if failure_rate and rng.random() < failure_rate:
+        raise FakeServiceError(f"Injected {service} failure")
+
+
+def burn_cpu(milliseconds):
+    """Busy-loop for roughly `milliseconds` of CPU time (stands in for LangChain/JSON overhead)."""
+    if milliseconds <= 0:
+        return
+    deadline = time.process_time() + milliseconds / 1000.0
+    while time.process_time() < deadline:
+        pass
+
+
+class FakeRAGService:
+    def __init__(self, latency_ms=50, cpu_ms=5):
+        """
+        Stand-in for RAGService that mimics its response contract
+
+        Args:
+            latency_ms: Simulated time spent waiting on Bedrock/OpenAI/Pinecone per chat request
+            cpu_ms: Simulated Python CPU work per chat request
+        """
+        self.latency_ms = latency_ms
+        self.cpu_ms = cpu_ms
+
+    def reinitialize_clients(self):
+        pass
+
+    def generate_response(self, user_query, chat_history_from_frontend, image_data_base64=None):
+        burn_cpu(self.cpu_ms)
+        time.sleep(self.latency_ms / 1000.0)
+        return {
+            "urgency": "NON_URGENT",
+            "response": f"Fake advice for: {user_query[:50]}",
+            "data": {
+                "sagemaker_analysis": {"summary": "No image was submitted for analysis.", "raw": None},
+                "action_required": "MONITOR_AND_CONSIDER_VET_IF_NEEDED",
+            },
+        }
+
+    def index_documents(self, pdf_directory):
+        time.sleep(self.latency_ms / 1000.0)
+        return 0
+
+
+class _FakeStreamingBody:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def read(self):
+        return self._payload
+
+
+class FakeBedrockClient:
+    def __init__(self, latency_ms=300, classification="UNCERTAIN", failure_rate=0.0):
+        """Blocking stand-in for the bedrock-runtime client used by classify_urgency_with_bedrock."""
+        self.latency_ms = latency_ms
+        self.classification = classification
+        self.failure_rate = failure_rate
+        self.slow_rate, self.slow_ms = 0.0, 0 # optional latency tail
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        simulate_call("bedrock", self.latency_ms, self.failure_rate, slow_rate=self.slow_rate, slow_ms=self.slow_ms)
+        body = json.dumps({"content": [{"type": "text", "text": self.classification}]}).encode('utf-8')
+        return {"body": _FakeStreamingBody(body)}
+
+
+class FakeSageMakerClient:
+    def __init__(self, latency_ms=400, failure_rate=0.0):
+        """Blocking stand-in for the sagemaker-runtime client used by analyze_skin_image_with_sagemaker."""
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.slow_rate, self.slow_ms = 0.0, 0 # optional latency tail
+        self.calls = 0
+
+    def invoke_endpoint(self, **kwargs):
+        self.calls += 1
+        simulate_call("sagemaker", self.latency_ms, self.failure_rate, slow_rate=self.slow_rate, slow_ms=self.slow_ms)
+        return {"Body": _FakeStreamingBody(b"[0.05, 0.1, 0.05, 0.1, 0.6, 0.1]")}
+
+
+class FakeQAChain:
+    def __init__(self, latency_ms=1500):
+        """Stand-in for the ConversationalRetrievalChain (question rewrite + Pinecone + GPT)."""
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def _result(self, inputs):
+        self.calls += 1
+        return {"answer": f"Fake advice for: {inputs['question'][:50]}", "source_documents": []}
+
+    def invoke(self, inputs, config=None):
+        time.sleep(self.latency_ms / 1000.0)
+        return self._result(inputs)
+
+    async def ainvoke(self, inputs, config=None):
+        await asyncio.sleep(self.latency_ms / 1000.0)
+        return self._result(inputs)
+
+
+class FakeLocationClient:
+    def __init__(self, latency_ms=150, failure_rate=0.0):
+        """Blocking stand-in for the Amazon Location client."""
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    def search_place_index_for_text(self, **kwargs):
+        self.calls += 1
+        simulate_call("location", self.latency_ms, self.failure_rate)
+        return {"Results": [
+            {"Place": {"PlaceId": "fake-1", "Label": "Fake Vet Clinic, 1 Main St, Springfield",
+                       "Geometry": {"Point": [-122.0, 37.0]}, "PhoneNumber": "+15555550100"}},
+        ]}
+
+
+class _FakeEmbeddingResponse:
+    def __init__(self, embedding):
+        self.data = [type("EmbeddingData", (), {"embedding": embedding})()]
+
+
+class FakeOpenAIClient:
+    def __init__(self, latency_ms=0, dimension=3072, failure_rate=0.0):
+        """Blocking stand-in for the OpenAI client; only `embeddings.create` is implemented."""
+        self.latency_ms = latency_ms
+        self.dimension = dimension
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.embeddings = self
+
+    def create(self, model, input):
+        self.calls += 1
+        simulate_call("openai", self.latency_ms, self.failure_rate)
+        seed = (hash(input) % 1000) / 1000.0
+        return _FakeEmbeddingResponse([seed] * self.dimension)
+
+
+class FakePineconeIndex:
+    def __init__(self, latency_ms=0, failure_rate=0.0, dimension=3072):
+        """Stand-in for a Pinecone Index that keeps upserted vectors in memory, per namespace."""
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.dimension = dimension
+        self.slow_rate, self.slow_ms = 0.0, 0 # optional latency tail
+        self.queries = 0
+        self.upserts = 0
+        self.vectors = {} # default namespace
+        self.namespaces = {"": self.vectors}
+        self._matrices = {} # namespace -> (vector count, candidates, values matrix) for ranked queries
+
+    def _namespace(self, namespace):
+        return self.namespaces.setdefault(namespace or "", {})
+
+    def upsert(self, vectors, namespace="", **kwargs):
+        self.upserts += 1
+        simulate_call("pinecone", self.latency_ms, self.failure_rate)
+        stored = self._namespace(namespace)
+        for vector in vectors:
+            stored[vector["id"]] = vector
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k=5, include_metadata=True, namespace="", **kwargs):
+        self.queries += 1
+        simulate_call("pinecone", self.latency_ms, self.failure_rate, slow_rate=self.slow_rate, slow_ms=self.slow_ms)
+        stored = self._namespace(namespace)
+        candidates = list(stored.values())
+        if vector and candidates and all(len(v["values"]) == len(vector) for v in candidates):
+            # Nearest first (Euclidean); prefilled fake chunks without values are returned in insertion order.
+            import numpy as np
+            cached = self._matrices.get(namespace or "")
+            if cached is None or cached[0] != len(stored) or cached[1] != candidates:
+                cached = self._matrices[namespace or ""] = (len(stored), candidates, np.asarray([v["values"] for v in candidates], dtype=np.float32))
+            distances = np.linalg.norm(cached[2] - np.asarray(vector, dtype=np.float32), axis=1)
+            candidates = [candidates[i] for i in np.argsort(distances, kind="stable")]
+        matches = [{"id": v["id"], "score": 1.0, "metadata": v.get("metadata", {})} for v in candidates[:top_k]]
+        return {"matches": matches}
+
+    def list(self, namespace="", limit=100, prefix=None, **kwargs):
+        """Like Index.list on a serverless index: yields pages of vector IDs (starting with `prefix`)."""
+        ids = [vector_id for vector_id in self._namespace(namespace) if prefix is None or vector_id.startswith(prefix)]
+        for start in range(0, len(ids), limit):
+            simulate_call("pinecone", self.latency_ms, self.failure_rate)
+            yield ids[start:start + limit]
+
+    def fetch(self, ids, namespace="", **kwargs):
+        simulate_call("pinecone", self.latency_ms, self.failure_rate)
+        stored = self._namespace(namespace)
+        vectors = {vector_id: SimpleNamespace(id=vector_id, values=stored[vector_id]["values"], metadata=stored[vector_id].get("metadata"))
+                   for vector_id in ids if vector_id in stored}
+        return SimpleNamespace(vectors=vectors, namespace=namespace)
+
+    def delete(self, ids=None, delete_all=False, namespace="", **kwargs):
+        simulate_call("pinecone", self.latency_ms, self.failure_rate)
+        stored = self._namespace(namespace)
+        if delete_all:
+            stored.clear()
+            if namespace:
+                del self.namespaces[namespace]
+        else:
+            for vector_id in ids or ():
+                stored.pop(vector_id, None)
+        return {}
+
+    def describe_index_stats(self):
+        return {"dimension": self.dimension, "total_vector_count": sum(len(stored) for stored in self.namespaces.values()),
+                "namespaces": {name: {"vector_count": len(stored)} for name, stored in self.namespaces.items() if stored}}
+
+
+def build_fake_embedding_manager(openai_ms=0, pinecone_ms=0, openai_failure_rate=0.0, pinecone_failure_rate=0.0):
+    """Build a real EmbeddingManager wired to in-memory OpenAI and Pinecone fakes."""
+    from embedding_manager import EmbeddingManager
+    manager = EmbeddingManager.__new__(EmbeddingManager) # Skip __init__: it connects to OpenAI and Pinecone
+    manager.openai_client = FakeOpenAIClient(openai_ms, failure_rate=openai_failure_rate)
+    manager.embedding_model = "text-embedding-3-large"
+    manager.pinecone_dimension = 3072
+    manager.index = FakePineconeIndex(pinecone_ms, failure_rate=pinecone_failure_rate)
+    return manager
+
+
+@functools.lru_cache(maxsize=None)
+def _fake_cognito_key():
+    # RSA key generation in pure Python takes a second or more: once per process, kept in memory.
+    import rsa
+    _, private_key = rsa.newkeys(2048)
+    return private_key.save_pkcs1().decode('utf-8')
+
+
+class _FakeJWKSResponse:
+    def __init__(self, keys):
+        self._keys = keys
+
+    def json(self):
+        return {"keys": self._keys}
+
+
+class FakeCognito:
+    def __init__(self, user_pool_id, client_id, region, latency_ms=50, failure_rate=0.0):
+        """
+        Local Cognito user pool: issues RS256 access tokens and serves the matching JWKS
+        to flask_awscognito's TokenService, so token verification runs the real code
+
+        Args:
+            user_pool_id, client_id, region: Values the app is configured with
+            latency_ms: Simulated round trip of each JWKS download
+            failure_rate: Probability that a JWKS download fails
+        """
+        from jose import jwk
+        self.user_pool_id = user_pool_id
+        self.client_id = client_id
+        self.region = region
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.jwks_requests = 0
+        self._private_pem = _fake_cognito_key()
+        public_jwk = jwk.construct(self._private_pem, 'RS256').public_key().to_dict()
+        public_jwk.update({"kid": "bench-key-1", "use": "sig"})
+        self._jwks = [public_jwk]
+
+    def issue_token(self, ttl_seconds=3600, sub="bench-user"):
+        from jose import jwt
+        claims = {"sub": sub, "client_id": self.client_id, "token_use": "access", "exp": int(time.time()) + ttl_seconds,
+                  "iss": f"https://cognito-idp.{self.region}.amazonaws.com/{self.user_pool_id}"}
+        return jwt.encode(claims, self._private_pem, algorithm='RS256', headers={"kid": "bench-key-1"})
+
+    def fetch_jwks(self, url):
+        import requests
+        self.jwks_requests += 1
+        try:
+            simulate_call("cognito", self.latency_ms, self.failure_rate)
+        except FakeServiceError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e # what requests.get raises on a network failure
+        return _FakeJWKSResponse(self._jwks)
+
+    def token_service_factory(self, user_pool_id, user_pool_client_id, region, _jwk_keys=None):
+        """Drop-in for flask_awscognito's token_service_factory that downloads the JWKS from this fake."""
+        from flask_awscognito.services.token_service import TokenService
+        return TokenService(user_pool_id, user_pool_client_id, region, request_client=self.fetch_jwks, _jwk_keys=_jwk_keys)
+
+
+def build_fake_rag_service(bedrock_ms=300, sagemaker_ms=400, chain_ms=1500, classification="UNCERTAIN",
+                           bedrock_failure_rate=0.0, sagemaker_failure_rate=0.0):
+    """
+    Build a real RAGService whose network clients are replaced by latency-injecting fakes,
+    so the request path (both sync and async) runs the production code.
+    """
+    from rag_service import RAGService
+    service = RAGService.__new__(RAGService) # Skip __init__: it connects to AWS, OpenAI and Pinecone
+    service.bedrock_runtime_client = FakeBedrockClient(bedrock_ms, classification, bedrock_failure_rate)
+    service.sagemaker_runtime_client = FakeSageMakerClient(sagemaker_ms, sagemaker_failure_rate)
+    service.qa_chain_rag = FakeQAChain(chain_ms)
+    return service
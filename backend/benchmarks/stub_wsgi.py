@@ -0,0 +1,23 @@
+# WSGI app with stubbed backends for load benchmarks:
+#
+#   gunicorn -c gunicorn.conf.py benchmarks.stub_wsgi:app
+#
+# Latency/CPU per request come from BENCH_LATENCY_MS and BENCH_CPU_MS.
+
+import os
+
+# Present-but-empty keys stop load_dotenv() from pulling real credentials in, so the real
+# RAGService refuses to start and nothing reaches OpenAI or Pinecone.
+for _key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+    os.environ[_key] = ""
+os.environ.setdefault("ADMISSION_CONTROL", "false") # one client far past the per-user limits
+
+import app as app_module
+from benchmarks.fakes import FakeRAGService
+
+app_module.app.config['TESTING'] = True # Skips Cognito token verification
+app_module.rag_service_instance = FakeRAGService(
+    latency_ms=float(os.getenv("BENCH_LATENCY_MS", "50")),
+    cpu_ms=float(os.getenv("BENCH_CPU_MS", "5")),
+)
+app = app_module.app
@@ -0,0 +1,322 @@
+# In-process benchmark suite for the Flask backend.
+#
+#   python -m benchmarks.suite                                   # run every scenario, print a table
+#   python -m benchmarks.suite --save-baseline                   # ...and store benchmarks/baselines/baseline.json
+#   python -m benchmarks.suite --compare benchmarks/baselines/baseline.json   # exit 1 on regressions
+#   python -m benchmarks.suite --scenarios chat_text --latency bedrock=800 --fail openai_chat=0.05
+#
+# Requests go through app.test_client() (routing, Cognito token verification, request parsing,
+# RAGService, the real ConversationalRetrievalChain, JSON encoding). Only the network calls are
+# replaced, by fakes with configurable latency and failure rates:
+#   cognito (JWKS download), bedrock, sagemaker, openai_chat, openai_embedding, pinecone, location
+#
+# Each scenario reports throughput, p50/p95/p99 latency, error rate and the peak of Python heap
+# allocations (tracemalloc, measured in a separate pass so tracing does not skew the latencies).
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(BENCH_DIR, 'baselines', 'baseline.json')
+RESULTS_FORMAT_VERSION = 1
+
+DEFAULT_LATENCY_MS = {
+    "cognito": 50,
+    "bedrock": 300,
+    "sagemaker": 400,
+    "openai_chat": 600,
+    "openai_embedding": 100,
+    "pinecone": 50,
+    "location": 150,
+}
+
+CHAT_BODY = {
+    "message": "My dog keeps scratching his ear and shaking his head",
+    "chat_history": [{"sender": "user", "text": "Hi"}, {"sender": "ai", "text": "Hello! How can I help?"}],
+}
+
+# scenario -> (path, default request count, default concurrency)
+SCENARIOS = {
+    "chat_text": ("/api/chat", 100, 8),
+    "chat_image": ("/api/chat", 50, 8),
+    "index": ("/api/index", 5, 1),
+    "find_vets": ("/api/find_vets", 200, 8),
+    "search_vets_by_text": ("/api/search_vets_by_text", 200, 8),
+}
+
+# A metric regresses when it is worse than the baseline by more than the relative tolerance
+# AND by more than this absolute amount (keeps sub-millisecond noise from being flagged).
+ABSOLUTE_FLOORS = {"p50_ms": 5.0, "p95_ms": 10.0, "p99_ms": 20.0, "throughput_rps": 0.5, "peak_memory_kib": 256.0}
+HIGHER_IS_BETTER = {"throughput_rps"}
+
+
+def _parse_overrides(pairs, option):
+    overrides = {}
+    for pair in pairs or []:
+        service, _, value = pair.partition("=")
+        if service not in DEFAULT_LATENCY_MS or not value:
+            raise SystemExit(f"{option} expects SERVICE=VALUE with SERVICE in {sorted(DEFAULT_LATENCY_MS)}, got '{pair}'")
+        overrides[service] = float(value)
+    return overrides
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class BenchEnvironment:
+    def __init__(self, latency_ms, failure_rates, work_dir, pdf_files=3, pdf_pages=10):
+        """
+        Import the Flask app with credentials blanked out and wire every external service to a fake
+
+        Args:
+            latency_ms: Per-service latency in milliseconds (keys of DEFAULT_LATENCY_MS)
+            failure_rates: Per-service failure probability
+            work_dir: Scratch directory for the PDF corpus and the page-text cache
+            pdf_files, pdf_pages: Size of the synthetic corpus indexed by the `index` scenario
+        """
+        # Present-but-empty keys stop load_dotenv() from pulling real credentials in.
+        for key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "AWS_LOCATION_PLACE_INDEX_NAME"):
+            os.environ[key] = ""
+        os.environ.setdefault("ADMISSION_CONTROL", "false") # one client far past the per-user limits
+        # Index generations made by the `index` scenario stay in the scratch directory, never in cache/.
+        os.environ["INDEX_GENERATION_STATE_PATH"] = os.path.join(work_dir, 'index_generation.json')
+        os.environ["LEXICAL_INDEX_DIR"] = os.path.join(work_dir, 'lexical_index')
+        os.environ["UPLOAD_ARCHIVE_DIR"] = os.path.join(work_dir, 'uploads')
+        import app as flask_backend
+        from benchmarks.fakes import FakeCognito, FakeLocationClient, build_fake_embedding_manager, build_fake_rag_service
+        from benchmarks.fake_langchain import FakeChatOpenAI, build_fake_retriever
+        from benchmarks.synthetic_pdfs import write_pdf_corpus
+        from page_cache import PageTextCache
+        from pdf_processor import PDFProcessor
+
+        self.flask_backend = flask_backend
+        app = flask_backend.app
+        app.config['TESTING'] = False # verify tokens for real, against the fake user pool
+        auth = flask_backend.aws_auth
+        auth.region, auth.user_pool_id, auth.user_pool_client_id = "us-east-1", "us-east-1_BENCH", "bench-client"
+        self.cognito = FakeCognito(auth.user_pool_id, auth.user_pool_client_id, auth.region,
+                                   latency_ms["cognito"], failure_rates["cognito"])
+        auth.token_service_factory = self.cognito.token_service_factory
+        self.auth_headers = {"Authorization": f"Bearer {self.cognito.issue_token()}"}
+
+        service = build_fake_rag_service(
+            bedrock_ms=latency_ms["bedrock"], sagemaker_ms=latency_ms["sagemaker"],
+            bedrock_failure_rate=failure_rates["bedrock"], sagemaker_failure_rate=failure_rates["sagemaker"],
+        )
+        del service.qa_chain_rag # rebuilt by the real factory from the fake LLM and retriever below
+        service.llm_rag = FakeChatOpenAI(latency_ms=latency_ms["openai_chat"], failure_rate=failure_rates["openai_chat"])
+        # Each index generation the `index` scenario activates gets a fake retriever of its own.
+        service._generation_retriever = lambda generation: build_fake_retriever(
+            latency_ms["openai_embedding"], latency_ms["pinecone"],
+            failure_rates["openai_embedding"], failure_rates["pinecone"],
+        )
+        service.retriever = service._generation_retriever(service.active_generation)
+        service.pdf_processor = PDFProcessor(page_cache=PageTextCache(os.path.join(work_dir, 'page_cache')))
+        service.embedding_manager = build_fake_embedding_manager(
+            latency_ms["openai_embedding"], latency_ms["pinecone"],
+            failure_rates["openai_embedding"], failure_rates["pinecone"],
+        )
+        flask_backend.rag_service_instance = service
+        flask_backend.LOCATION_PLACE_INDEX_NAME = "bench-place-index"
+        flask_backend.location_client = FakeLocationClient(latency_ms["location"], failure_rates["location"])
+
+        self.pdf_directory = os.path.join(work_dir, 'pdfs')
+        write_pdf_corpus(self.pdf_directory, pdf_files, pdf_pages, 40)
+        self.image_bytes = os.urandom(200 * 1024) # the fake endpoint does not decode it
+        self.client = app.test_client()
+
+    def request(self, scenario):
+        """Issue one request for `scenario` and return its HTTP status code."""
+        path = SCENARIOS[scenario][0]
+        if scenario == "chat_text":
+            response = self.client.post(path, json=CHAT_BODY, headers=self.auth_headers)
+        elif scenario == "chat_image":
+            data = {
+                "message": "What is this rash on my dog's belly?",
+                "chat_history": json.dumps(CHAT_BODY["chat_history"]),
+                "image": (io.BytesIO(self.image_bytes), "skin.jpg"),
+            }
+            response = self.client.post(path, data=data, content_type="multipart/form-data", headers=self.auth_headers)
+        elif scenario == "index":
+            response = self.client.post(path, json={"directory": self.pdf_directory}, headers=self.auth_headers)
+        elif scenario == "find_vets":
+            response = self.client.post(path, json={"latitude": 37.77, "longitude": -122.42}, headers=self.auth_headers)
+        else:
+            response = self.client.post(path, json={"query": "emergency vet Springfield"}, headers=self.auth_headers)
+        body = response.get_json(silent=True) or {}
+        # /api/chat reports handled service failures inside a 200 response.
+        if response.status_code == 200 and body.get("urgency") == "ERROR":
+            return 500
+        return response.status_code
+
+
+def run_scenario(env, scenario, num_requests, concurrency, measure_memory=True):
+    """
+    Run `num_requests` requests with `concurrency` client threads
+
+    Returns:
+        Dict of summary statistics for the scenario
+    """
+    def one(_):
+        start = time.perf_counter()
+        status = env.request(scenario)
+        return time.perf_counter() - start, status
+
+    env.request(scenario) # warm-up: lazy components, chain construction, page cache
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(num_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in samples]
+    errors = sum(1 for _, status in samples if status >= 400)
+    result = {
+        "requests": num_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "error_rate": round(errors / num_requests, 4),
+        "throughput_rps": round(num_requests / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+    }
+    if measure_memory:
+        tracemalloc.start()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(min(num_requests, max(concurrency * 2, 10)))))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_memory_kib"] = round(peak / 1024, 1)
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare_results(baseline, current, tolerance):
+    """
+    Compare two result documents scenario by scenario
+
+    Args:
+        baseline: Result document loaded from a previous run
+        current: Result document of this run
+        tolerance: Allowed relative slowdown, e.g. 0.2 for 20%
+
+    Returns:
+        List of (scenario, metric, baseline value, current value, relative change, regressed)
+    """
+    rows = []
+    for scenario, current_stats in current["scenarios"].items():
+        baseline_stats = baseline.get("scenarios", {}).get(scenario)
+        if not baseline_stats:
+            continue
+        for metric, floor in ABSOLUTE_FLOORS.items():
+            old, new = baseline_stats.get(metric), current_stats.get(metric)
+            if old is None or new is None:
+                continue
+            worse_by = (old - new) if metric in HIGHER_IS_BETTER else (new - old)
+            change = (new - old) / old if old else 0.0
+            rows.append((scenario, metric, old, new, change, worse_by > floor and worse_by > tolerance * abs(old)))
+        old_rate, new_rate = baseline_stats.get("error_rate", 0.0), current_stats.get("error_rate", 0.0)
+        rows.append((scenario, "error_rate", old_rate, new_rate, new_rate - old_rate, new_rate - old_rate > 0.01))
+    return rows
+
+
+def _print_results(results):
+    print(f"{'scenario':<21} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'peak KiB':>9}")
+    for scenario, stats in results["scenarios"].items():
+        peak = stats.get("peak_memory_kib")
+        print(f"{scenario:<21} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+              f"{stats['p99_ms']:>9.1f} {stats['error_rate']:>6.1%} {peak if peak is not None else '-':>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the backend endpoints in-process against latency-injecting fakes')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, help='Requests per scenario (default: per-scenario)')
+    parser.add_argument('--concurrency', type=int, help='Client threads per scenario (default: per-scenario)')
+    parser.add_argument('--latency', nargs='*', metavar='SERVICE=MS', help=f'Override fake latencies {DEFAULT_LATENCY_MS}')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Multiply every fake latency, e.g. 0.1 for a quick run')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Failure probability for every fake service')
+    parser.add_argument('--fail', nargs='*', metavar='SERVICE=RATE', help='Per-service failure probability')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc pass')
+    parser.add_argument('--output', help='Write this run as JSON')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE_PATH, help='Write this run as the baseline')
+    parser.add_argument('--compare', help='Baseline JSON to compare against; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown tolerated before flagging (default 0.2)')
+    parser.add_argument('--log-level', default='CRITICAL', help='Application log level during the run')
+    args = parser.parse_args()
+
+    latency_ms = {service: ms * args.latency_scale for service, ms in DEFAULT_LATENCY_MS.items()}
+    latency_ms.update(_parse_overrides(args.latency, '--latency'))
+    failure_rates = {service: args.failure_rate for service in DEFAULT_LATENCY_MS}
+    failure_rates.update(_parse_overrides(args.fail, '--fail'))
+    os.environ.setdefault("LOG_LEVEL", args.log_level)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = BenchEnvironment(latency_ms, failure_rates, work_dir)
+        results = {
+            "format_version": RESULTS_FORMAT_VERSION,
+            "meta": {
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                "git_commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "latency_ms": latency_ms,
+                "failure_rates": failure_rates,
+            },
+            "scenarios": {},
+        }
+        for scenario in args.scenarios:
+            _, default_requests, default_concurrency = SCENARIOS[scenario]
+            results["scenarios"][scenario] = run_scenario(
+                env, scenario, args.requests or default_requests, args.concurrency or default_concurrency,
+                measure_memory=not args.no_memory,
+            )
+            print(f"finished {scenario}", file=sys.stderr)
+
+    _print_results(results)
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("latency_ms") != latency_ms:
+            print("WARNING: baseline was recorded with different fake latencies; comparison may be meaningless.")
+        rows = compare_results(baseline, results, args.tolerance)
+        regressions = [row for row in rows if row[5]]
+        print(f"\nComparison against {args.compare} (tolerance {args.tolerance:.0%}):")
+        for scenario, metric, old, new, change, regressed in rows:
+            change_text = f"{change:+.3f}" if metric == "error_rate" else f"{change:+.1%}"
+            print(f"  {'REGRESSION' if regressed else 'ok':<10} {scenario:<21} {metric:<16} {old:>10} -> {new:<10} ({change_text})")
+        if regressions:
+            print(f"FAIL: {len(regressions)} regression(s) against the baseline")
+            sys.exit(1)
+        print("OK: no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Minimal PDF writer used to generate benchmark inputs without extra dependencies.
+
+import os
+import random
+
+_WORDS = (
+    "dog cat pet skin itching rash fungal ringworm demodicosis dermatitis allergy "
+    "vomiting diarrhea lethargy appetite fever vaccine parasite flea tick carprofen "
+    "dosage veterinarian clinic symptom treatment monitor hydration diet weight"
+).split()
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf_bytes(num_pages=10, lines_per_page=40, seed=0):
+    """
+    Build a text-only PDF document in memory
+
+    Args:
+        num_pages: Number of pages to generate
+        lines_per_page: Lines of pseudo-random veterinary text per page
+        seed: Seed for reproducible text
+
+    Returns:
+        PDF file content as bytes
+    """
+    rng = random.Random(seed)
+    objects = []  # object bodies, object number = index + 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog_num = add(None)
+    pages_num = add(None)
+    font_num = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_nums = []
+    for page_index in range(num_pages):
+        lines = [f"Page {page_index + 1}."]
+        lines += [" ".join(rng.choice(_WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 780 Td"]
+        ops += [f"({_escape(line)}) Tj T*" for line in lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content_num = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_nums.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_num, font_num, content_num)
+        ))
+    objects[catalog_num - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_num
+    kids = b" ".join(b"%d 0 R" % n for n in page_nums)
+    objects[pages_num - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_nums))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog_num, xref_offset
+    )
+    return bytes(out)
+
+
+def write_pdf_corpus(directory, num_files=5, num_pages=10, lines_per_page=40):
+    """
+    Write a directory of synthetic PDFs
+
+    Args:
+        directory: Target directory (created if missing)
+        num_files: Number of PDF files
+        num_pages: Pages per file
+        lines_per_page: Lines per page
+
+    Returns:
+        List of written file paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for file_index in range(num_files):
+        path = os.path.join(directory, f"synthetic_{file_index:03d}.pdf")
+        with open(path, "wb") as f:
+            f.write(build_pdf_bytes(num_pages, lines_per_page, seed=file_index))
+        paths.append(path)
+    return paths
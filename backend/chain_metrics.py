@@ -0,0 +1,137 @@
+#logging
+import logging
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import metrics
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'chain_metrics'
+
+# Tag carried by the LLM that condenses chat history + follow-up into a standalone question,
+# so its calls are reported separately from the answer generation.
+QUESTION_REWRITE_TAG = "question_rewrite"
+
+
+class PromptTokenUsage:
+    def __init__(self):
+        """Prompt tokens of one request's LLM calls, split by whether the provider served them from its prompt cache."""
+        self.cached = 0
+        self.uncached = 0
+        self.calls = 0
+        self._lock = threading.Lock() # async callbacks may run on executor threads
+
+    def add(self, cached, uncached):
+        with self._lock:
+            self.cached += cached
+            self.uncached += uncached
+            self.calls += 1
+
+    @property
+    def total(self):
+        return self.cached + self.uncached
+
+
+_current_usage = contextvars.ContextVar("prompt_token_usage", default=None)
+
+
+@contextmanager
+def prompt_usage_scope():
+    """Collect the prompt token usage of the LLM calls made inside the block into the yielded PromptTokenUsage."""
+    usage = PromptTokenUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def prompt_token_counts(response):
+    """
+    Prompt token counts reported by the API for one LLM call
+
+    Args:
+        response: LLMResult passed to on_llm_end (may be None)
+
+    Returns:
+        (cached tokens, total prompt tokens), or None if the response carries no usage
+    """
+    if response is None:
+        return None
+    # Chat models put usage on the message (langchain's usage_metadata); older paths only fill llm_output.
+    for generations in getattr(response, "generations", None) or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                details = usage.get("input_token_details") or {}
+                return details.get("cache_read") or 0, usage.get("input_tokens") or 0
+    token_usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    if "prompt_tokens" in token_usage:
+        details = token_usage.get("prompt_tokens_details") or {}
+        return details.get("cached_tokens") or 0, token_usage["prompt_tokens"]
+    return None
+
+
+class StageTimingCallbackHandler(BaseCallbackHandler):
+    """
+    Times the stages inside ConversationalRetrievalChain:
+    question_rewrite (condense LLM), pinecone_retrieval (the chain's retriever: hedged query
+    embedding + Pinecone search, fused with the lexical search when hybrid) and llm_generation (answer LLM), and counts the LLM calls' cached/uncached prompt tokens
+    (into llm_prompt_tokens_total and the enclosing prompt_usage_scope). Pass it per call via `config={"callbacks": [...]}`.
+    """
+
+    def __init__(self):
+        self._started = {} # run_id -> (stage, start time)
+
+    def _start(self, run_id, stage):
+        self._started[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id, error=False):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return None
+        stage, start = started
+        metrics.REGISTRY.observe_stage(stage, time.perf_counter() - start)
+        if error:
+            metrics.record_error(stage)
+        return stage
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self._start(run_id, QUESTION_REWRITE_TAG if tags and QUESTION_REWRITE_TAG in tags else "llm_generation")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        self._start(run_id, QUESTION_REWRITE_TAG if tags and QUESTION_REWRITE_TAG in tags else "llm_generation")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        stage = self._end(run_id)
+        counts = prompt_token_counts(response)
+        if stage is None or counts is None:
+            return
+        cached, total = counts
+        uncached = max(total - cached, 0)
+        metrics.increment("llm_prompt_tokens_total", cached, stage=stage, cache="hit")
+        metrics.increment("llm_prompt_tokens_total", uncached, stage=stage, cache="miss")
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.add(cached, uncached)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "pinecone_retrieval")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+
+# Stateless apart from in-flight run ids (unique per call), so one instance serves all requests.
+STAGE_TIMING_HANDLER = StageTimingCallbackHandler()
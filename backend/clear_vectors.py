@@ -1,12 +1,19 @@
 # Simple script to delete all vectors
+#
+#   python clear_vectors.py          # the active index generation's namespace (the one chat serves)
+#   python clear_vectors.py --all    # every generation (gen-* namespaces and the default one), their
+#                                    # lexical indexes and the generation state file
+#
+# Index generations: see index_generations.py.
 
 #logging
 import logging
-from logging.handlers import RotatingFileHandler
 
+import argparse
 import os
 from dotenv import load_dotenv
 from pinecone import Pinecone
+from logging_setup import configure_logging
 
 # --- Standalone Script Logging Setup ---
 LOG_DIR_SCRIPT_CV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
@@ -21,14 +28,7 @@ LOG_FILE_SCRIPT_CV = os.path.join(LOG_DIR_SCRIPT_CV, 'script_clear_vectors.log')
 def setup_clear_vectors_logging():
     logger_instance = logging.getLogger() # Get root logger
     if not logger_instance.hasHandlers(): # Only configure if no handlers exist
-        logging.basicConfig(
-            level=logging.INFO, 
-            format='%(asctime)s [%(levelname)-8s] %(name)-25s %(filename)s:%(lineno)d - %(message)s',
-            handlers=[
-                RotatingFileHandler(LOG_FILE_SCRIPT_CV, maxBytes=2*1024*1024, backupCount=3, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        configure_logging(LOG_FILE_SCRIPT_CV, default_level="INFO", max_bytes=2*1024*1024, backup_count=3)
     return logging.getLogger(__name__) # Logger name will be 'clear_vectors'
 
 cv_logger = setup_clear_vectors_logging()
@@ -36,7 +36,13 @@ cv_logger = setup_clear_vectors_logging()
 # Load environment variables
 load_dotenv()
 
-def clear_pinecone_index():
+def clear_pinecone_index(all_generations=False):
+    """
+    Args:
+        all_generations: Delete every index generation instead of only the active one's vectors
+    """
+    # Imported after load_dotenv(): the state file and lexical index paths are env-configurable.
+    import index_generations
     cv_logger.info("--- Attempting to clear all vectors from Pinecone index ---")
     # Initialize Pinecone
     pc = Pinecone(
@@ -49,15 +55,26 @@ def clear_pinecone_index():
     index = pc.Index(index_name)
     cv_logger.info(f"Successfully connected to Pinecone index: '{index}'.")
     
-    cv_logger.info(f"Sending command to delete all vectors from index: '{index}'...")
-    # Delete all vectors
-    delete_response = index.delete(delete_all=True)
-    cv_logger.info(f"Pinecone delete_all operation response for index '{index}': {delete_response}")
+    if all_generations:
+        cv_logger.info(f"Sending commands to delete every index generation from index: '{index}'...")
+        deleted = index_generations.delete_all_generations(index)
+        cv_logger.info(f"Deleted index generations {deleted}; the default namespace is active again. Restart serving processes.")
+    else:
+        # Chat retrieves from the active generation's namespace, not (only) the default one.
+        generation = index_generations.load_state()[0]
+        cv_logger.info(f"Sending command to delete all vectors of index generation '{generation.name}' "
+                       f"(namespace '{generation.namespace}') from index: '{index}'...")
+        index_generations.clear_namespace(index, generation.namespace)
     cv_logger.info(f"All vectors should now be cleared from index '{index}'. Note: Deletion might take a short while to reflect in stats.")
     
     cv_logger.info(f"--- Finished attempt to clear vectors from Pinecone index: {index} ---")
 
 if __name__ == "__main__":
     cv_logger.info("clear_vectors.py script started directly.")
-    clear_pinecone_index()
+    parser = argparse.ArgumentParser(description='Delete vectors from the Pinecone index')
+    parser.add_argument('--all', action='store_true',
+                        help="Delete every index generation, their lexical indexes and the generation state file, "
+                             "not only the active generation's vectors")
+    args = parser.parse_args()
+    clear_pinecone_index(all_generations=args.all)
     cv_logger.info("clear_vectors.py script finished.")
\ No newline at end of file
@@ -7,6 +7,7 @@ from openai import OpenAI
 import numpy as np
 from dotenv import load_dotenv
 from pinecone import Pinecone
+from logging_setup import EveryNth, CHUNK_LOG_SAMPLE_EVERY
 
 # Get a logger for this module
 logger = logging.getLogger(__name__) # Logger name will be 'embedding_manager'
@@ -14,6 +15,9 @@ logger = logging.getLogger(__name__) # Logger name will be 'embedding_manager'
 # Load environment variables
 load_dotenv()
 
+# create_embedding runs once per chunk while indexing: only 1 in N calls logs its debug records.
+_sample_embedding_debug = EveryNth(CHUNK_LOG_SAMPLE_EVERY)
+
 class EmbeddingManager:
     def __init__(self):
         """
@@ -56,20 +60,22 @@ class EmbeddingManager:
         Returns:
             Embedding vector adapted to Pinecone dimensions
         """
-        text_snippet = (text[:75] + "...") if len(text) > 75 else text
-        logger.debug(f"Creating OpenAI embedding using model '{self.embedding_model}' for text snippet: '{text_snippet}'")
+        log_debug = logger.isEnabledFor(logging.DEBUG) and _sample_embedding_debug()
+        if log_debug:
+            logger.debug("Creating OpenAI embedding using model '%s' for text snippet: '%.75s'", self.embedding_model, text)
         response = self.openai_client.embeddings.create(
             model=self.embedding_model,
             input=text
         )
         
         embedding = response.data[0].embedding
-        logger.debug(f"Successfully created embedding of dimension {len(embedding)} for text snippet: '{text_snippet}'.")
+        if log_debug:
+            logger.debug("Successfully created embedding of dimension %d for text snippet: '%.75s'.", len(embedding), text)
         
         # Adapt the embedding to match Pinecone index dimensions
         adapted_embedding = self._adapt_embedding_dimension(embedding, self.pinecone_dimension)
         if len(adapted_embedding) != self.pinecone_dimension:
-            logger.warning(f"Adapted embedding dimension {len(adapted_embedding)} does not match target {self.pinecone_dimension} for text snippet: '{text_snippet}'.")
+            logger.warning("Adapted embedding dimension %d does not match target %d for text snippet: '%.75s'.", len(adapted_embedding), self.pinecone_dimension, text)
         
         return adapted_embedding
     
@@ -98,18 +104,20 @@ class EmbeddingManager:
         
         # If current dimension is larger, truncate
         if current_dim > target_dim:
-            logger.debug(f"Truncating embedding from {current_dim} to {target_dim}.")
+            logger.debug("Truncating embedding from %d to %d.", current_dim, target_dim)
             return embedding[:target_dim]
         else: # If current dimension is smaller, pad with zeros
-            logger.debug(f"Padding embedding from {current_dim} to {target_dim} with zeros.")
+            logger.debug("Padding embedding from %d to %d with zeros.", current_dim, target_dim)
             return embedding + [0.0] * (target_dim - current_dim)
     
-    def upsert_documents(self, documents):
+    def upsert_documents(self, documents, namespace="", id_prefix="doc"):
         """
         Create embeddings for documents and insert them into Pinecone
         
         Args:
             documents: List of document chunks with text and metadata
+            namespace: Pinecone namespace to write to ("" is the default namespace)
+            id_prefix: Vector IDs are "<id_prefix>_<n>", n being the chunk's position in `documents`
             
         Returns:
             Number of vectors inserted
@@ -128,7 +136,7 @@ class EmbeddingManager:
             
             # Create vector record
             vector = {
-                "id": f"doc_{i}",
+                "id": f"{id_prefix}_{i}",
                 "values": embedding,
                 "metadata": {
                     "text": doc.page_content,
@@ -140,11 +148,11 @@ class EmbeddingManager:
             
             # When batch is full or at end of documents, upsert to Pinecone
             if len(vectors) >= batch_size or i == len(documents) - 1:
-                self.index.upsert(vectors=vectors)
-                print(f"Inserted batch of {len(vectors)} vectors")
+                self.index.upsert(vectors=vectors, namespace=namespace)
+                logger.debug("Inserted batch of %d vectors (%d/%d).", len(vectors), i + 1, len(documents))
                 vectors = []
         
-        logger.info(f"Finished upserting documents. Total vectors reported as upserted by Pinecone: {vectors}.")
+        logger.info(f"Finished upserting documents. Total vectors upserted to Pinecone: {len(documents)}.")
         return len(documents)
     
     def query_similar(self, query_text, top_k=5):
@@ -0,0 +1,50 @@
+# Gunicorn configuration for serving the PetHealth AI backend in production.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Tunables (environment variables):
+#   PORT               - listen port (default: 5000)
+#   GUNICORN_WORKERS   - number of preforked worker processes (default: 2 * CPUs + 1)
+#   GUNICORN_THREADS   - threads per worker; requests are I/O bound on Bedrock/OpenAI/Pinecone (default: 4)
+#   GUNICORN_TIMEOUT   - seconds before a silent worker is restarted (default: 120)
+#   WARM_UP_ON_START   - build clients and open connections in each worker before it accepts requests
+#   SESSION_STORE_PATH - SQLite file of the chat sessions (default: cache/sessions.sqlite3, see below)
+
+import gc
+import multiprocessing
+import os
+
+# A conversation's next message may reach any worker, so chat sessions (sessions.py) are shared
+# through a SQLite file on this host unless configured otherwise. Set before the app is imported.
+os.environ.setdefault("SESSION_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'sessions.sqlite3'))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = 5
+wsgi_app = "wsgi:app"
+
+# Import the application (and build RAGService, prompt templates, caches) once in the master.
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything allocated during preload into the permanent GC generation so that
+    # collections in the workers do not touch (and un-share) those pages.
+    gc.freeze()
+    server.log.info(f"Preloaded application frozen for copy-on-write sharing; spawning {workers} workers x {threads} threads.")
+
+
+def post_fork(server, worker):
+    # Sockets and connection pools must not be shared across processes: rebuild them per worker.
+    from app import reinitialize_clients_after_fork
+    reinitialize_clients_after_fork()
+
+
+def post_worker_init(worker):
+    # Runs in the worker before it accepts connections, so a warmed worker is ready when it is up.
+    from app import WARM_UP_ON_START, warm_up
+    if WARM_UP_ON_START:
+        warm_up()
@@ -0,0 +1,59 @@
+#logging
+import logging
+
+from typing import Any, List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import metrics
+import resilience
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'hedged_retriever'
+
+# Retriever wrapper used by the RAG chain: each retrieval gets at most `cap_seconds` of the
+# request deadline, is hedged once it runs past the observed p95 of single attempts, and is
+# skipped at once while the breaker is open. The chain reports the failure, and generate_response
+# falls back to its "trouble retrieving detailed information" answer.
+#
+# Each attempt of the inner retriever (query embedding + Pinecone search) is timed on its own, as
+# `attempt_stage`, and the hedge policy reads that stage: the chain's `pinecone_retrieval` timing
+# also covers hedged retries and, with hybrid retrieval, the lexical search, and a threshold taken
+# from it would keep creeping up.
+
+# The inner retriever runs without callbacks so its attempts are not timed as separate retrievals.
+_NO_CALLBACKS = {"callbacks": []}
+
+
+class HedgedRetriever(BaseRetriever):
+    inner: BaseRetriever
+    policy: Any
+    breaker: Any = None
+    cap_seconds: float = 5.0
+    stage: str = "pinecone_retrieval"
+    attempt_stage: str = "pinecone_query"
+
+    def _deadline(self):
+        return resilience.current_deadline() or resilience.Deadline()
+
+    def _attempt(self, query):
+        with metrics.stage_timer(self.attempt_stage):
+            return self.inner.invoke(query, config=_NO_CALLBACKS)
+
+    async def _aattempt(self, query):
+        with metrics.stage_timer(self.attempt_stage):
+            return await self.inner.ainvoke(query, config=_NO_CALLBACKS)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return resilience.hedged_call(
+            lambda: self._attempt(query),
+            self._deadline(), self.stage, self.policy, cap=self.cap_seconds, breaker=self.breaker
+        )
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return await resilience.ahedged_call(
+            lambda: self._aattempt(query),
+            self._deadline(), self.stage, self.policy, cap=self.cap_seconds, breaker=self.breaker
+        )
@@ -0,0 +1,122 @@
+#logging
+import logging
+
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import metrics
+import request_profiler
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'hybrid_retriever'
+
+# Retriever used by the RAG chain when a local lexical index exists: the vector retriever
+# (Pinecone, hedged and deadline-bounded) and BM25 over the same chunks run in parallel and their
+# rankings are merged by reciprocal rank fusion. If the vector side fails - its circuit is open,
+# it ran out of time, or it errored - the lexical results are used alone instead of failing the chain.
+
+RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_LEXICAL_CANDIDATES = int(os.getenv("HYBRID_LEXICAL_CANDIDATES", "10"))
+# Lexical hits scoring below this fraction of the best one only matched common words; fusing them
+# would let chunks that also share common words with the vector results outrank a rare-term hit.
+HYBRID_LEXICAL_MIN_SCORE_RATIO = float(os.getenv("HYBRID_LEXICAL_MIN_SCORE_RATIO", "0.25"))
+
+# The vector retrieval runs here while the request thread scores the lexical index.
+_vector_executor = None
+
+def _executor():
+    global _vector_executor
+    if _vector_executor is None: # created on first use so that it is never inherited across a fork
+        _vector_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HYBRID_THREADS", "32")), thread_name_prefix='hybrid-vector')
+    return _vector_executor
+
+
+def _reset_executor_in_child():
+    global _vector_executor
+    _vector_executor = None
+
+
+os.register_at_fork(after_in_child=_reset_executor_in_child)
+
+
+def _fusion_key(doc):
+    # Pinecone and the lexical index hold the same chunk text; IDs are not always returned.
+    return doc.page_content
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """
+    Merge ranked Document lists: each document scores sum(1 / (rrf_k + rank)) over the lists
+
+    Args:
+        rankings: Lists of Documents, best first
+        k: Number of documents to return
+        rrf_k: Damping constant; larger values flatten the advantage of top ranks
+
+    Returns:
+        Up to `k` Documents, best fused score first
+    """
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _fusion_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    vector: BaseRetriever
+    lexical: Any # lexical_index.LexicalIndex
+    k: int = 5
+    lexical_candidates: int = HYBRID_LEXICAL_CANDIDATES
+    lexical_min_score_ratio: float = HYBRID_LEXICAL_MIN_SCORE_RATIO
+
+    def _lexical_documents(self, query):
+        try:
+            hits = self.lexical.search(query, self.lexical_candidates)
+            cutoff = hits[0][1] * self.lexical_min_score_ratio if hits else 0.0
+            return [self.lexical.document(number) for number, score in hits if score >= cutoff]
+        except Exception as e:
+            logger.error(f"Lexical search failed, using vector results only: {e}", exc_info=True)
+            return []
+
+    def _fuse(self, vector_docs, vector_error, lexical_docs):
+        if vector_error is not None:
+            if not lexical_docs:
+                raise vector_error
+            logger.warning(f"Vector retrieval failed ({type(vector_error).__name__}: {vector_error}); answering from the lexical index.")
+            metrics.increment("hybrid_retrievals_total", mode="lexical_only")
+            return lexical_docs[:self.k]
+        metrics.increment("hybrid_retrievals_total", mode="fused" if lexical_docs else "vector_only")
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], self.k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # A copy of the context carries the request deadline into the vector call.
+        future = _executor().submit(contextvars.copy_context().run, request_profiler.propagate(self.vector.invoke), query, {"callbacks": []})
+        lexical_docs = self._lexical_documents(query)
+        try:
+            vector_docs, vector_error = future.result(), None
+        except Exception as e:
+            vector_docs, vector_error = None, e
+        return self._fuse(vector_docs, vector_error, lexical_docs)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector_result, lexical_docs = await asyncio.gather(
+            self.vector.ainvoke(query, config={"callbacks": []}),
+            asyncio.to_thread(self._lexical_documents, query),
+            return_exceptions=True
+        )
+        if isinstance(lexical_docs, BaseException):
+            raise lexical_docs
+        if isinstance(vector_result, BaseException):
+            return self._fuse(None, vector_result, lexical_docs)
+        return self._fuse(vector_result, None, lexical_docs)
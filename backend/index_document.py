@@ -1,11 +1,14 @@
 #logging
 import logging
-from logging.handlers import RotatingFileHandler
 
 import os
+import time
 import argparse
 from dotenv import load_dotenv
+import index_generations
+import rag_service as rag_service_module
 from rag_service import RAGService
+from logging_setup import configure_logging
 
 # --- Standalone Script Logging Setup ---
 # This setup is for when the script is run directly.
@@ -23,14 +26,7 @@ def setup_standalone_script_logging():
     logger_instance = logging.getLogger() # Get root logger
     # Only configure if no handlers are present (i.e., not run via Flask app which already configures)
     if not logger_instance.hasHandlers(): 
-        logging.basicConfig(
-            level=logging.INFO, # INFO for standalone script might be sufficient
-            format='%(asctime)s [%(levelname)-8s] %(name)-25s %(filename)s:%(lineno)d - %(message)s',
-            handlers=[
-                RotatingFileHandler(LOG_FILE_IDX_SCRIPT, maxBytes=5*1024*1024, backupCount=3, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        configure_logging(LOG_FILE_IDX_SCRIPT, default_level="INFO", max_bytes=5*1024*1024, backup_count=3)
     # Return a named logger for this script's specific messages
     return logging.getLogger(__name__) # Logger name will be 'index_document'
 
@@ -45,9 +41,13 @@ def main():
     parser = argparse.ArgumentParser(description='Index PDF documents for RAG')
     parser.add_argument('--directory', '-d', type=str, default='../pdfs',
                         help='Directory containing PDF files (default: pdfs)')
+    parser.add_argument('--no-gc-wait', action='store_true',
+                        help="Exit after the switch instead of waiting to delete the previous index generation "
+                             "(it is then deleted by the next indexing run)")
     args = parser.parse_args()
     
     pdf_directory = args.directory
+    pdf_directory_abs = os.path.abspath(pdf_directory)
     script_logger.debug(f"PDF directory argument received: '{pdf_directory}'")
     
     # Check if directory exists
@@ -63,7 +63,8 @@ def main():
     
     script_logger.info(f"Found {len(pdf_files)} PDF files to process in '{pdf_directory}'.")
     
-    # Initialize RAG service
+    # Initialize RAG service. Its components are lazy, so only the indexing stack
+    # (PDFProcessor, EmbeddingManager) is built here; the chat stack is never touched.
     script_logger.info("Initializing RAGService to perform indexing...")
     rag_service = RAGService()
     script_logger.info("RAGService initialized successfully by index_document.py.")
@@ -71,6 +72,9 @@ def main():
     # Index documents
     script_logger.info(f"Calling RAGService.index_documents for directory: '{pdf_directory}'...")
     try:
+        if rag_service_module.BLUE_GREEN_INDEXING:
+            # Generations retired by earlier runs that exited before their grace period ended.
+            index_generations.collect_garbage(rag_service.embedding_manager.index)
         num_indexed = rag_service.index_documents(pdf_directory)
         script_logger.info(
             f"RAGService.index_documents completed. Attempted to index {num_indexed} chunks "
@@ -78,6 +82,14 @@ def main():
         )
     except Exception as e:
         script_logger.error(f"Error indexing documents: {str(e)}", exc_info=True)
+        return
+
+    if rag_service_module.BLUE_GREEN_INDEXING and num_indexed and not args.no_gc_wait:
+        grace = index_generations.GENERATION_GC_GRACE_SECONDS
+        script_logger.info(f"Waiting {grace:.0f}s for serving processes to switch before deleting the previous index generation...")
+        time.sleep(grace)
+        collected = index_generations.collect_garbage(rag_service.embedding_manager.index, grace)
+        script_logger.info(f"Deleted retired index generations: {collected or 'none'}")
     
     script_logger.info("--- index_document.py script execution finished ---")
 
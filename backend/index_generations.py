@@ -0,0 +1,326 @@
+#logging
+import logging
+
+import fcntl
+import glob
+import json
+import os
+import secrets
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import lexical_index
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'index_generations'
+
+# Blue/green re-indexing. Every index_documents run writes a new generation - a fresh Pinecone
+# namespace plus its own lexical index directory - while the active one keeps serving. Once it is
+# validated it becomes active by rewriting a small state file; serving processes notice within
+# INDEX_GENERATION_CHECK_SECONDS and swap their retriever without a restart. The previous
+# generation is retired and deleted INDEX_GENERATION_GC_GRACE_SECONDS later, once no process can
+# still be reading it.
+#
+# State file (JSON): {"active": {generation}, "retired": [{generation, "retired_at": ...}, ...]}
+# Without a state file the "legacy" generation is active: the default namespace and
+# lexical_index.DEFAULT_INDEX_DIR, i.e. what indexing wrote before generations existed.
+# The file must be visible to every serving process (shared volume when there are several hosts).
+
+GENERATION_STATE_PATH = os.getenv(
+    "INDEX_GENERATION_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'index_generation.json')
+)
+GENERATION_CHECK_SECONDS = float(os.getenv("INDEX_GENERATION_CHECK_SECONDS", "5"))
+GENERATION_GC_GRACE_SECONDS = float(os.getenv("INDEX_GENERATION_GC_GRACE_SECONDS", "120"))
+GENERATION_VALIDATION_SAMPLES = int(os.getenv("INDEX_GENERATION_VALIDATION_SAMPLES", "5"))
+GENERATION_VALIDATION_TIMEOUT_SECONDS = float(os.getenv("INDEX_GENERATION_VALIDATION_TIMEOUT_SECONDS", "60"))
+
+
+class GenerationValidationError(RuntimeError):
+    """A freshly indexed generation did not pass validation and was not activated."""
+
+
+class GenerationBuildInProgress(RuntimeError):
+    """A new generation is being built; writes into the active one would be lost with it."""
+
+
+class Generation:
+    def __init__(self, name, namespace, lexical_dir, vectors=None, created=None):
+        """
+        One complete copy of the index
+
+        Args:
+            name: Generation name
+            namespace: Pinecone namespace holding its vectors ("" is the default namespace)
+            lexical_dir: Directory of its lexical index
+            vectors: Number of vectors indexed, once known
+            created: Creation time (epoch seconds)
+        """
+        self.name = name
+        self.namespace = namespace
+        self.lexical_dir = lexical_dir
+        self.vectors = vectors
+        self.created = time.time() if created is None else created
+
+    def to_dict(self):
+        return {"name": self.name, "namespace": self.namespace, "lexical_dir": self.lexical_dir,
+                "vectors": self.vectors, "created": self.created}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["namespace"], data["lexical_dir"], data.get("vectors"), data.get("created"))
+
+    def __eq__(self, other):
+        return isinstance(other, Generation) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return f"Generation({self.name!r}, namespace={self.namespace!r})"
+
+
+LEGACY_GENERATION = Generation("legacy", "", lexical_index.DEFAULT_INDEX_DIR, created=0.0)
+
+GENERATION_PREFIX = "gen-" # of every generation's name and namespace
+
+
+def _generation_named(name):
+    return Generation(name, name, f"{lexical_index.DEFAULT_INDEX_DIR}-{name}")
+
+
+def new_generation():
+    """A new, not yet indexed generation with its own namespace and lexical index directory."""
+    return _generation_named(f"{GENERATION_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(2)}")
+
+
+def load_state(path=None):
+    """
+    Returns:
+        (active Generation, list of (retired Generation, retired_at))
+    """
+    path = path or GENERATION_STATE_PATH
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return LEGACY_GENERATION, []
+    return (Generation.from_dict(state["active"]),
+            [(Generation.from_dict(entry), entry["retired_at"]) for entry in state.get("retired", [])])
+
+
+def _write_state(path, active, retired):
+    state = {"active": active.to_dict(), "retired": [{**generation.to_dict(), "retired_at": at} for generation, at in retired]}
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path) # readers see the old or the new file, never a partial one
+
+
+@contextmanager
+def _state_lock(path):
+    # Serialises read-modify-write of the state file between indexing runs and GC.
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def generation_build(path=None):
+    """
+    Held by an indexing run from reading its documents until the new generation is active.
+    Waits for writes into the active generation (see outside_generation_build) to finish first.
+    """
+    path = path or GENERATION_STATE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.build", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def outside_generation_build(path=None):
+    """
+    Held while writing into the active generation outside an indexing run (uploads). The lock
+    of an indexing run that crashed is released with its process.
+
+    Raises:
+        GenerationBuildInProgress: A new generation is being built; try again once it is active
+    """
+    path = path or GENERATION_STATE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.build", 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise GenerationBuildInProgress("A new index generation is being built; retry once it is active.") from None
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def activate(generation, path=None):
+    """
+    Make `generation` the active one and retire the previous
+
+    Returns:
+        The previously active Generation
+    """
+    path = path or GENERATION_STATE_PATH
+    with _state_lock(path):
+        previous, retired = load_state(path)
+        if previous == generation:
+            return previous
+        retired = [(g, at) for g, at in retired if g != generation] + [(previous, time.time())]
+        _write_state(path, generation, retired)
+    logger.info(f"Index generation '{generation.name}' is now active (namespace '{generation.namespace}'); "
+                f"'{previous.name}' retired.")
+    return previous
+
+
+def clear_namespace(index, namespace):
+    """Delete every vector in one namespace of the index."""
+    # Pinecone rejects delete_all on a namespace that does not exist (e.g. a legacy index never populated).
+    try:
+        index.delete(delete_all=True, namespace=namespace)
+    except Exception as e:
+        if "not found" not in str(e).lower():
+            raise
+
+
+def delete_generation(index, generation):
+    """Delete a generation's vectors and lexical index."""
+    clear_namespace(index, generation.namespace)
+    shutil.rmtree(generation.lexical_dir, ignore_errors=True)
+    logger.info(f"Deleted index generation '{generation.name}' (namespace '{generation.namespace}').")
+
+
+def delete_all_generations(index, path=None):
+    """
+    Delete every generation - the state file's, the gen-* namespaces found in the index and the
+    legacy one - with their lexical indexes, then the state file: the legacy generation is active
+    again, and empty. Serving processes must be restarted or re-indexed afterwards.
+
+    Returns:
+        Names of the generations deleted
+    """
+    path = path or GENERATION_STATE_PATH
+    with _state_lock(path):
+        active, retired = load_state(path)
+        namespaces = index.describe_index_stats().get("namespaces") or {}
+        # Known generations first: their recorded lexical directories win over the derived ones.
+        generations = {active, LEGACY_GENERATION} | {generation for generation, _ in retired}
+        generations |= {_generation_named(namespace) for namespace in namespaces if namespace.startswith(GENERATION_PREFIX)}
+        for generation in sorted(generations, key=lambda generation: generation.name):
+            delete_generation(index, generation)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    # Lexical indexes of runs that never got as far as the state file.
+    for directory in glob.glob(f"{lexical_index.DEFAULT_INDEX_DIR}-{GENERATION_PREFIX}*"):
+        shutil.rmtree(directory, ignore_errors=True)
+    logger.info(f"Deleted all {len(generations)} index generation(s); the state file '{path}' is removed.")
+    return sorted(generation.name for generation in generations)
+
+
+def collect_garbage(index, grace_seconds=None, path=None):
+    """
+    Delete generations retired more than `grace_seconds` ago
+
+    Args:
+        index: Pinecone Index holding the generations' namespaces
+        grace_seconds: Time serving processes get to move off a retired generation
+        path: State file
+
+    Returns:
+        Names of the generations deleted
+    """
+    grace_seconds = GENERATION_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    path = path or GENERATION_STATE_PATH
+    collected = []
+    with _state_lock(path):
+        active, retired = load_state(path)
+        kept = []
+        for generation, retired_at in retired:
+            if time.time() - retired_at < grace_seconds or generation == active:
+                kept.append((generation, retired_at))
+                continue
+            try:
+                delete_generation(index, generation)
+                collected.append(generation.name)
+            except Exception as e:
+                # Stays retired; the next collection retries.
+                logger.error(f"Failed to delete retired index generation '{generation.name}': {e}", exc_info=True)
+                kept.append((generation, retired_at))
+        if collected:
+            _write_state(path, active, kept)
+    return collected
+
+
+def schedule_garbage_collection(index, grace_seconds=None, path=None):
+    """Run collect_garbage once the grace period has passed, on a daemon timer thread."""
+    grace_seconds = GENERATION_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+
+    def run():
+        try:
+            collect_garbage(index, grace_seconds, path)
+        except Exception as e:
+            logger.error(f"Index generation garbage collection failed: {e}", exc_info=True)
+
+    timer = threading.Timer(grace_seconds + 1.0, run)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class GenerationWatcher:
+    def __init__(self, path=None, check_seconds=GENERATION_CHECK_SECONDS):
+        """
+        Cached view of the active generation; the state file is stat()ed at most every `check_seconds`
+
+        Args:
+            path: State file
+            check_seconds: Staleness bound of `current()`
+        """
+        self.path = path or GENERATION_STATE_PATH
+        self.check_seconds = check_seconds
+        self._active = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Returns: the active Generation, at most `check_seconds` stale."""
+        now = time.monotonic()
+        if self._active is not None and now - self._checked < self.check_seconds:
+            return self._active
+        with self._lock:
+            if self._active is None or now - self._checked >= self.check_seconds:
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                except FileNotFoundError:
+                    mtime = None
+                if self._active is None or mtime != self._mtime:
+                    self._active = load_state(self.path)[0]
+                    self._mtime = mtime
+                self._checked = now
+            return self._active
+
+    def refresh(self):
+        """Forget the cached generation, so the next current() reads the state file."""
+        with self._lock:
+            self._active = None
+
+
+GENERATION_WATCHER = GenerationWatcher()
@@ -0,0 +1,187 @@
+#logging
+import logging
+
+import json
+import math
+import os
+import re
+import shutil
+from collections import Counter
+
+import numpy as np
+
+import metrics
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'lexical_index'
+
+# Local BM25 index over the same chunks that are upserted to Pinecone, for the exact-term queries
+# dense retrieval misses (drug and condition names such as "carprofen" or "demodicosis").
+#
+# On-disk layout (one directory, replaced as a whole on rebuild):
+#   meta.json         - chunk count, average length, BM25 parameters
+#   terms.json        - term -> [offset into the postings arrays, document frequency]
+#   postings_docs.npy - int32 chunk numbers, grouped by term (memory-mapped)
+#   postings_tfs.npy  - uint16 term frequencies, aligned with postings_docs (memory-mapped)
+#   doc_lengths.npy   - int32 token count per chunk (memory-mapped)
+#   docs.jsonl        - one {"id", "text", "metadata"} line per chunk, read on demand
+#   doc_offsets.npy   - int64 byte offsets of those lines (N + 1 entries)
+
+DEFAULT_INDEX_DIR = os.getenv(
+    "LEXICAL_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'lexical_index')
+)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in into is it its my me "
+    "no not of on or our should so that the their them then there these they this to was we what "
+    "when which while who why will with you your".split()
+)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in _STOPWORDS]
+
+
+def build_lexical_index(documents, index_dir=DEFAULT_INDEX_DIR, ids=None):
+    """
+    Build the BM25 index for a list of chunks and replace the one in `index_dir`
+
+    Args:
+        documents: Langchain Document chunks, in upsert order
+        index_dir: Target directory
+        ids: Vector IDs of the chunks (default: "doc_<position>", as EmbeddingManager assigns them)
+
+    Returns:
+        Number of chunks indexed
+    """
+    postings = {} # term -> ([chunk numbers], [term frequencies])
+    doc_lengths = np.zeros(len(documents), dtype=np.int32)
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    offsets = [0]
+    with open(os.path.join(tmp_dir, 'docs.jsonl'), 'wb') as docs_file:
+        for number, doc in enumerate(documents):
+            tokens = tokenize(doc.page_content)
+            doc_lengths[number] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = ([], [])
+                entry[0].append(number)
+                entry[1].append(min(tf, 65535))
+            line = json.dumps({"id": ids[number] if ids else f"doc_{number}", "text": doc.page_content,
+                               "metadata": doc.metadata}, separators=(",", ":")).encode('utf-8') + b"\n"
+            docs_file.write(line)
+            offsets.append(offsets[-1] + len(line))
+
+    terms, docs_arrays, tfs_arrays, offset = {}, [], [], 0
+    for term in sorted(postings):
+        doc_numbers, tfs = postings[term]
+        terms[term] = [offset, len(doc_numbers)]
+        docs_arrays.append(np.asarray(doc_numbers, dtype=np.int32))
+        tfs_arrays.append(np.asarray(tfs, dtype=np.uint16))
+        offset += len(doc_numbers)
+    np.save(os.path.join(tmp_dir, 'postings_docs.npy'), np.concatenate(docs_arrays) if docs_arrays else np.zeros(0, np.int32))
+    np.save(os.path.join(tmp_dir, 'postings_tfs.npy'), np.concatenate(tfs_arrays) if tfs_arrays else np.zeros(0, np.uint16))
+    np.save(os.path.join(tmp_dir, 'doc_lengths.npy'), doc_lengths)
+    np.save(os.path.join(tmp_dir, 'doc_offsets.npy'), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp_dir, 'terms.json'), 'w', encoding='utf-8') as f:
+        json.dump(terms, f, separators=(",", ":"))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({"num_docs": len(documents), "avg_doc_length": float(doc_lengths.mean()) if len(documents) else 0.0,
+                   "k1": BM25_K1, "b": BM25_B, "num_terms": len(terms)}, f)
+
+    # Swap directories. A process still serving the old index keeps its memory-mapped files
+    # (unlinked files stay readable while mapped) until it loads the new one.
+    old_dir = f"{index_dir}.old-{os.getpid()}"
+    if os.path.exists(index_dir):
+        os.rename(index_dir, old_dir)
+    os.rename(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logger.info(f"Lexical index built in '{index_dir}': {len(documents)} chunks, {len(terms)} terms, {offset} postings.")
+    return len(documents)
+
+
+class LexicalIndex:
+    def __init__(self, index_dir):
+        """
+        Open a BM25 index built by build_lexical_index; the postings are memory-mapped, not read
+
+        Args:
+            index_dir: Index directory
+        """
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, 'terms.json'), 'r', encoding='utf-8') as f:
+            self.terms = json.load(f)
+        self.num_docs = meta["num_docs"]
+        self.k1, self.b = meta["k1"], meta["b"]
+        self.postings_docs = np.load(os.path.join(index_dir, 'postings_docs.npy'), mmap_mode='r')
+        self.postings_tfs = np.load(os.path.join(index_dir, 'postings_tfs.npy'), mmap_mode='r')
+        self.doc_offsets = np.load(os.path.join(index_dir, 'doc_offsets.npy'), mmap_mode='r')
+        doc_lengths = np.load(os.path.join(index_dir, 'doc_lengths.npy'), mmap_mode='r')
+        # Per-chunk part of the BM25 denominator, computed once: k1 * (1 - b + b * len / avg_len)
+        avg_length = meta["avg_doc_length"] or 1.0
+        self.length_norms = (self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)).astype(np.float32)
+        self._docs_file = open(os.path.join(index_dir, 'docs.jsonl'), 'rb')
+        logger.info(f"Lexical index loaded from '{index_dir}': {self.num_docs} chunks, {len(self.terms)} terms.")
+
+    @classmethod
+    def load(cls, index_dir=DEFAULT_INDEX_DIR):
+        """
+        Returns:
+            The LexicalIndex in `index_dir`, or None if none has been built there
+        """
+        if not os.path.exists(os.path.join(index_dir, 'meta.json')):
+            logger.info(f"No lexical index in '{index_dir}'; retrieval stays vector-only until documents are indexed.")
+            return None
+        return cls(index_dir)
+
+    def search(self, query, k=10):
+        """
+        Rank chunks by BM25 against `query`
+
+        Returns:
+            List of (chunk number, score), best first; chunks sharing no term with the query are left out
+        """
+        with metrics.stage_timer("lexical_search"):
+            scores = None
+            for term in set(tokenize(query)):
+                entry = self.terms.get(term)
+                if entry is None:
+                    continue
+                offset, df = entry
+                doc_numbers = self.postings_docs[offset:offset + df]
+                tfs = self.postings_tfs[offset:offset + df].astype(np.float32)
+                idf = math.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+                if scores is None:
+                    scores = np.zeros(self.num_docs, dtype=np.float32)
+                # A chunk appears once per term, so plain fancy-index accumulation is exact.
+                scores[doc_numbers] += idf * tfs * (self.k1 + 1.0) / (tfs + self.length_norms[doc_numbers])
+            if scores is None:
+                return []
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+            ranked = matched[np.argsort(scores[matched])[::-1]]
+            return [(int(number), float(scores[number])) for number in ranked]
+
+    def document(self, number):
+        """
+        Returns:
+            The chunk as a Langchain Document (id, page_content, metadata)
+        """
+        from langchain_core.documents import Document
+        start, end = int(self.doc_offsets[number]), int(self.doc_offsets[number + 1])
+        record = json.loads(os.pread(self._docs_file.fileno(), end - start, start))
+        return Document(id=record["id"], page_content=record["text"], metadata=record["metadata"])
+
+    def close(self):
+        self._docs_file.close()
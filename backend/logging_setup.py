@@ -0,0 +1,113 @@
+#logging
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import atexit
+import itertools
+import os
+import queue
+
+# Shared logging configuration for the Flask app and the standalone scripts.
+#
+# Request threads only put records on an in-memory queue (QueueHandler); a single listener
+# thread formats them and does the file/console I/O. Levels come from the environment:
+#   LOG_LEVEL   - root level (default given by the caller, INFO for the app)
+#   LOG_LEVELS  - per-logger overrides, e.g. "rag_service=DEBUG,embedding_manager=WARNING"
+#   LOG_CHUNK_SAMPLE_EVERY - emit 1 in N per-chunk debug records during indexing (default: 100)
+
+LOG_FORMAT = '%(asctime)s [%(levelname)-8s] %(name)-30s %(filename)s:%(lineno)d - %(message)s'
+
+_listener = None
+_handlers = []
+
+
+def _level_from_env(default_level):
+    return os.getenv("LOG_LEVEL", default_level).upper()
+
+
+def _apply_logger_overrides():
+    for item in filter(None, (part.strip() for part in os.getenv("LOG_LEVELS", "").split(","))):
+        name, _, level = item.partition("=")
+        if level:
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+
+def configure_logging(log_file, default_level="INFO", max_bytes=10*1024*1024, backup_count=5):
+    """
+    Route all logging through a queue to a background thread writing to `log_file` and stderr
+
+    Args:
+        log_file: Path of the rotating log file
+        default_level: Root level when LOG_LEVEL is not set
+        max_bytes: Size at which the log file rotates
+        backup_count: Number of rotated files to keep
+
+    Returns:
+        The root logger
+    """
+    global _listener, _handlers
+    stop_listener()
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    _handlers = [
+        RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'),
+        logging.StreamHandler(), # To also print to console
+    ]
+    for handler in _handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(_level_from_env(default_level))
+    _apply_logger_overrides()
+    _start_listener(root)
+    return root
+
+
+def _start_listener(root):
+    global _listener
+    log_queue = queue.SimpleQueue()
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    # respect_handler_level lets the file/console handlers keep their own thresholds.
+    _listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_listener():
+    """Flush queued records and stop the background logging thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener_in_child():
+    # The listener thread does not survive fork(); give the child its own queue and thread
+    # (e.g. gunicorn workers forked from a preloaded master).
+    global _listener
+    if _listener is not None:
+        _listener = None
+        _start_listener(logging.getLogger())
+
+
+os.register_at_fork(after_in_child=_restart_listener_in_child)
+atexit.register(stop_listener)
+
+
+class EveryNth:
+    """
+    Sampler for high-volume debug logs: calling it returns True once every `n` calls.
+    `itertools.count` is advanced atomically under the GIL, so instances can be shared across threads.
+    """
+    def __init__(self, n):
+        self.n = max(1, int(n))
+        self._counter = itertools.count()
+
+    def __call__(self):
+        return next(self._counter) % self.n == 0
+
+
+CHUNK_LOG_SAMPLE_EVERY = int(os.getenv("LOG_CHUNK_SAMPLE_EVERY", "100"))
@@ -0,0 +1,252 @@
+#logging
+import logging
+
+import bisect
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'metrics'
+
+# In-process latency histograms and counters for the request pipeline, rendered in the
+# Prometheus text exposition format by the `/metrics` endpoint. Each process (gunicorn worker)
+# keeps its own registry; Prometheus aggregates across scrape targets.
+
+METRIC_PREFIX = "pethealth"
+
+# Upper bounds (seconds) of the latency buckets: 1ms .. 60s, roughly x2.5 apart.
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+REPORTED_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+COUNTER_HELP = {
+    "stage_errors_total": "Errors raised or handled per pipeline stage.",
+    "cache_requests_total": "Cache lookups by cache and result (hit/miss).",
+    "jwks_refresh_total": "Downloads of the Cognito signing keys by result.",
+    "coalesce_executions_total": "Calls executed by a single-flight group (one per burst of identical requests).",
+    "coalesced_requests_total": "Requests answered by joining an identical call already in flight.",
+    "coalesce_retries_total": "Requests that joined an identical call whose failure was not shared, and ran again.",
+    "hedged_requests_total": "Calls that started a hedged second attempt, by stage and winning attempt.",
+    "deadline_exceeded_total": "Stages abandoned because the request deadline ran out.",
+    "circuit_breaker_rejections_total": "Calls skipped because the dependency's circuit was open.",
+    "circuit_breaker_transitions_total": "Circuit breaker state changes by breaker and new state.",
+    "admission_rejections_total": "Requests rejected with 429 by rate limit or stage queue, by scope and reason.",
+    "admission_store_errors_total": "Rate-limit checks admitted because the shared admission store failed.",
+    "hybrid_retrievals_total": "Chat retrievals by the hybrid retriever, by mode (fused, vector_only, lexical_only).",
+    "llm_prompt_tokens_total": "LLM prompt tokens by stage and provider prompt cache result (hit = served from the cache).",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        Fixed-bucket histogram
+
+        Args:
+            buckets: Sorted upper bounds; an implicit +Inf bucket is appended
+        """
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            (per-bucket counts, sum, count), consistent with each other
+        """
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def percentile(self, quantile, snapshot=None):
+        """
+        Estimate a quantile by linear interpolation inside the bucket that contains it
+
+        Args:
+            quantile: Value in [0, 1]
+            snapshot: Optional result of snapshot() to reuse
+
+        Returns:
+            Estimated value in seconds, or None if nothing was observed
+        """
+        counts, _, count = snapshot or self.snapshot()
+        if count == 0:
+            return None
+        rank = quantile * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets): # +Inf bucket: best estimate is its lower bound
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class StageTimer:
+    """
+    Context manager that records the wall time of a block into a stage histogram.
+    An exception leaving the block is counted as an error for that stage and re-raised.
+    """
+    __slots__ = ("registry", "stage", "start")
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe_stage(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.registry.record_error(self.stage)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        self.latency_buckets = latency_buckets
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _stage_histogram(self, stage):
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._stages.setdefault(stage, Histogram(self.latency_buckets))
+        return histogram
+
+    def observe_stage(self, stage, seconds):
+        self._stage_histogram(stage).observe(seconds)
+
+    def stage_timer(self, stage):
+        return StageTimer(self, stage)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def record_error(self, stage):
+        self.increment("stage_errors_total", stage=stage)
+
+    def record_cache(self, cache, hit):
+        self.increment("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    def stage_percentiles(self, stage, quantiles=REPORTED_QUANTILES):
+        """
+        Returns:
+            Dict of quantile -> seconds (None when the stage has no observations)
+        """
+        histogram = self._stage_histogram(stage)
+        snapshot = histogram.snapshot()
+        return {q: histogram.percentile(q, snapshot) for q in quantiles}
+
+    def stage_percentile(self, stage, quantile, min_samples=0):
+        """
+        Returns:
+            Estimated quantile of a stage in seconds, or None with fewer than `min_samples` observations
+        """
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            return None
+        snapshot = histogram.snapshot()
+        if snapshot[2] < max(1, min_samples):
+            return None
+        return histogram.percentile(quantile, snapshot)
+
+    def counter_value(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def render_prometheus(self):
+        """
+        Render all metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            stages = sorted(self._stages.items())
+            counters = sorted(self._counters.items())
+
+        latency_name = f"{METRIC_PREFIX}_stage_latency_seconds"
+        quantile_name = f"{METRIC_PREFIX}_stage_latency_quantile_seconds"
+        lines.append(f"# HELP {latency_name} Wall time spent in each request pipeline stage.")
+        lines.append(f"# TYPE {latency_name} histogram")
+        quantile_lines = []
+        for stage, histogram in stages:
+            counts, total, count = snapshot = histogram.snapshot()
+            cumulative = 0
+            for upper, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{latency_name}_bucket{{stage="{stage}",le="{upper}"}} {cumulative}')
+            lines.append(f'{latency_name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{latency_name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{latency_name}_count{{stage="{stage}"}} {count}')
+            for quantile in REPORTED_QUANTILES:
+                value = histogram.percentile(quantile, snapshot)
+                if value is not None:
+                    quantile_lines.append(f'{quantile_name}{{stage="{stage}",quantile="{quantile}"}} {value:.6f}')
+        lines.append(f"# HELP {quantile_name} Per-stage latency percentiles estimated from the histogram buckets.")
+        lines.append(f"# TYPE {quantile_name} gauge")
+        lines.extend(quantile_lines)
+
+        seen_counter_names = set()
+        for (name, labels), value in counters:
+            full_name = f"{METRIC_PREFIX}_{name}"
+            if name not in seen_counter_names:
+                seen_counter_names.add(name)
+                lines.append(f"# HELP {full_name} {COUNTER_HELP.get(name, name)}")
+                lines.append(f"# TYPE {full_name} counter")
+            label_text = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels)
+            lines.append(f"{full_name}{{{label_text}}} {value}" if label_text else f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Process-wide registry used by the application modules.
+REGISTRY = MetricsRegistry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def stage_timer(stage):
+    """Time a block as `stage`, e.g. `with metrics.stage_timer("bedrock_classification"): ...`."""
+    return StageTimer(REGISTRY, stage)
+
+
+def record_error(stage):
+    REGISTRY.record_error(stage)
+
+
+def record_cache(cache, hit):
+    REGISTRY.record_cache(cache, hit)
+
+
+def increment(name, amount=1, **labels):
+    REGISTRY.increment(name, amount, **labels)
+
+
+def render_prometheus():
+    return REGISTRY.render_prometheus()
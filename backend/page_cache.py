@@ -0,0 +1,262 @@
+#logging
+import logging
+
+import os
+import json
+import hashlib
+import struct
+import tempfile
+import threading
+import zlib
+
+import metrics
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'page_cache'
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "PDF_PAGE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'pdf_pages')
+)
+
+# On-disk layout of one cache entry (<sha256>.pages):
+#   magic (8 bytes) | page count N (uint32) | N+1 offsets (uint64, relative to data start) | zlib pages...
+# The offset table makes every page addressable without decompressing the rest of the file.
+_MAGIC = b"PHPAGES1"
+_COUNT_FMT = "<I"
+_OFFSET_FMT = "<Q"
+_HEADER_SIZE = len(_MAGIC) + struct.calcsize(_COUNT_FMT)
+_OFFSET_SIZE = struct.calcsize(_OFFSET_FMT)
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class PageTextCache:
+    def __init__(self, cache_dir=None, compression_level=6):
+        """
+        Initialize a persistent cache of extracted PDF page text
+
+        Args:
+            cache_dir: Directory holding the cache entries (default: PDF_PAGE_CACHE_DIR or backend/cache/pdf_pages)
+            compression_level: zlib level used when writing pages
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.compression_level = compression_level
+        self._index_path = os.path.join(self.cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        logger.info(f"PageTextCache initialized at '{self.cache_dir}' with {len(self._index)} tracked files.")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Page cache index '{self._index_path}' unreadable, starting empty: {e}")
+            return {}
+
+    def _save_index(self):
+        self._atomic_write(self._index_path, json.dumps(self._index, sort_keys=True).encode('utf-8'))
+
+    def _atomic_write(self, path, payload):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _entry_path(self, content_hash):
+        return os.path.join(self.cache_dir, f"{content_hash}.pages")
+
+    @staticmethod
+    def hash_file(pdf_path):
+        """
+        Compute the SHA-256 of a file's content
+
+        Args:
+            pdf_path: Path to the file
+
+        Returns:
+            Hex digest string
+        """
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def content_hash(self, pdf_path):
+        """
+        Return the content hash for a file, reusing the stored hash when size and mtime are unchanged
+
+        Args:
+            pdf_path: Path to the file
+
+        Returns:
+            Hex digest string
+        """
+        abs_path = os.path.abspath(pdf_path)
+        stat = os.stat(abs_path)
+        known = self._index.get(abs_path)
+        if known and known.get('size') == stat.st_size and known.get('mtime_ns') == stat.st_mtime_ns:
+            return known['sha256']
+        return self.hash_file(abs_path)
+
+    def get_pages(self, pdf_path):
+        """
+        Return cached page texts for a file, or None on a miss
+
+        A changed file gets a new content hash, so stale entries are never returned.
+
+        Args:
+            pdf_path: Path to the PDF file
+
+        Returns:
+            List of page strings, or None if the file is not cached
+        """
+        content_hash = self.content_hash(pdf_path)
+        entry_path = self._entry_path(content_hash)
+        try:
+            pages = self._read_entry(entry_path)
+        except FileNotFoundError:
+            logger.debug("Page cache miss for '%s' (%s).", pdf_path, content_hash[:12])
+            metrics.record_cache("pdf_page_cache", hit=False)
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Discarding corrupt page cache entry '{entry_path}': {e}")
+            self._remove_entry(content_hash)
+            metrics.record_cache("pdf_page_cache", hit=False)
+            return None
+        metrics.record_cache("pdf_page_cache", hit=True)
+        self._track(pdf_path, content_hash)
+        logger.debug("Page cache hit for '%s' (%d pages).", pdf_path, len(pages))
+        return pages
+
+    def get_page(self, pdf_path, page_number):
+        """
+        Return the text of a single cached page without decompressing the others
+
+        Args:
+            pdf_path: Path to the PDF file
+            page_number: Zero-based page index
+
+        Returns:
+            Page string, or None if the file is not cached
+        """
+        entry_path = self._entry_path(self.content_hash(pdf_path))
+        try:
+            with open(entry_path, 'rb') as f:
+                count = self._read_header(f)
+                if not 0 <= page_number < count:
+                    raise IndexError(f"Page {page_number} out of range for {count}-page entry.")
+                f.seek(_HEADER_SIZE + page_number * _OFFSET_SIZE)
+                start, end = struct.unpack(f"<2Q", f.read(2 * _OFFSET_SIZE))
+                f.seek(_HEADER_SIZE + (count + 1) * _OFFSET_SIZE + start)
+                return zlib.decompress(f.read(end - start)).decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+    def put_pages(self, pdf_path, pages):
+        """
+        Store extracted page texts for a file
+
+        Args:
+            pdf_path: Path to the PDF file the pages came from
+            pages: List of page strings
+        """
+        content_hash = self.content_hash(pdf_path)
+        blobs = [zlib.compress(page.encode('utf-8'), self.compression_level) for page in pages]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        payload = b"".join([
+            _MAGIC,
+            struct.pack(_COUNT_FMT, len(blobs)),
+            struct.pack(f"<{len(offsets)}Q", *offsets),
+            *blobs,
+        ])
+        self._atomic_write(self._entry_path(content_hash), payload)
+        self._track(pdf_path, content_hash)
+        logger.debug("Cached %d pages for '%s' (%d compressed bytes).", len(pages), pdf_path, offsets[-1])
+
+    def invalidate(self, pdf_path):
+        """
+        Drop the cache entry for a file
+
+        Args:
+            pdf_path: Path to the PDF file
+        """
+        abs_path = os.path.abspath(pdf_path)
+        with self._lock:
+            known = self._index.pop(abs_path, None)
+            if known:
+                self._remove_entry_if_unreferenced(known['sha256'])
+                self._save_index()
+
+    def prune(self):
+        """
+        Remove entries whose source files no longer exist, and any orphaned entry files
+
+        Returns:
+            Number of entry files removed
+        """
+        removed = 0
+        with self._lock:
+            for abs_path in [p for p in self._index if not os.path.exists(p)]:
+                del self._index[abs_path]
+            live_hashes = {entry['sha256'] for entry in self._index.values()}
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.pages') and filename[:-len('.pages')] not in live_hashes:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                    removed += 1
+            self._save_index()
+        logger.info(f"Page cache prune removed {removed} entries.")
+        return removed
+
+    def _track(self, pdf_path, content_hash):
+        abs_path = os.path.abspath(pdf_path)
+        stat = os.stat(abs_path)
+        record = {'sha256': content_hash, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        with self._lock:
+            previous = self._index.get(abs_path)
+            if previous == record:
+                return
+            self._index[abs_path] = record
+            # The file changed under the same path: its old entry is stale.
+            if previous and previous['sha256'] != content_hash:
+                self._remove_entry_if_unreferenced(previous['sha256'])
+            self._save_index()
+
+    def _remove_entry_if_unreferenced(self, content_hash):
+        if not any(entry['sha256'] == content_hash for entry in self._index.values()):
+            self._remove_entry(content_hash)
+
+    def _remove_entry(self, content_hash):
+        try:
+            os.remove(self._entry_path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _read_header(f):
+        header = f.read(_HEADER_SIZE)
+        if len(header) != _HEADER_SIZE or not header.startswith(_MAGIC):
+            raise ValueError("Bad page cache entry header.")
+        (count,) = struct.unpack(_COUNT_FMT, header[len(_MAGIC):])
+        return count
+
+    def _read_entry(self, entry_path):
+        with open(entry_path, 'rb') as f:
+            count = self._read_header(f)
+            offsets = struct.unpack(f"<{count + 1}Q", f.read((count + 1) * _OFFSET_SIZE))
+            data = f.read()
+        if len(data) != offsets[-1]:
+            raise ValueError("Truncated page cache entry.")
+        view = memoryview(data)
+        return [zlib.decompress(view[start:end]).decode('utf-8') for start, end in zip(offsets, offsets[1:])]
@@ -4,22 +4,31 @@ import logging
 import os
 from PyPDF2 import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from page_cache import PageTextCache
 
 # Get a logger for this module
 logger = logging.getLogger(__name__) # Logger name will be 'pdf_processor'
 
 class PDFProcessor:
-    def __init__(self, chunk_size=1000, chunk_overlap=200):
+    def __init__(self, chunk_size=1000, chunk_overlap=200, page_cache=None, use_page_cache=True):
         """
         Initialize PDF processor with chunk size and overlap parameters
         
         Args:
             chunk_size: Number of characters in each chunk
             chunk_overlap: Number of characters to overlap between chunks
+            page_cache: Optional PageTextCache for extracted page text (created on demand if omitted)
+            use_page_cache: Set to False to always re-parse PDFs with PyPDF2
         """
         logger.info(f"Initializing PDFProcessor with chunk_size={chunk_size}, chunk_overlap={chunk_overlap}.")
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.page_cache = page_cache
+        if self.page_cache is None and use_page_cache:
+            try:
+                self.page_cache = PageTextCache()
+            except OSError as e:
+                logger.warning(f"PDF page cache unavailable, PDFs will be re-parsed on every run: {e}")
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -37,21 +46,56 @@ class PDFProcessor:
         Returns:
             String containing all text from the PDF
         """
+        text = "".join(self.extract_pages_from_pdf(pdf_path))
+        logger.info(f"Successfully extracted text from '{os.path.basename(pdf_path)}'")
+        return text
+
+    def extract_pages_from_pdf(self, pdf_path):
+        """
+        Extract per-page text from a PDF file, served from the page cache when the file is unchanged
+        
+        Args:
+            pdf_path: Path to the PDF file
+            
+        Returns:
+            List of strings, one per page
+        """
         logger.info(f"Attempting to extract text from PDF: '{pdf_path}'")
         if not os.path.exists(pdf_path):
             logger.error(f"PDF file not found at path: '{pdf_path}'")
             raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+
+        if self.page_cache is not None:
+            pages = self.page_cache.get_pages(pdf_path)
+            if pages is not None:
+                logger.info(f"Loaded {len(pages)} pages for '{os.path.basename(pdf_path)}' from page cache.")
+                return pages
             
         with open(pdf_path, 'rb') as file:
             pdf_reader = PdfReader(file)
-            text = ""
-            
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        
-        logger.info(f"Successfully extracted text from '{os.path.basename(pdf_path)}'")
-        return text
+            pages = [page.extract_text() or "" for page in pdf_reader.pages]
+
+        if self.page_cache is not None:
+            try:
+                self.page_cache.put_pages(pdf_path, pages)
+            except OSError as e:
+                logger.warning(f"Could not write page cache entry for '{pdf_path}': {e}")
+        return pages
     
+    def extract_pages_from_stream(self, stream):
+        """
+        Extract per-page text from a PDF file object (e.g. an upload); the page cache is not used
+
+        Args:
+            stream: Seekable binary file object
+
+        Returns:
+            List of strings, one per page
+        """
+        stream.seek(0)
+        pdf_reader = PdfReader(stream)
+        return [page.extract_text() or "" for page in pdf_reader.pages]
+
     def process_directory(self, directory_path):
         """
         Process all PDFs in a directory
@@ -67,7 +111,7 @@ class PDFProcessor:
 
         if not os.path.isdir(directory_path):
             logger.error(f"Provided path is not a directory: '{directory_path}'")
-            return all_langchain_documents # Return empty list
+            return all_chunks # Return empty list
         
         for filename in os.listdir(directory_path):
             if filename.endswith('.pdf'):
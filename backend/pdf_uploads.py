@@ -0,0 +1,139 @@
+#logging
+import logging
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from werkzeug.utils import secure_filename
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'pdf_uploads'
+
+# PDFs uploaded to /api/index/upload (app.py and asgi_app.py) instead of being copied into the
+# server-side folder /api/index reads. The multipart parser streams every file part into a
+# SpooledTemporaryFile: up to UPLOAD_SPOOL_MAX_BYTES stays in memory, larger parts roll over to
+# a temporary file in UPLOAD_SPOOL_DIR (the system temp dir if unset), so no upload is ever held
+# in memory whole. Requests over UPLOAD_MAX_BYTES are rejected before their body is read.
+# RAGService.index_uploaded_pdfs then indexes each PDF on its own into the active index
+# generation, at most UPLOAD_INDEX_CONCURRENCY at a time.
+#
+# Every indexed upload is also kept in UPLOAD_ARCHIVE_DIR, as <vector ID prefix>/<file name>;
+# a re-index (RAGService.index_documents) embeds the archive along with the PDF folder, so the
+# new generation keeps every uploaded document under the same vector IDs. The directory must be
+# shared by the serving processes and the indexing host. With blue/green indexing, uploads are
+# refused (409) while a new generation is being built, since they would land in the old one.
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+UPLOAD_INDEX_CONCURRENCY = int(os.getenv("UPLOAD_INDEX_CONCURRENCY", "2"))
+UPLOAD_ARCHIVE_DIR = os.getenv("UPLOAD_ARCHIVE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+
+BUILD_RETRY_AFTER_SECONDS = int(os.getenv("UPLOAD_BUILD_RETRY_AFTER_SECONDS", "60")) # Retry-After of a 409 during a build
+
+UPLOAD_FIELD = "files" # multipart field name; repeat it for several PDFs
+
+PDF_MAGIC = b"%PDF-"
+
+
+def spooled_stream(*args, **kwargs):
+    """Stream factory for werkzeug's and Quart's multipart parsers (their arguments are not needed)."""
+    return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, mode="rb+", dir=UPLOAD_SPOOL_DIR)
+
+
+def source_name(filename):
+    """File name stored as the chunks' "source" metadata: no path parts, safe characters only."""
+    name = secure_filename(filename or "")
+    return name if name.lower().endswith(".pdf") else f"{name or 'upload'}.pdf"
+
+
+def vector_id_prefix(user, source):
+    """
+    Vector ID prefix of an uploaded document's chunks ("<prefix>_<n>"). Derived from the uploading
+    user and the file name: a user's new version of a file overwrites its previous vectors, while
+    another user's file of the same name gets vectors of its own.
+
+    Args:
+        user: Uploading user (admission.current_user())
+        source: Sanitised file name (source_name())
+    """
+    key = f"{user}\n{source}".encode('utf-8')
+    return f"upload-{hashlib.sha1(key).hexdigest()[:16]}"
+
+
+def is_pdf(stream):
+    """True if the file object starts with the PDF header; leaves it at position 0."""
+    stream.seek(0)
+    head = stream.read(len(PDF_MAGIC))
+    stream.seek(0)
+    return head == PDF_MAGIC
+
+
+def stream_size(stream):
+    """Size in bytes of a seekable file object; leaves it at position 0."""
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    return size
+
+
+def archive_upload(stream, source, id_prefix):
+    """
+    Keep an indexed upload in UPLOAD_ARCHIVE_DIR for re-indexing, replacing an earlier version
+
+    Args:
+        stream: Seekable binary file object holding the PDF
+        source: Sanitised file name (source_name())
+        id_prefix: The document's vector ID prefix (vector_id_prefix())
+
+    Returns:
+        Path written
+    """
+    directory = os.path.join(UPLOAD_ARCHIVE_DIR, id_prefix)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, source)
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    stream.seek(0)
+    with open(tmp_path, 'wb') as f:
+        shutil.copyfileobj(stream, f)
+    os.replace(tmp_path, path) # a concurrent re-index sees the old or the new file, never a partial one
+    stream.seek(0)
+    logger.info(f"Archived uploaded PDF '{source}' to '{path}'.")
+    return path
+
+
+def archived_uploads():
+    """
+    Returns:
+        (vector ID prefix, file name, path) of every archived upload, sorted by prefix
+    """
+    if not os.path.isdir(UPLOAD_ARCHIVE_DIR):
+        return []
+    uploads = []
+    for id_prefix in sorted(os.listdir(UPLOAD_ARCHIVE_DIR)):
+        directory = os.path.join(UPLOAD_ARCHIVE_DIR, id_prefix)
+        if not os.path.isdir(directory):
+            continue
+        for source in sorted(os.listdir(directory)):
+            if source.lower().endswith('.pdf'):
+                uploads.append((id_prefix, source, os.path.join(directory, source)))
+    return uploads
+
+
+def upload_response(results, seconds):
+    """
+    Response body and status for an upload request
+
+    Args:
+        results: RAGService.index_uploaded_pdfs results
+        seconds: Wall time of the whole request's indexing
+
+    Returns:
+        (dict, HTTP status): 200 if every PDF was indexed, 207 if only some, 500 if none
+    """
+    indexed = [result for result in results if "error" not in result]
+    status = 200 if len(indexed) == len(results) else 207 if indexed else 500
+    return {"success": status == 200, "uploads": results, "chunks": sum(result["chunks"] for result in indexed),
+            "seconds": round(seconds, 4)}, status
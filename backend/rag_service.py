@@ -3,22 +3,26 @@ import logging
 
 import os
 from dotenv import load_dotenv
-import boto3
 import json
 import ast
 import base64
-
-# Langchain components
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain.prompts import PromptTemplate
-from langchain_core.messages import HumanMessage, AIMessage
-
-# existing helper classes for indexing
-from embedding_manager import EmbeddingManager # This will use text-embedding-3-large
-from pdf_processor import PDFProcessor
+import contextlib
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import admission
+import index_generations
+import metrics
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, Deadline, HedgePolicy
+from singleflight import SingleFlight, normalize_text
+from sessions import as_history
+
+# boto3, the Langchain components and the indexing helpers (EmbeddingManager, PDFProcessor) are
+# imported inside the component factories below: together they dominate import time, and a
+# serving process never needs the indexing stack (nor an indexing run the chat stack).
 
 # Get a logger for this module. It will inherit configuration from app.py's basicConfig.
 logger = logging.getLogger(__name__) # Logger name will be 'rag_service'
@@ -42,6 +46,134 @@ SAGEMAKER_SKIN_ANALYSIS_ENDPOINT_NAME = os.getenv("SAGEMAKER_SKIN_ENDPOINT_NAME"
 SAGEMAKER_SKIN_ENDPOINT_CONTENT_TYPE = os.getenv("SAGEMAKER_SKIN_CONTENT_TYPE", "application/x-image") 
 SAGEMAKER_SKIN_ENDPOINT_ACCEPT_TYPE = "application/json"
 
+# Per-stage caps (seconds) within the request deadline (resilience.CHAT_DEADLINE_SECONDS). The SDK
+# timeouts match them, so a call abandoned at its deadline does not linger for the SDK defaults.
+AWS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("AWS_CONNECT_TIMEOUT_SECONDS", "3"))
+BEDROCK_TIMEOUT_SECONDS = float(os.getenv("BEDROCK_TIMEOUT_SECONDS", "5"))
+SAGEMAKER_TIMEOUT_SECONDS = float(os.getenv("SAGEMAKER_TIMEOUT_SECONDS", "10"))
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "5"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+
+# One breaker per dependency, shared by all requests of the process. "rag_chain" covers the
+# whole ConversationalRetrievalChain (OpenAI calls and retrieval).
+BEDROCK_BREAKER = CircuitBreaker("bedrock")
+SAGEMAKER_BREAKER = CircuitBreaker("sagemaker")
+RETRIEVAL_BREAKER = CircuitBreaker("pinecone_retrieval")
+RAG_CHAIN_BREAKER = CircuitBreaker("rag_chain")
+# Classification and retrieval are cheap, idempotent reads, so slow attempts are hedged.
+CLASSIFICATION_HEDGE = HedgePolicy("bedrock_classification", default_delay=1.0)
+RETRIEVAL_HEDGE = HedgePolicy("pinecone_query", default_delay=0.5) # single Pinecone attempts (hedged_retriever.py)
+
+# BM25 over the indexed chunks (lexical_index.py), fused with the Pinecone results and used alone
+# while Pinecone is unavailable. Built by index_documents; set HYBRID_RETRIEVAL=false for vector-only.
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+
+# index_documents builds a new index generation next to the serving one and switches to it once
+# validated (see index_generations.py). BLUE_GREEN_INDEXING=false re-indexes the active one in place.
+BLUE_GREEN_INDEXING = os.getenv("BLUE_GREEN_INDEXING", "true").lower() in ("1", "true", "yes")
+_generation_switch_lock = threading.Lock()
+
+def _aws_client_config(read_timeout):
+    from botocore.config import Config
+    return Config(connect_timeout=AWS_CONNECT_TIMEOUT_SECONDS, read_timeout=read_timeout,
+                  retries={"max_attempts": 2, "mode": "standard"})
+
+# Threads used by the async request path for SDKs that only offer blocking calls (boto3).
+# Each in-flight Bedrock/SageMaker call occupies one thread while it waits on the network.
+ASYNC_IO_THREADS = int(os.getenv("ASYNC_IO_THREADS", "256"))
+_io_executor = None
+
+async def run_blocking(func, *args):
+    """
+    Run a blocking SDK call on the shared I/O thread pool without blocking the event loop.
+    The pool is created on first use so that it is never inherited across a fork.
+    """
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix='rag-io')
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, func, *args)
+
+# Concurrent first messages with the same text (no history, no image) share one classification
+# + chain run, e.g. when many users ask about the same outbreak at once. Set COALESCE_CHAT_REQUESTS=false to disable.
+COALESCE_CHAT_REQUESTS = os.getenv("COALESCE_CHAT_REQUESTS", "true").lower() in ("1", "true", "yes")
+
+def _shareable_chat_outcome(response, error):
+    # Only a full answer is handed to the requests that joined the run. A failure - the runner's
+    # user rejected by admission control (429), its deadline running out, an open circuit - belongs
+    # to that request: the others run again, under their own user, deadline and admission checks.
+    return error is None and not response["data"].get("error_retrieving_details")
+
+CHAT_FLIGHT = SingleFlight("chat_generate_response", shared=_shareable_chat_outcome)
+
+def chat_coalescing_key(user_query, chat_history, image_data_base64=None):
+    """
+    Key under which identical concurrent chat requests are coalesced, or None if the request
+    depends on per-user context (chat history or an image) and must run on its own.
+    """
+    if not COALESCE_CHAT_REQUESTS or chat_history or image_data_base64 or not user_query:
+        return None
+    return normalize_text(user_query)
+
+# Prompt templates are module-level so they are built once at import. Under a preforking
+# server the master imports this module and every worker shares these pages copy-on-write.
+#
+# The answer prompt is laid out for provider-side prompt caching (OpenAI reuses the longest
+# previously seen prefix, in 128-token steps, once a prompt is over 1024 tokens): the static
+# instructions come first and are byte-identical in every request, then the chat history, which
+# only grows between the turns of a conversation, and only then what changes every turn - the
+# retrieved context and the question. A conversation's next turn thus starts with the previous
+# turn's prompt up to the end of its history. Keep anything per-request (dates, IDs, user names)
+# out of RAG_PROMPT_INSTRUCTIONS, or no request shares even that prefix.
+RAG_PROMPT_INSTRUCTIONS = """You are PetHealth AI, a friendly, empathetic, and knowledgeable virtual assistant.
+The user's query has been preliminarily assessed as NON-URGENT.
+Your role is to provide helpful at-home advice and information based on the 'Retrieved Context' from veterinary documents and the 'Chat History'.
+The 'Human's Question' may contain preliminary findings from an AI image analysis (SageMaker); you MUST incorporate these findings thoughtfully into your response if the user's question is about a skin condition or the image.
+If the context from the documents doesn't fully answer the user's question, state that and suggest general care or monitoring based on the provided information.
+Always remind the user to consult a veterinarian if symptoms worsen, if they are unsure, or for a definitive diagnosis.
+
+"""
+
+RAG_PROMPT_TEMPLATE = RAG_PROMPT_INSTRUCTIONS + """Chat History:
+{chat_history}
+
+Retrieved Context from documents:
+{context}
+
+Human's Question:
+{question}
+
+PetHealth AI's Non-Urgent Advice (synthesizing all available information):"""
+
+RAG_PROMPT_INPUT_VARIABLES = ["chat_history", "context", "question"]
+
+# V2 PROMPT: Added GENERAL_CONVERSATION as an option and clarified instructions.
+CLASSIFICATION_SYSTEM_PROMPT = """You are an AI assistant that classifies pet-related user queries into one of four categories. Respond with only one of these exact phrases: URGENT, NON_URGENT, UNCERTAIN, or GENERAL_CONVERSATION.
+    - URGENT: The user describes a life-threatening situation, severe distress, or a serious medical condition requiring immediate attention (e.g., "can't breathe," "ate poison," "heavy bleeding").
+    - NON_URGENT: The user asks about common, mild ailments, general health questions, or describes non-critical symptoms (e.g., "my dog is itching," "what should I feed my cat?").
+    - GENERAL_CONVERSATION: The user's query is conversational and not a health question (e.g., "hello," "thank you," "I have two dogs").
+    - UNCERTAIN: The query is too vague to classify, but seems like it might be about a health concern.
+    """
+
+class lazy_component:
+    """
+    Decorator for RAGService components that are built on first access and then cached on the instance.
+    Assigning the attribute directly (e.g. a fake client in benchmarks) bypasses the factory.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.lock = threading.RLock()
+        self.__doc__ = factory.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # Only the first access takes the lock; afterwards the instance attribute shadows this descriptor.
+        with self.lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.factory(instance)
+        return instance.__dict__[self.name]
+
 class RAGService:
     _SADEMAKER_MODEL_CLASS_NAMES = [
         "dog_demodicosis", 
@@ -52,10 +184,22 @@ class RAGService:
         "dog_ringworm"
     ]
 
+    # Components holding network connections; dropped by reinitialize_clients() so they are rebuilt per process.
+    _NETWORK_COMPONENTS = (
+        'bedrock_runtime_client', 'sagemaker_runtime_client', 'embeddings', 'llm_rag',
+        'vector_store', 'retriever', 'qa_chain_rag', 'embedding_manager',
+    )
+
+    # Source of the active index generation; a benchmark can give a service its own watcher.
+    generation_watcher = index_generations.GENERATION_WATCHER
+
     def __init__(self):
         """
         Initialize the RAG service with Langchain components for conversational RAG.
         Ensures embedding model consistency with my Pinecone setup (text-embedding-3-large, 3072 dims).
+        Components are built lazily on first use (see `lazy_component`), so constructing the service
+        is cheap and chat-only or indexing-only processes only pay for what they touch.
+        Call warm_up() to build them ahead of the first request.
         """
         logger.info(f"Initializing RAGService with LLM: '{LLM_MODEL_NAME}' and Embeddings: '{EMBEDDING_MODEL_NAME}' (3072 dimensions).")
         if not all([OPENAI_API_KEY, PINECONE_API_KEY, PINECONE_INDEX_NAME]): # PINECONE_ENVIRONMENT might be optional for serverless
@@ -64,235 +208,650 @@ class RAGService:
                 "Missing one or more critical environment variables: "
                 "OPENAI_API_KEY, PINECONE_API_KEY, PINECONE_INDEX_NAME"
             )
-        
+
+    @lazy_component
+    def bedrock_runtime_client(self):
+        import boto3
         try:
-            self.bedrock_runtime_client = boto3.client(service_name='bedrock-runtime', region_name=AWS_REGION)
+            client = boto3.client(service_name='bedrock-runtime', region_name=AWS_REGION, config=_aws_client_config(BEDROCK_TIMEOUT_SECONDS))
             logger.info(f"AWS Bedrock runtime client initialized for region '{AWS_REGION}'.")
-                
-            if SAGEMAKER_SKIN_ANALYSIS_ENDPOINT_NAME:
-                self.sagemaker_runtime_client = boto3.client(service_name='sagemaker-runtime', region_name=AWS_REGION)
-                logger.info(f"AWS SageMaker runtime client initialized for region '{AWS_REGION}'.")
-            else:
-                self.sagemaker_runtime_client = None
-                logger.warning("SAGEMAKER_SKIN_ENDPOINT_NAME not set. Skin image analysis will be disabled.")
+            return client
+        except Exception as e:
+            logger.error(f"CRITICAL: Failed to initialize AWS SDK clients: {e}", exc_info=True)
+            raise
+
+    @lazy_component
+    def sagemaker_runtime_client(self):
+        if not SAGEMAKER_SKIN_ANALYSIS_ENDPOINT_NAME:
+            logger.warning("SAGEMAKER_SKIN_ENDPOINT_NAME not set. Skin image analysis will be disabled.")
+            return None
+        import boto3
+        try:
+            client = boto3.client(service_name='sagemaker-runtime', region_name=AWS_REGION, config=_aws_client_config(SAGEMAKER_TIMEOUT_SECONDS))
+            logger.info(f"AWS SageMaker runtime client initialized for region '{AWS_REGION}'.")
+            return client
         except Exception as e:
             logger.error(f"CRITICAL: Failed to initialize AWS SDK clients: {e}", exc_info=True)
             raise
 
+    @lazy_component
+    def embeddings(self):
         # 1. Initialize Embeddings model (for retrieval by Langchain)
         # This MUST be the SAME model used for indexing (text-embedding-3-large).
+        from langchain_openai import OpenAIEmbeddings
         logger.debug(f"Attempting to initialize OpenAI Embeddings with model: '{EMBEDDING_MODEL_NAME}'...")
-        self.embeddings = OpenAIEmbeddings(
+        embeddings = OpenAIEmbeddings(
             openai_api_key=OPENAI_API_KEY,
             model=EMBEDDING_MODEL_NAME
         )
         logger.info(f"OpenAI Embeddings for Langchain retriever initialized successfully with '{EMBEDDING_MODEL_NAME}'.")
+        return embeddings
 
+    @lazy_component
+    def llm_rag(self):
         # 2. Initialize LLM
+        from langchain_openai import ChatOpenAI
         logger.debug(f"Attempting to initialize ChatOpenAI LLM with model: '{LLM_MODEL_NAME}'...")
-        self.llm_rag = ChatOpenAI(
+        llm = ChatOpenAI(
             openai_api_key=OPENAI_API_KEY,
             model_name=LLM_MODEL_NAME,
-            temperature=0.6 # Good balance for informative yet slightly varied pet health advice
+            temperature=0.6, # Good balance for informative yet slightly varied pet health advice
+            request_timeout=LLM_TIMEOUT_SECONDS
         )
         logger.info(f"ChatOpenAI LLM initialized successfully with '{LLM_MODEL_NAME}'.")
+        return llm
+
+    @lazy_component
+    def active_generation(self):
+        # The index generation the retrieval components below are built for.
+        return self.generation_watcher.current()
+
+    @lazy_component
+    def vector_store(self):
+        return self._connect_vector_store(self.active_generation.namespace)
 
-        # 3. Initialize Pinecone Vector Store as Retriever
+    def _connect_vector_store(self, namespace):
+        # 3. Initialize Pinecone Vector Store
         # Connects to my existing Pinecone index populated with text-embedding-3-large embeddings.
+        from langchain_pinecone import PineconeVectorStore
         try:
-            logger.info(f"Attempting to connect to Pinecone index: '{PINECONE_INDEX_NAME}'.")
+            logger.info(f"Attempting to connect to Pinecone index: '{PINECONE_INDEX_NAME}' (namespace '{namespace}').")
             # For pinecone-client v3+, environment might be implicitly handled or part of host.
             # Langchain's PineconeVectorStore should handle this.
-            self.vector_store = PineconeVectorStore.from_existing_index(
+            vector_store = PineconeVectorStore.from_existing_index(
                 index_name=PINECONE_INDEX_NAME,
                 embedding=self.embeddings,
+                namespace=namespace or None,
                 # pinecone_api_key=PINECONE_API_KEY, # Usually picked from env
                 # pinecone_environment=PINECONE_ENVIRONMENT, # If required by your setup/client version
             )
-            self.retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={'k': 5} # Number of documents to retrieve for context
-            )
-            logger.info("Pinecone vector store and retriever initialized successfully.")
+            logger.info("Pinecone vector store initialized successfully.")
+            return vector_store
         except Exception as e:
-            # print(f"Error initializing Pinecone vector store for Langchain: {e}")
-            # print("Ensure Pinecone index exists and is accessible.")
             logger.error(f"Failed to initialize Pinecone vector store for Langchain using index '{PINECONE_INDEX_NAME}': {e}", exc_info=True)
             raise
 
-        # 4. Initialize Conversation Memory
-        logger.debug("Initializing ConversationBufferMemory...")
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            output_key='answer',
-            input_key='question' # This tells the memory what to consider as the "Human" input
-        )
-        logger.info("ConversationBufferMemory initialized.")
-
-        # 5. Defining the Prompt Template for the Conversational Chain
-        _rag_template = """You are PetHealth AI, a friendly, empathetic, and knowledgeable virtual assistant.
-The user's query has been preliminarily assessed as NON-URGENT.
-Your role is to provide helpful at-home advice and information based on the 'Retrieved Context' from veterinary documents and the 'Chat History'.
-The 'Human's Question' may contain preliminary findings from an AI image analysis (SageMaker); you MUST incorporate these findings thoughtfully into your response if the user's question is about a skin condition or the image.
-If the context from the documents doesn't fully answer the user's question, state that and suggest general care or monitoring based on the provided information.
-Always remind the user to consult a veterinarian if symptoms worsen, if they are unsure, or for a definitive diagnosis.
-
-Retrieved Context from documents:
-{context}
+    @lazy_component
+    def retriever(self):
+        return self._vector_retriever(self.vector_store)
 
-Chat History:
-{chat_history}
+    def _vector_retriever(self, vector_store):
+        return vector_store.as_retriever(
+            search_type="similarity",
+            search_kwargs={'k': 5} # Number of documents to retrieve for context
+        )
 
-Human's Question:
-{question}
+    def _generation_retriever(self, generation):
+        """Pinecone retriever over `generation`'s namespace, built without touching the serving one."""
+        return self._vector_retriever(self._connect_vector_store(generation.namespace))
 
-PetHealth AI's Non-Urgent Advice (synthesizing all available information):"""
-        
-        RAG_PROMPT = PromptTemplate(
-            input_variables=["chat_history", "context", "question"], 
-            template=_rag_template
-        )
-        logger.debug("QA_PROMPT template defined for ConversationalRetrievalChain.")
+    @lazy_component
+    def lexical_index(self):
+        return self._load_lexical_index(self.active_generation)
 
-        # 6. Creating a ConversationalRetrievalChain
+    def _load_lexical_index(self, generation):
+        if not HYBRID_RETRIEVAL:
+            return None
+        from lexical_index import LexicalIndex
+        try:
+            return LexicalIndex.load(generation.lexical_dir)
+        except Exception as e:
+            logger.error(f"Failed to load the lexical index, retrieval stays vector-only: {e}", exc_info=True)
+            return None
+
+    @lazy_component
+    def qa_chain_rag(self):
+        return self._build_qa_chain(self.retriever, self.lexical_index)
+
+    def _build_qa_chain(self, vector_retriever, lexical):
+        # 4. Creating a ConversationalRetrievalChain
+        # No memory object is attached: every call passes its own `chat_history`, so concurrent
+        # requests (threads or asyncio tasks) never share conversation state.
+        from langchain.chains import ConversationalRetrievalChain
+        from langchain.prompts import PromptTemplate
+        from chain_metrics import QUESTION_REWRITE_TAG
+        from hedged_retriever import HedgedRetriever
         logger.debug("Creating ConversationalRetrievalChain...")
-        self.qa_chain_rag = ConversationalRetrievalChain.from_llm(
-            llm=self.llm_rag, retriever=self.retriever, memory=self.memory,
-            combine_docs_chain_kwargs={"prompt": RAG_PROMPT},
+        rag_prompt = PromptTemplate(input_variables=RAG_PROMPT_INPUT_VARIABLES, template=RAG_PROMPT_TEMPLATE)
+        retriever = HedgedRetriever(inner=vector_retriever, policy=RETRIEVAL_HEDGE, breaker=RETRIEVAL_BREAKER, cap_seconds=RETRIEVAL_TIMEOUT_SECONDS)
+        if lexical is not None:
+            from hybrid_retriever import HybridRetriever
+            retriever = HybridRetriever(vector=retriever, lexical=lexical, k=5)
+            logger.info("Hybrid retrieval enabled: Pinecone results fused with the local lexical index.")
+        chain = ConversationalRetrievalChain.from_llm(
+            llm=self.llm_rag, retriever=retriever,
+            # Same model and client, tagged so the rewrite step is timed apart from answer generation.
+            condense_question_llm=self.llm_rag.model_copy(update={"tags": [QUESTION_REWRITE_TAG]}),
+            combine_docs_chain_kwargs={"prompt": rag_prompt},
             return_source_documents=True, output_key='answer'
         )
         logger.info("ConversationalRetrievalChain created successfully.")
-        logger.info("RAGService core components initialization complete.")
+        return chain
 
+    def switch_generation(self, generation):
+        """
+        Serve `generation` from now on. Only the retrieval components already built are rebuilt for
+        it, first, then swapped in together; a request in flight finishes on the chain it started
+        with, the next one gets the new chain. In a process that only indexes, nothing of the chat
+        stack is built here: the components not built yet pick up the generation when first used.
+        """
+        if self.__dict__.get('active_generation') == generation:
+            return
+        logger.info(f"RAGService: Switching retrieval to index generation '{generation.name}' (namespace '{generation.namespace}').")
+        built = set(self.__dict__)
+        if 'qa_chain_rag' in built: # built from the retriever and the lexical index
+            built |= {'retriever', 'lexical_index'}
+        components = {'active_generation': generation}
+        if 'retriever' in built:
+            components['retriever'] = self._generation_retriever(generation)
+        if 'lexical_index' in built:
+            components['lexical_index'] = self._load_lexical_index(generation)
+        if 'qa_chain_rag' in built:
+            components['qa_chain_rag'] = self._build_qa_chain(components['retriever'], components['lexical_index'])
+        self.__dict__.update(components)
+        self.__dict__.pop('vector_store', None) # reconnected for the new namespace on next use (warm_up)
+        logger.info(f"RAGService: Now serving index generation '{generation.name}'.")
+
+    def _follow_active_generation(self):
+        # Called per chat request: a cheap cached check, at most one stat() per INDEX_GENERATION_CHECK_SECONDS.
+        # The switch itself (new Pinecone connection, lexical index load) runs in the background.
+        serving = self.__dict__.get('active_generation')
+        if serving is None:
+            return # nothing built yet; the factories pick up the active generation
+        generation = self.generation_watcher.current()
+        if generation == serving or not _generation_switch_lock.acquire(blocking=False):
+            return
+
+        def switch():
+            try:
+                self.switch_generation(generation)
+            except Exception as e:
+                logger.error(f"RAGService: Failed to switch to index generation '{generation.name}', still serving '{serving.name}': {e}", exc_info=True)
+            finally:
+                _generation_switch_lock.release()
+
+        threading.Thread(target=switch, name='generation-switch', daemon=True).start()
+
+    @lazy_component
+    def pdf_processor(self):
         # For indexing, these are the existing components.
+        from pdf_processor import PDFProcessor
+        return PDFProcessor()
+
+    @lazy_component
+    def embedding_manager(self):
         # EmbeddingManager should already be using "text-embedding-3-large" and 3072 dimensions.
-        logger.debug("Initializing PDFProcessor and EmbeddingManager for indexing tasks...")
-        self.pdf_processor = PDFProcessor()
-        self.embedding_manager = EmbeddingManager() # This should pick up text-embedding-3-large from its own __init__
-        logger.info(f"PDFProcessor and EmbeddingManager instances created for indexing.")
-        if self.embedding_manager.embedding_model != EMBEDDING_MODEL_NAME or \
-           self.embedding_manager.pinecone_dimension != 3072:
-            logger.warning(f"WARNING: EmbeddingManager model/dimension mismatch! Manager uses {self.embedding_manager.embedding_model} ({self.embedding_manager.pinecone_dimension} dims), RAGService expects {EMBEDDING_MODEL_NAME} (3072 dims). Ensure consistency.")
+        from embedding_manager import EmbeddingManager
+        embedding_manager = EmbeddingManager() # This should pick up text-embedding-3-large from its own __init__
+        if embedding_manager.embedding_model != EMBEDDING_MODEL_NAME or \
+           embedding_manager.pinecone_dimension != 3072:
+            logger.warning(f"WARNING: EmbeddingManager model/dimension mismatch! Manager uses {embedding_manager.embedding_model} ({embedding_manager.pinecone_dimension} dims), RAGService expects {EMBEDDING_MODEL_NAME} (3072 dims). Ensure consistency.")
         else:
-            logger.info("PDFProcessor and EmbeddingManager confirmed for indexing (using {self.embedding_manager.embedding_model}).")
+            logger.info(f"EmbeddingManager confirmed for indexing (using {embedding_manager.embedding_model}).")
+        return embedding_manager
 
+    def warm_up(self, serving=True, indexing=False):
+        """
+        Build components and open their connections before the process reports ready.
+
+        Args:
+            serving: Build the chat stack (AWS clients, LLM, Pinecone retriever, chain)
+            indexing: Build the indexing stack (PDFProcessor, EmbeddingManager)
+        """
+        logger.info(f"Warming up RAGService (serving={serving}, indexing={indexing}) in process {os.getpid()}.")
+        if serving:
+            self.bedrock_runtime_client
+            self.sagemaker_runtime_client
+            self.qa_chain_rag
+            # A cheap round trip so the first user request does not pay for TLS + connection setup.
+            try:
+                self.vector_store.index.describe_index_stats()
+            except Exception as e:
+                logger.warning(f"Pinecone warm-up request failed (will retry on first request): {e}")
+        if indexing:
+            self.pdf_processor
+            self.embedding_manager
+        logger.info("RAGService warm-up complete.")
+
+    def reinitialize_clients(self):
+        """
+        Drop network clients, e.g. in a worker process after a preforking server has forked.
+        Connection pools inherited from the parent process must not be shared between processes;
+        they are rebuilt lazily (or by warm_up()) in this process.
+        """
+        logger.info(f"Re-initializing RAGService network clients in process {os.getpid()}.")
+        for name in self._NETWORK_COMPONENTS:
+            self.__dict__.pop(name, None)
 
     def index_documents(self, pdf_directory):
         """
         Process PDFs and index them in Pinecone using PDFProcessor and EmbeddingManager.
         This assumes EmbeddingManager is correctly configured for text-embedding-3-large.
+        The archived uploads (pdf_uploads.archived_uploads) are embedded along with the folder,
+        under their own vector IDs, so a re-index keeps every uploaded document.
+        With BLUE_GREEN_INDEXING the documents go to a new index generation; chat keeps using the
+        current one until the new one is complete and validated, then switches (see index_generations.py).
+        Uploads are refused while it is being built.
         """
         logger.info(f"RAGService: Starting document indexing from directory: '{pdf_directory}'")
+        build = index_generations.generation_build() if BLUE_GREEN_INDEXING else contextlib.nullcontext()
         try:
-            langchain_documents = self.pdf_processor.process_directory(pdf_directory)
-            
-            if not langchain_documents:
-                logger.warning(f"RAGService: PDFProcessor returned no documents from '{pdf_directory}'.")
-                return 0
-            
-            logger.info(f"RAGService: PDFProcessor processed {len(langchain_documents)} Langchain document objects.")
-            logger.info("RAGService: Calling EmbeddingManager to upsert documents...")
-            num_indexed = self.embedding_manager.upsert_documents(langchain_documents)
-            logger.info(f"RAGService: EmbeddingManager successfully processed {num_indexed} chunks for upsertion.")
-            return num_indexed
+            with build:
+                langchain_documents = self.pdf_processor.process_directory(pdf_directory)
+                uploads = self._archived_upload_documents()
+
+                if not langchain_documents and not uploads:
+                    logger.warning(f"RAGService: PDFProcessor returned no documents from '{pdf_directory}'.")
+                    return 0
+
+                logger.info(f"RAGService: PDFProcessor processed {len(langchain_documents)} Langchain document objects "
+                            f"and {sum(len(chunks) for _, chunks in uploads)} chunks of {len(uploads)} archived uploads.")
+                generation = index_generations.new_generation() if BLUE_GREEN_INDEXING else self.active_generation
+                logger.info(f"RAGService: Calling EmbeddingManager to upsert documents into index generation '{generation.name}'...")
+                # Embedding runs are bounded per process and shared fairly between the users indexing.
+                with admission.EMBEDDING_LIMITER.slot():
+                    num_indexed = self.embedding_manager.upsert_documents(langchain_documents, namespace=generation.namespace) if langchain_documents else 0
+                    for id_prefix, chunks in uploads:
+                        num_indexed += self.embedding_manager.upsert_documents(chunks, namespace=generation.namespace, id_prefix=id_prefix)
+                logger.info(f"RAGService: EmbeddingManager successfully processed {num_indexed} chunks for upsertion.")
+                # Same chunks, same IDs as the upserts above.
+                documents = langchain_documents + [chunk for _, chunks in uploads for chunk in chunks]
+                ids = ([f"doc_{i}" for i in range(len(langchain_documents))] +
+                       [f"{id_prefix}_{i}" for id_prefix, chunks in uploads for i in range(len(chunks))])
+                if HYBRID_RETRIEVAL:
+                    self._rebuild_lexical_index(documents, generation, ids)
+                if BLUE_GREEN_INDEXING:
+                    generation.vectors = num_indexed
+                    self._activate_generation(generation, documents, ids)
+                return num_indexed
+        except admission.AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"RAGService: Error during document indexing for directory '{pdf_directory}': {e}", exc_info=True)
             # import traceback
             # traceback.print_exc()
             raise
+
+    def _archived_upload_documents(self):
+        # (vector ID prefix, chunks) of every archived upload, chunked as when it was uploaded.
+        import pdf_uploads
+        uploads = []
+        for id_prefix, source, path in pdf_uploads.archived_uploads():
+            try:
+                text = self.pdf_processor.extract_text_from_pdf(path)
+            except Exception as e:
+                logger.error(f"RAGService: Failed to read archived upload '{path}', leaving it out: {e}", exc_info=True)
+                continue
+            if text.strip():
+                uploads.append((id_prefix, self.pdf_processor.create_chunks(text, {"source": source})))
+        return uploads
     
-    def classify_urgency_with_bedrock(self, user_query: str, chat_history: list) -> str:
+    def index_uploaded_pdfs(self, uploads):
         """
-        FIXED V2: This version adds a 'GENERAL_CONVERSATION' category to better handle
-        non-medical questions and prevent incorrect urgency classifications.
+        Index uploaded PDFs, each on its own (see index_uploaded_pdf), at most
+        pdf_uploads.UPLOAD_INDEX_CONCURRENCY at a time.
+
+        Args:
+            uploads: List of (seekable binary file object, original file name)
+
+        Returns:
+            One result dict per upload, in order; a failed upload's has an "error" instead of counts
+        """
+        import contextvars
+        import pdf_uploads
+        self._follow_active_generation()
+        # A generation being built would not hold these uploads: refused until it is active
+        # (GenerationBuildInProgress, 409), then written into it rather than into the one this
+        # process may still be serving for up to INDEX_GENERATION_CHECK_SECONDS.
+        with index_generations.outside_generation_build() if BLUE_GREEN_INDEXING else contextlib.nullcontext():
+            generation = index_generations.load_state()[0] if BLUE_GREEN_INDEXING else self.active_generation
+            with ThreadPoolExecutor(max_workers=max(1, min(pdf_uploads.UPLOAD_INDEX_CONCURRENCY, len(uploads))),
+                                    thread_name_prefix='pdf-upload') as pool:
+                # A copy of the context per upload keeps the user visible to the embedding limiter.
+                futures = [pool.submit(contextvars.copy_context().run, self._index_upload_or_error, stream, filename, generation)
+                           for stream, filename in uploads]
+        return [future.result() for future in futures] # AdmissionRejected propagates (429)
+
+    def _index_upload_or_error(self, stream, filename, generation):
+        try:
+            return self.index_uploaded_pdf(stream, filename, generation)
+        except admission.AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"RAGService: Failed to index uploaded PDF '{filename}': {e}", exc_info=True)
+            return {"filename": filename, "error": str(e)}
+
+    def index_uploaded_pdf(self, stream, filename, generation=None):
         """
-        logger.info(f"Classifying query type/urgency with Bedrock for query: '{user_query[:100]}...'")
+        Extract, chunk, embed and upsert one uploaded PDF into the active index generation,
+        and keep it in the upload archive so the next full re-index embeds it again.
+        Its vectors are "<pdf_uploads.vector_id_prefix>_<n>", keyed by the user and the file name:
+        the same user re-uploading a file replaces its chunks (surplus ones from a longer previous
+        version are deleted), and every other document - another user's of the same name too - is left alone. The lexical index is not updated: until the next full re-index the
+        document is found through Pinecone only.
+
+        Args:
+            stream: Seekable binary file object holding the PDF
+            filename: Original file name, stored (sanitised) as the chunks' "source"
+            generation: Index generation to write into (default: the one this process serves)
+
+        Returns:
+            Dict with the file name, size, pages, chunks, vectors written and per-stage seconds
+        """
+        import pdf_uploads
+        started = time.perf_counter()
+        source = pdf_uploads.source_name(filename)
+        result = {"filename": source, "bytes": pdf_uploads.stream_size(stream)}
+        seconds = {}
+
+        start = time.perf_counter()
+        with metrics.stage_timer("upload_extract"):
+            pages = self.pdf_processor.extract_pages_from_stream(stream)
+        seconds["extract"] = time.perf_counter() - start
+        text = "".join(pages)
+        if not text.strip():
+            raise ValueError(f"No text could be extracted from '{source}'.")
+
+        start = time.perf_counter()
+        langchain_documents = self.pdf_processor.create_chunks(text, {"source": source})
+        seconds["chunk"] = time.perf_counter() - start
+
+        generation = generation or self.active_generation
+        id_prefix = pdf_uploads.vector_id_prefix(admission.current_user(), source)
+        start = time.perf_counter()
+        with admission.EMBEDDING_LIMITER.slot(), metrics.stage_timer("upload_embed_upsert"):
+            num_indexed = self.embedding_manager.upsert_documents(langchain_documents, namespace=generation.namespace, id_prefix=id_prefix)
+        seconds["embed_upsert"] = time.perf_counter() - start
+        stale = self._delete_stale_upload_chunks(generation.namespace, id_prefix, num_indexed)
+        pdf_uploads.archive_upload(stream, source, id_prefix)
+
+        seconds["total"] = time.perf_counter() - started
+        result.update(pages=len(pages), chunks=len(langchain_documents), vectors=num_indexed, stale_vectors_deleted=stale,
+                      generation=generation.name, seconds={stage: round(value, 4) for stage, value in seconds.items()})
+        logger.info(f"RAGService: Indexed uploaded PDF '{source}' ({result['bytes']} bytes, {len(pages)} pages) as "
+                    f"{num_indexed} chunks into generation '{generation.name}' in {seconds['total']:.2f}s.")
+        return result
+
+    def _delete_stale_upload_chunks(self, namespace, id_prefix, count):
+        # Chunks "<id_prefix>_<n>" with n >= count are left over from a longer earlier version.
+        index = self.embedding_manager.index
+        try:
+            stale = [vector_id for page in index.list(prefix=f"{id_prefix}_", namespace=namespace)
+                     for vector_id in page if int(vector_id.rsplit("_", 1)[1]) >= count]
+        except Exception as e:
+            # Pod-based indexes cannot list IDs; the surplus chunks of a shrunken document then stay.
+            logger.warning(f"RAGService: Could not list earlier chunks of '{id_prefix}': {e}")
+            return 0
+        for start in range(0, len(stale), 1000): # Pinecone deletes at most 1000 IDs per call
+            index.delete(ids=stale[start:start + 1000], namespace=namespace)
+        return len(stale)
+
+    def _rebuild_lexical_index(self, langchain_documents, generation, ids):
+        # Same chunks, same IDs as the Pinecone upserts. The vectors are already in; a failure
+        # here only leaves retrieval without (or on the previous) lexical index.
+        from lexical_index import build_lexical_index
+        try:
+            build_lexical_index(langchain_documents, generation.lexical_dir, ids=ids)
+        except Exception as e:
+            logger.error(f"RAGService: Failed to build the lexical index: {e}", exc_info=True)
+            return
+        if not BLUE_GREEN_INDEXING:
+            # Rebuilt in place: the next chat request rebuilds the chain around the new index.
+            self.__dict__.pop('lexical_index', None)
+            self.__dict__.pop('qa_chain_rag', None)
+
+    def _activate_generation(self, generation, langchain_documents, ids):
+        index = self.embedding_manager.index
+        previous = self.active_generation
+        try:
+            self.validate_generation(generation, langchain_documents, ids)
+            # This process switches first, so a generation it cannot serve is never recorded as active.
+            self.switch_generation(generation)
+        except Exception:
+            # Never served, so it can go right away.
+            index_generations.delete_generation(index, generation)
+            raise
+        try:
+            index_generations.activate(generation) # the other processes follow within INDEX_GENERATION_CHECK_SECONDS
+        except Exception:
+            # Not recorded as active: go back to the generation every other process still serves.
+            self.switch_generation(previous)
+            index_generations.delete_generation(index, generation)
+            raise
+        self.generation_watcher.refresh()
+        index_generations.schedule_garbage_collection(index)
 
+    def validate_generation(self, generation, langchain_documents, ids=None):
+        """
+        Check a freshly indexed generation before it is activated: Pinecone reports every vector,
+        sampled vectors come back with their chunk's text, each finds itself as the nearest
+        neighbour, and the lexical index (if built) covers every chunk.
+        `ids` are the chunks' vector IDs (default: "doc_<position>").
+        Raises index_generations.GenerationValidationError otherwise.
+        """
+        ids_of = ids or [f"doc_{number}" for number in range(len(langchain_documents))]
+        index = self.embedding_manager.index
+        expected = len(langchain_documents)
+        # Serverless indexes report new vectors with a short delay.
+        deadline = time.monotonic() + index_generations.GENERATION_VALIDATION_TIMEOUT_SECONDS
+        while True:
+            namespaces = index.describe_index_stats().get("namespaces") or {}
+            count = int((namespaces.get(generation.namespace) or {}).get("vector_count", 0))
+            if count >= expected or time.monotonic() > deadline:
+                break
+            time.sleep(1.0)
+        if count != expected:
+            raise index_generations.GenerationValidationError(
+                f"Generation '{generation.name}' holds {count} vectors, expected {expected}.")
+
+        samples = min(index_generations.GENERATION_VALIDATION_SAMPLES, expected)
+        numbers = sorted({round(i * (expected - 1) / max(samples - 1, 1)) for i in range(samples)})
+        ids = [ids_of[number] for number in numbers]
+        fetched = index.fetch(ids=ids, namespace=generation.namespace).vectors
+        for number, vector_id in zip(numbers, ids):
+            vector = fetched.get(vector_id)
+            if vector is None or (vector.metadata or {}).get("text") != langchain_documents[number].page_content:
+                raise index_generations.GenerationValidationError(
+                    f"Generation '{generation.name}': '{vector_id}' is missing or does not hold its chunk's text.")
+            matches = index.query(vector=list(vector.values), top_k=5, namespace=generation.namespace)["matches"]
+            if vector_id not in [match["id"] for match in matches]:
+                raise index_generations.GenerationValidationError(
+                    f"Generation '{generation.name}': '{vector_id}' is not among its own nearest neighbours.")
+
+        if HYBRID_RETRIEVAL:
+            lexical = self._load_lexical_index(generation)
+            if lexical is not None:
+                lexical.close()
+                if lexical.num_docs != expected:
+                    raise index_generations.GenerationValidationError(
+                        f"Generation '{generation.name}': lexical index covers {lexical.num_docs} of {expected} chunks.")
+        logger.info(f"RAGService: Index generation '{generation.name}' validated ({expected} vectors, {len(ids)} spot checks).")
+
+    def _classification_request_body(self, user_query: str, chat_history: list) -> str:
         # This correctly uses only the user's history to avoid context pollution
-        user_history_messages = [f"User: {msg.get('text')}" for msg in chat_history[-5:] if msg.get('sender') == 'user']
+        user_history_messages = [f"User: {text}" for text in as_history(chat_history).recent_user_queries()]
         history_str = "\n".join(user_history_messages)
 
-        # V2 PROMPT: Added GENERAL_CONVERSATION as an option and clarified instructions.
-        system_prompt = """You are an AI assistant that classifies pet-related user queries into one of four categories. Respond with only one of these exact phrases: URGENT, NON_URGENT, UNCERTAIN, or GENERAL_CONVERSATION.
-    - URGENT: The user describes a life-threatening situation, severe distress, or a serious medical condition requiring immediate attention (e.g., "can't breathe," "ate poison," "heavy bleeding").
-    - NON_URGENT: The user asks about common, mild ailments, general health questions, or describes non-critical symptoms (e.g., "my dog is itching," "what should I feed my cat?").
-    - GENERAL_CONVERSATION: The user's query is conversational and not a health question (e.g., "hello," "thank you," "I have two dogs").
-    - UNCERTAIN: The query is too vague to classify, but seems like it might be about a health concern.
-    """
-        
         user_message_content = f"Please classify the user's latest query based on their conversation history.\n\nRecent User Queries:\n<chat_history>\n{history_str or 'N/A'}\n</chat_history>\n\nUser's Latest Query: \"{user_query}\"\n\nClassification:"
         
         messages = [{"role": "user", "content": [{"type": "text", "text": user_message_content}]}]
-        body = json.dumps({"anthropic_version": "bedrock-2023-05-31", "max_tokens": 20, "temperature": 0.0, "system": system_prompt, "messages": messages})
-        
-        try:
+        return json.dumps({"anthropic_version": "bedrock-2023-05-31", "max_tokens": 20, "temperature": 0.0, "system": CLASSIFICATION_SYSTEM_PROMPT, "messages": messages})
+
+    def _invoke_bedrock_classifier(self, body: str) -> str:
+        with metrics.stage_timer("bedrock_classification"):
             response = self.bedrock_runtime_client.invoke_model(body=body, modelId=BEDROCK_CLASSIFICATION_MODEL_ID, accept='application/json', contentType='application/json')
             response_body = json.loads(response.get('body').read())
-            raw_text = response_body.get("content", [{}])[0].get("text", "").strip().upper().replace("_", " ")
-
-            # Check for the new category first
-            if "GENERAL CONVERSATION" in raw_text:
-                classification = "GENERAL_CONVERSATION"
-            elif "URGENT" in raw_text:
-                classification = "URGENT"
-            elif "NON URGENT" in raw_text:
-                classification = "NON_URGENT"
-            else:
-                classification = "UNCERTAIN" # Default fallback
-            
-            logger.info(f"Bedrock query classification result: '{classification}'")
-            return classification
+        raw_text = response_body.get("content", [{}])[0].get("text", "").strip().upper().replace("_", " ")
+
+        # Check for the new category first
+        if "GENERAL CONVERSATION" in raw_text:
+            classification = "GENERAL_CONVERSATION"
+        elif "URGENT" in raw_text:
+            classification = "URGENT"
+        elif "NON URGENT" in raw_text:
+            classification = "NON_URGENT"
+        else:
+            classification = "UNCERTAIN" # Default fallback
+        
+        logger.info("Bedrock query classification result: '%s'", classification)
+        return classification
+
+    def classify_urgency_with_bedrock(self, user_query: str, chat_history: list, deadline: Deadline = None) -> str:
+        """
+        FIXED V2: This version adds a 'GENERAL_CONVERSATION' category to better handle
+        non-medical questions and prevent incorrect urgency classifications.
+        Bounded by `deadline` (and BEDROCK_TIMEOUT_SECONDS), hedged when slow, skipped while the
+        Bedrock circuit is open; every failure falls back to "UNCERTAIN".
+        """
+        logger.info("Classifying query type/urgency with Bedrock for query: '%.100s...'", user_query)
+        body = self._classification_request_body(user_query, chat_history)
+        try:
+            return resilience.hedged_call(
+                lambda: self._invoke_bedrock_classifier(body), deadline or Deadline(), "bedrock_classification",
+                CLASSIFICATION_HEDGE, cap=BEDROCK_TIMEOUT_SECONDS, breaker=BEDROCK_BREAKER
+            )
+        except (CircuitOpenError, resilience.DeadlineExceeded) as e:
+            logger.warning(f"Bedrock urgency classification skipped: {e}")
+            return "UNCERTAIN"
         except Exception as e:
             logger.error(f"Error during Bedrock urgency classification: {e}", exc_info=True)
             return "UNCERTAIN"
-    
-    def analyze_skin_image_with_sagemaker(self, image_bytes: bytes) -> dict:
-        if not self.sagemaker_runtime_client:
-            return {"analysis_summary": "Image analysis feature not configured."}
-        logger.info(f"Invoking SageMaker endpoint '{SAGEMAKER_SKIN_ANALYSIS_ENDPOINT_NAME}' with image of size {len(image_bytes)} bytes.")
+
+    async def aclassify_urgency_with_bedrock(self, user_query: str, chat_history: list, deadline: Deadline = None) -> str:
+        """
+        Async variant of classify_urgency_with_bedrock for the ASGI request path.
+        """
+        logger.info("Classifying query type/urgency with Bedrock (async) for query: '%.100s...'", user_query)
+        body = self._classification_request_body(user_query, chat_history)
         try:
+            return await resilience.ahedged_call(
+                lambda: run_blocking(self._invoke_bedrock_classifier, body), deadline or Deadline(), "bedrock_classification",
+                CLASSIFICATION_HEDGE, cap=BEDROCK_TIMEOUT_SECONDS, breaker=BEDROCK_BREAKER
+            )
+        except (CircuitOpenError, resilience.DeadlineExceeded) as e:
+            logger.warning(f"Bedrock urgency classification skipped: {e}")
+            return "UNCERTAIN"
+        except Exception as e:
+            logger.error(f"Error during Bedrock urgency classification: {e}", exc_info=True)
+            return "UNCERTAIN"
+
+    def _invoke_sagemaker_skin_endpoint(self, image_bytes: bytes) -> dict:
+        with metrics.stage_timer("sagemaker_analysis"):
             response = self.sagemaker_runtime_client.invoke_endpoint(
                 EndpointName=SAGEMAKER_SKIN_ANALYSIS_ENDPOINT_NAME,
                 ContentType=SAGEMAKER_SKIN_ENDPOINT_CONTENT_TYPE,
                 Body=image_bytes
             )
             response_body_str = response['Body'].read().decode('utf-8')
-            logger.debug(f"SageMaker raw response string: {response_body_str}")
-                
-            probabilities = ast.literal_eval(response_body_str)
-                
-            if isinstance(probabilities, list) and len(probabilities) == len(self._SADEMAKER_MODEL_CLASS_NAMES):
-                max_score = max(probabilities)
-                max_index = probabilities.index(max_score)
-                predicted_label = self._SADEMAKER_MODEL_CLASS_NAMES[max_index]
-                analysis_summary = f"Preliminary image analysis suggests the condition appears most similar to '{predicted_label}' (with a {max_score:.1%} confidence score). This is not a definitive diagnosis and a veterinarian must be consulted for confirmation."
-                logger.info(f"SageMaker prediction: '{predicted_label}' with score {max_score:.4f}")
-            else:
-                analysis_summary = "Image analysis results received in an unexpected format."
-                logger.warning(f"Parsed SageMaker output was not a list of {len(self._SADEMAKER_MODEL_CLASS_NAMES)} probabilities: {probabilities}")
+        # Lazily formatted and truncated: the body is only rendered when DEBUG is enabled.
+        logger.debug("SageMaker raw response string (%d chars): %.500s", len(response_body_str), response_body_str)
+            
+        probabilities = ast.literal_eval(response_body_str)
+            
+        if isinstance(probabilities, list) and len(probabilities) == len(self._SADEMAKER_MODEL_CLASS_NAMES):
+            max_score = max(probabilities)
+            max_index = probabilities.index(max_score)
+            predicted_label = self._SADEMAKER_MODEL_CLASS_NAMES[max_index]
+            analysis_summary = f"Preliminary image analysis suggests the condition appears most similar to '{predicted_label}' (with a {max_score:.1%} confidence score). This is not a definitive diagnosis and a veterinarian must be consulted for confirmation."
+            logger.info("SageMaker prediction: '%s' with score %.4f", predicted_label, max_score)
+        else:
+            analysis_summary = "Image analysis results received in an unexpected format."
+            logger.warning("Parsed SageMaker output was not a list of %d probabilities: %.500r", len(self._SADEMAKER_MODEL_CLASS_NAMES), probabilities)
 
-            return {"analysis_summary": analysis_summary, "raw_output": probabilities}
+        return {"analysis_summary": analysis_summary, "raw_output": probabilities}
+
+    def analyze_skin_image_with_sagemaker(self, image_bytes: bytes, deadline: Deadline = None) -> dict:
+        if not self.sagemaker_runtime_client:
+            return {"analysis_summary": "Image analysis feature not configured."}
+        logger.info("Invoking SageMaker endpoint '%s' with image of size %d bytes.", SAGEMAKER_SKIN_ANALYSIS_ENDPOINT_NAME, len(image_bytes))
+        try:
+            return resilience.call_with_deadline(
+                lambda: self._invoke_sagemaker_skin_endpoint(image_bytes), deadline or Deadline(), "sagemaker_analysis",
+                cap=SAGEMAKER_TIMEOUT_SECONDS, breaker=SAGEMAKER_BREAKER
+            )
+        except (CircuitOpenError, resilience.DeadlineExceeded) as e:
+            logger.warning(f"SageMaker skin image analysis skipped: {e}")
+            return {"analysis_summary": "Could not perform skin image analysis due to a technical issue."}
         except Exception as e:
             logger.error(f"Error invoking or parsing SageMaker endpoint response: {e}", exc_info=True)
             return {"analysis_summary": "Could not perform skin image analysis due to a technical issue."}
 
-    def generate_response(self, user_query: str, chat_history_from_frontend: list, image_data_base64: str = None) -> dict:
+    async def aanalyze_skin_image_with_sagemaker(self, image_bytes: bytes, deadline: Deadline = None) -> dict:
         """
-        FIXED V2: This version handles the new 'GENERAL_CONVERSATION' category to provide
-        a more natural, friendly response to non-medical queries. It also ensures the
-        conversation memory is cleared for each request.
+        Async variant of analyze_skin_image_with_sagemaker for the ASGI request path.
         """
-        classification = self.classify_urgency_with_bedrock(user_query, chat_history_from_frontend)
-        
-        sagemaker_analysis_summary = "No image was submitted for analysis."
-        sagemaker_raw_output = None
+        if not self.sagemaker_runtime_client:
+            return {"analysis_summary": "Image analysis feature not configured."}
+        logger.info("Invoking SageMaker endpoint '%s' (async) with image of size %d bytes.", SAGEMAKER_SKIN_ANALYSIS_ENDPOINT_NAME, len(image_bytes))
+        try:
+            return await resilience.acall_with_deadline(
+                lambda: run_blocking(self._invoke_sagemaker_skin_endpoint, image_bytes), deadline or Deadline(), "sagemaker_analysis",
+                cap=SAGEMAKER_TIMEOUT_SECONDS, breaker=SAGEMAKER_BREAKER
+            )
+        except (CircuitOpenError, resilience.DeadlineExceeded) as e:
+            logger.warning(f"SageMaker skin image analysis skipped: {e}")
+            return {"analysis_summary": "Could not perform skin image analysis due to a technical issue."}
+        except Exception as e:
+            logger.error(f"Error invoking or parsing SageMaker endpoint response: {e}", exc_info=True)
+            return {"analysis_summary": "Could not perform skin image analysis due to a technical issue."}
 
-        if image_data_base64:
-            sagemaker_result_dict = self.analyze_skin_image_with_sagemaker(base64.b64decode(image_data_base64))
-            sagemaker_analysis_summary = sagemaker_result_dict.get("analysis_summary", "Image analysis failed.")
-            sagemaker_raw_output = sagemaker_result_dict.get("raw_output")
-        
+    def _rag_chain_inputs(self, user_query: str, chat_history_from_frontend: list, image_data_base64, sagemaker_analysis_summary: str) -> dict:
+        question_for_rag = user_query
+        if image_data_base64 and sagemaker_analysis_summary.find("No image") == -1 and sagemaker_analysis_summary.find("not available") == -1:
+            question_for_rag = (
+                f"A skin image was analyzed by an AI, which provided the following preliminary findings: '{sagemaker_analysis_summary}'. "
+                f"Based on this finding AND the user's text query below, please provide advice.\n\n"
+                f"User's Text Query: {user_query}"
+            )
+
+        # Stored conversations (sessions.py) carry these messages already built.
+        return {"question": question_for_rag, "chat_history": as_history(chat_history_from_frontend).langchain_messages()}
+
+    @staticmethod
+    def _chain_run_config():
+        # Per-call callbacks propagate to every child run (rewrite LLM, retriever, answer LLM).
+        from chain_metrics import STAGE_TIMING_HANDLER
+        return {"callbacks": [STAGE_TIMING_HANDLER]}
+
+    @staticmethod
+    def _prompt_usage_scope():
+        from chain_metrics import prompt_usage_scope
+        return prompt_usage_scope()
+
+    @staticmethod
+    def _log_prompt_usage(usage):
+        # Per request: how much of the prompt the provider served from its prefix cache.
+        if usage.calls:
+            logger.info("RAGService: prompt tokens %d cached / %d total over %d LLM call(s)",
+                        usage.cached, usage.total, usage.calls)
+
+    @staticmethod
+    def _sagemaker_fields(sagemaker_result_dict):
+        if sagemaker_result_dict is None:
+            return "No image was submitted for analysis.", None
+        return sagemaker_result_dict.get("analysis_summary", "Image analysis failed."), sagemaker_result_dict.get("raw_output")
+
+    def _build_response(self, classification: str, sagemaker_analysis_summary: str, sagemaker_raw_output, rag_result=None, rag_error=None) -> dict:
         additional_data = {"sagemaker_analysis": {"summary": sagemaker_analysis_summary, "raw": sagemaker_raw_output}}
         response_message = ""
         # The 'urgency' key in the response will now hold one of the four categories
@@ -307,41 +866,108 @@ PetHealth AI's Non-Urgent Advice (synthesizing all available information):"""
             )
             additional_data.update({"action_required": "IMMEDIATE_VET_CONSULTATION", "suggest_find_vet": True, "navigate_to_emergency_page": True})
         
-        else: # Handles NON_URGENT, UNCERTAIN, and GENERAL_CONVERSATION
-            try:
-                question_for_rag = user_query
-                if image_data_base64 and sagemaker_analysis_summary.find("No image") == -1 and sagemaker_analysis_summary.find("not available") == -1:
-                    question_for_rag = (
-                        f"A skin image was analyzed by an AI, which provided the following preliminary findings: '{sagemaker_analysis_summary}'. "
-                        f"Based on this finding AND the user's text query below, please provide advice.\n\n"
-                        f"User's Text Query: {user_query}"
-                    )
-
-                # Clear memory from the previous request to ensure the chain is stateless.
-                self.memory.clear()
-                langchain_formatted_history = [HumanMessage(content=msg['text']) if msg['sender'] == 'user' else AIMessage(content=msg['text']) for msg in chat_history_from_frontend]
-                self.memory.chat_memory.add_messages(langchain_formatted_history)
-
-                result = self.qa_chain_rag.invoke({
-                    "question": question_for_rag
-                })
-                
-                rag_answer = result.get("answer", "I'm not quite sure how to respond to that, but I'm here to help with your pet's health questions.")
-                
-                # Tailor the response prefix based on the classification.
-                if classification == "UNCERTAIN":
-                    # Only show the warning for UNCERTAIN health-related queries.
-                    response_message = f"I'm not entirely sure about the urgency of this situation. Here is some information that may be helpful, but it's always safest to consult a vet if you are concerned:\n\n{rag_answer}"
-                else: # NON_URGENT and GENERAL_CONVERSATION get a direct, friendly answer.
-                    response_message = rag_answer
-                
-                additional_data["action_required"] = "MONITOR_AND_CONSIDER_VET_IF_NEEDED"
+        elif rag_error is not None: # Handles NON_URGENT, UNCERTAIN, and GENERAL_CONVERSATION when the chain failed
+            logger.error(f"RAGService: Error during RAG chain invocation: {rag_error}", exc_info=rag_error)
+            response_message = f"I'm having trouble retrieving detailed information from my knowledge base right now. Image analysis: {sagemaker_analysis_summary}. Please monitor your pet and contact your vet if things don't improve."
+            urgency_for_frontend = "UNCERTAIN" 
+            additional_data.update({"action_required": "MONITOR_AND_CONSIDER_VET_IF_NEEDED", "error_retrieving_details": True})
 
-            except Exception as e:
-                logger.error(f"RAGService: Error during RAG chain invocation: {e}", exc_info=True)
-                response_message = f"I'm having trouble retrieving detailed information from my knowledge base right now. Image analysis: {sagemaker_analysis_summary}. Please monitor your pet and contact your vet if things don't improve."
-                urgency_for_frontend = "UNCERTAIN" 
-                additional_data.update({"action_required": "MONITOR_AND_CONSIDER_VET_IF_NEEDED", "error_retrieving_details": True})
+        else: # Handles NON_URGENT, UNCERTAIN, and GENERAL_CONVERSATION
+            rag_answer = rag_result.get("answer", "I'm not quite sure how to respond to that, but I'm here to help with your pet's health questions.")
+            
+            # Tailor the response prefix based on the classification.
+            if classification == "UNCERTAIN":
+                # Only show the warning for UNCERTAIN health-related queries.
+                response_message = f"I'm not entirely sure about the urgency of this situation. Here is some information that may be helpful, but it's always safest to consult a vet if you are concerned:\n\n{rag_answer}"
+            else: # NON_URGENT and GENERAL_CONVERSATION get a direct, friendly answer.
+                response_message = rag_answer
+            
+            additional_data["action_required"] = "MONITOR_AND_CONSIDER_VET_IF_NEEDED"
                 
         # Return a clean response object for the frontend to handle.
-        return {"urgency": urgency_for_frontend, "response": response_message, "data": additional_data}
\ No newline at end of file
+        return {"urgency": urgency_for_frontend, "response": response_message, "data": additional_data}
+
+    def generate_response(self, user_query: str, chat_history_from_frontend: list, image_data_base64: str = None) -> dict:
+        """
+        FIXED V2: This version handles the new 'GENERAL_CONVERSATION' category to provide
+        a more natural, friendly response to non-medical queries. The chat history is passed
+        to the chain on every call, so no conversation state is kept between requests.
+        `chat_history_from_frontend` is the frontend's list or a stored sessions.ConversationHistory.
+        Identical concurrent history-free queries are answered by a single run (see chat_coalescing_key).
+        """
+        key = chat_coalescing_key(user_query, chat_history_from_frontend, image_data_base64)
+        if key is None:
+            return self._generate_response(user_query, chat_history_from_frontend, image_data_base64)
+        return CHAT_FLIGHT.do(key, lambda: self._generate_response(user_query, chat_history_from_frontend))
+
+    def _generate_response(self, user_query: str, chat_history_from_frontend: list, image_data_base64: str = None) -> dict:
+        self._follow_active_generation()
+        chat_history_from_frontend = as_history(chat_history_from_frontend) # derived forms are shared by both stages
+        # One deadline for the whole request; the retriever inside the chain reads it from the context.
+        with resilience.deadline_scope(Deadline()) as deadline:
+            classification = self.classify_urgency_with_bedrock(user_query, chat_history_from_frontend, deadline)
+
+            sagemaker_result_dict = None
+            if image_data_base64:
+                sagemaker_result_dict = self.analyze_skin_image_with_sagemaker(base64.b64decode(image_data_base64), deadline)
+            sagemaker_analysis_summary, sagemaker_raw_output = self._sagemaker_fields(sagemaker_result_dict)
+
+            rag_result, rag_error = None, None
+            if classification != "URGENT":
+                chain_inputs = self._rag_chain_inputs(user_query, chat_history_from_frontend, image_data_base64, sagemaker_analysis_summary)
+                # Waits fairly for an LLM slot on the pool thread and holds it until the chain really ends,
+                # even one this request stopped waiting for. AdmissionRejected propagates (429), it is not a chain failure.
+                try:
+                    with self._prompt_usage_scope() as prompt_usage:
+                        rag_result = resilience.call_with_deadline(
+                            lambda: self.qa_chain_rag.invoke(chain_inputs, config=self._chain_run_config()),
+                            deadline, "rag_chain", breaker=RAG_CHAIN_BREAKER,
+                            gate=lambda: admission.LLM_LIMITER.slot(timeout=deadline.timeout(admission.ADMISSION_QUEUE_TIMEOUT_SECONDS))
+                        )
+                except admission.AdmissionRejected:
+                    raise
+                except Exception as e:
+                    rag_error = e
+                self._log_prompt_usage(prompt_usage)
+        return self._build_response(classification, sagemaker_analysis_summary, sagemaker_raw_output, rag_result, rag_error)
+
+    async def agenerate_response(self, user_query: str, chat_history_from_frontend: list, image_data_base64: str = None) -> dict:
+        """
+        Async variant of generate_response with the same response contract and coalescing.
+        Bedrock classification and SageMaker image analysis are independent, so they run concurrently.
+        """
+        key = chat_coalescing_key(user_query, chat_history_from_frontend, image_data_base64)
+        if key is None:
+            return await self._agenerate_response(user_query, chat_history_from_frontend, image_data_base64)
+        return await CHAT_FLIGHT.ado(key, lambda: self._agenerate_response(user_query, chat_history_from_frontend))
+
+    async def _agenerate_response(self, user_query: str, chat_history_from_frontend: list, image_data_base64: str = None) -> dict:
+        self._follow_active_generation()
+        chat_history_from_frontend = as_history(chat_history_from_frontend)
+        with resilience.deadline_scope(Deadline()) as deadline:
+            classification_task = self.aclassify_urgency_with_bedrock(user_query, chat_history_from_frontend, deadline)
+            if image_data_base64:
+                classification, sagemaker_result_dict = await asyncio.gather(
+                    classification_task,
+                    self.aanalyze_skin_image_with_sagemaker(base64.b64decode(image_data_base64), deadline)
+                )
+            else:
+                classification, sagemaker_result_dict = await classification_task, None
+            sagemaker_analysis_summary, sagemaker_raw_output = self._sagemaker_fields(sagemaker_result_dict)
+
+            rag_result, rag_error = None, None
+            if classification != "URGENT":
+                chain_inputs = self._rag_chain_inputs(user_query, chat_history_from_frontend, image_data_base64, sagemaker_analysis_summary)
+                try:
+                    with self._prompt_usage_scope() as prompt_usage:
+                        rag_result = await resilience.acall_with_deadline(
+                            lambda: self.qa_chain_rag.ainvoke(chain_inputs, config=self._chain_run_config()),
+                            deadline, "rag_chain", breaker=RAG_CHAIN_BREAKER,
+                            gate=lambda: admission.LLM_LIMITER.aslot(timeout=deadline.timeout(admission.ADMISSION_QUEUE_TIMEOUT_SECONDS))
+                        )
+                except admission.AdmissionRejected:
+                    raise
+                except Exception as e:
+                    rag_error = e
+                self._log_prompt_usage(prompt_usage)
+        return self._build_response(classification, sagemaker_analysis_summary, sagemaker_raw_output, rag_result, rag_error)
@@ -0,0 +1,218 @@
+#logging
+import logging
+
+import contextvars
+import cProfile
+import functools
+import glob
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'request_profiler'
+
+# Opt-in profiling of single requests. A request is profiled when it carries
+#   X-Profile-Request: <PROFILE_REQUEST_TOKEN>
+# or is picked by PROFILE_SAMPLE_RATE (fraction of requests, 0 = never). It then runs under
+# cProfile - in the request thread and in every pool thread it hands work to (see propagate()) -
+# and two files are written to PROFILE_DIR (the app's logs directory by default):
+#   profile-<endpoint>-<request id>.prof  - pstats dump (python -m pstats / snakeviz)
+#   profile-<endpoint>-<request id>.json  - summary: wall time, top functions by self time
+# Only the newest PROFILE_MAX_FILES profiles are kept. With neither a token nor a sample rate
+# configured PROFILING_ENABLED is False, and endpoints are not wrapped at all.
+
+PROFILE_REQUEST_TOKEN = os.getenv("PROFILE_REQUEST_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+PROFILE_TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP_FUNCTIONS", "25"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+PROFILING_ENABLED = bool(PROFILE_REQUEST_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+PROFILE_HEADER = "X-Profile-Request"
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$') # safe to put in a file name
+
+_current_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+def token_authorised(value):
+    """True if `value` is the configured profiling token (constant-time comparison)."""
+    return bool(PROFILE_REQUEST_TOKEN) and hmac.compare_digest((value or "").encode(), PROFILE_REQUEST_TOKEN.encode())
+
+
+def profile_reason(headers):
+    """
+    Args:
+        headers: Request headers
+
+    Returns:
+        "header" or "sampled" if the request should be profiled, else None
+    """
+    if token_authorised(headers.get(PROFILE_HEADER)):
+        return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def request_id_from(headers):
+    """The caller's X-Request-ID if it is file-name safe, else a new random ID."""
+    request_id = headers.get(REQUEST_ID_HEADER, "")
+    return request_id if _REQUEST_ID_RE.match(request_id) else uuid.uuid4().hex
+
+
+def _function_name(func):
+    filename, line, name = func
+    return f"{filename}:{line}({name})" if line else name # built-ins have no line
+
+
+class RequestProfile:
+    def __init__(self, request_id, endpoint, reason):
+        """
+        cProfile data of one request, collected from every thread that worked on it
+
+        Args:
+            request_id: Request ID, part of the file names
+            endpoint: Endpoint name, part of the file names
+            reason: Why the request is profiled ("header" or "sampled")
+        """
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.reason = reason
+        self.wall_seconds = None
+        self._profilers = []
+        self._lock = threading.Lock()
+
+    def run(self, func, *args, **kwargs):
+        """Call `func` with a profiler of its own enabled on the current thread."""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            # Only finished threads are merged: a call the request abandoned (deadline, losing
+            # hedge attempt) may still be running when the profile is saved.
+            with self._lock:
+                self._profilers.append(profiler)
+
+    def stats(self):
+        """Returns: pstats.Stats merged over the finished threads."""
+        with self._lock:
+            profilers = list(self._profilers)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+    def summary(self, top=None):
+        """
+        Returns:
+            Dict with the request ID, wall time, thread count and the `top` functions by self time
+        """
+        top = PROFILE_TOP_FUNCTIONS if top is None else top
+        stats = self.stats()
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "reason": self.reason,
+            "wall_ms": round(self.wall_seconds * 1000, 2) if self.wall_seconds is not None else None,
+            "profiled_ms": round(stats.total_tt * 1000, 2), # summed over threads, including blocking waits
+            "threads": len(self._profilers),
+            "top_functions": [
+                {"function": _function_name(func), "calls": calls, "self_ms": round(tottime * 1000, 3),
+                 "cumulative_ms": round(cumtime * 1000, 3)}
+                for func, (_, calls, tottime, cumtime, _) in rows
+            ],
+        }
+
+    def save(self, directory=None):
+        """
+        Write the pstats dump and the JSON summary, then prune old profiles
+
+        Returns:
+            The summary dict
+        """
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"profile-{self.endpoint}-{self.request_id}")
+        self.stats().dump_stats(f"{base}.prof")
+        summary = self.summary()
+        with open(f"{base}.json", 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=1)
+        _prune(directory)
+        return summary
+
+
+def _prune(directory):
+    dumps = sorted(glob.glob(os.path.join(directory, 'profile-*.prof')), key=os.path.getmtime)
+    for path in dumps[:-PROFILE_MAX_FILES] if PROFILE_MAX_FILES > 0 else []:
+        for stale in (path, f"{path[:-len('.prof')]}.json"):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+
+def profile_call(request_id, endpoint, reason, func, *args, **kwargs):
+    """
+    Run `func` as a profiled request and save its profile
+
+    Returns:
+        (func's result, summary dict or None if the profile could not be saved)
+    """
+    profile = RequestProfile(request_id, endpoint, reason)
+    token = _current_profile.set(profile)
+    start = time.perf_counter()
+    try:
+        result = profile.run(func, *args, **kwargs)
+    finally:
+        profile.wall_seconds = time.perf_counter() - start
+        _current_profile.reset(token)
+        summary = _save(profile)
+    return result, summary
+
+
+def _save(profile):
+    # A profile that cannot be written must not fail the request it describes.
+    try:
+        summary = profile.save()
+    except Exception as e:
+        logger.error(f"Failed to save the profile of request {profile.request_id}: {e}", exc_info=True)
+        return None
+    hottest = ", ".join(f"{row['function']} {row['self_ms']:.1f}ms" for row in summary["top_functions"][:3])
+    logger.info(f"Profiled '{profile.endpoint}' request {profile.request_id} ({profile.reason}): "
+                f"{summary['wall_ms']:.1f} ms wall, {summary['threads']} thread(s); hottest: {hottest}")
+    return summary
+
+
+def propagate(func):
+    """
+    `func`, profiled too if the calling request is: wrap work handed to a thread pool with this
+    (inside the copied context), since cProfile only sees the thread it is enabled on.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return func
+    return functools.partial(profile.run, func)
+
+
+def load_summary(endpoint, request_id, directory=None):
+    """Returns: the saved summary of a profiled request, or None."""
+    if not _REQUEST_ID_RE.match(request_id) or not _REQUEST_ID_RE.match(endpoint):
+        return None
+    try:
+        with open(os.path.join(directory or PROFILE_DIR, f"profile-{endpoint}-{request_id}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
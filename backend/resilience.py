@@ -0,0 +1,391 @@
+#logging
+import logging
+
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+import request_profiler
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'resilience'
+
+# Bounding outbound calls on the chat path:
+#   - Deadline: one time budget per request (CHAT_DEADLINE_SECONDS); every stage gets at most
+#     what is left, further capped per stage, and gives up instead of waiting on SDK timeouts.
+#   - Hedging: when an attempt is slower than the stage's observed p95 (from the metrics
+#     histograms), a second identical attempt is started and the first success wins.
+#   - CircuitBreaker: after consecutive failures a dependency is skipped at once for a cool-down,
+#     then a single probe call decides whether it is healthy again.
+# Failures of any kind surface as exceptions, so the callers' existing fallbacks apply.
+
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "25"))
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+RESILIENCE_THREADS = int(os.getenv("RESILIENCE_THREADS", "64"))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class Deadline:
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds=CHAT_DEADLINE_SECONDS):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, cap=None):
+        """Seconds a stage may take: what is left of the budget, at most `cap`."""
+        remaining = self.remaining()
+        return remaining if cap is None else min(remaining, cap)
+
+
+# The request's deadline, for code we do not call directly (e.g. the retriever inside the chain).
+_current_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        """
+        Consecutive-failure circuit breaker for one dependency
+
+        Args:
+            name: Dependency name, used in logs and metrics
+            failure_threshold: Consecutive failures that open the circuit
+            reset_seconds: Time the circuit stays open before a probe call is let through
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises:
+            CircuitOpenError: The dependency is being skipped
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+        metrics.increment("circuit_breaker_rejections_total", breaker=self.name)
+        raise CircuitOpenError(f"Circuit for '{self.name}' is open; skipping the call.")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def release_probe(self):
+        """A call let through by before_call() never reached the dependency: neither success nor failure."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _transition(self, state):
+        logger.warning(f"Circuit breaker '{self.name}': {self.state} -> {state}.")
+        self.state = state
+        metrics.increment("circuit_breaker_transitions_total", breaker=self.name, state=state)
+
+    def reset(self):
+        with self._lock:
+            self.state, self._failures, self._probe_in_flight = self.CLOSED, 0, False
+
+
+class HedgePolicy:
+    def __init__(self, stage, quantile=HEDGE_QUANTILE, min_samples=HEDGE_MIN_SAMPLES, default_delay=1.0, min_delay=0.05):
+        """
+        When to start a hedged attempt for a stage
+
+        Args:
+            stage: Stage name whose latency histogram sets the threshold
+            quantile: Attempts slower than this quantile of past calls are hedged
+            min_samples: Observations needed before the histogram is trusted
+            default_delay: Threshold (seconds) until then
+            min_delay: Lower bound, so a fast stage does not hedge on every small hiccup
+        """
+        self.stage = stage
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+
+    def delay(self):
+        observed = metrics.REGISTRY.stage_percentile(self.stage, self.quantile, self.min_samples)
+        return max(self.min_delay, self.default_delay if observed is None else observed)
+
+
+# Calls run on these pools so the caller can stop waiting for them. A call that overruns its
+# deadline is abandoned, not interrupted; the SDK clients' own timeouts bound how long it lingers.
+# Deadline-bounded calls and hedged attempts use separate pools because one can run inside the
+# other (retrieval is hedged inside the deadline-bounded chain) and must not wait on its own pool.
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def _executor(pool):
+    executor = _executors.get(pool)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(pool)
+            if executor is None:
+                executor = _executors[pool] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=RESILIENCE_THREADS, thread_name_prefix=f'resilience-{pool}'
+                )
+    return executor
+
+
+def _reset_executors_in_child():
+    _executors.clear()
+
+
+os.register_at_fork(after_in_child=_reset_executors_in_child)
+
+
+def _submit(pool, func):
+    # Run in a copy of the caller's context so the request deadline stays visible to the call.
+    return _executor(pool).submit(contextvars.copy_context().run, request_profiler.propagate(func))
+
+
+def _start(breaker, deadline, stage, cap):
+    timeout = deadline.timeout(cap)
+    if timeout <= 0:
+        metrics.increment("deadline_exceeded_total", stage=stage)
+        raise DeadlineExceeded(f"No time left in the request deadline for '{stage}'.")
+    # Last, so that a half-open breaker's probe slot is only taken by a call that will run.
+    if breaker is not None:
+        breaker.before_call()
+    return timeout
+
+
+def _timed_out(breaker, stage, timeout):
+    if breaker is not None:
+        breaker.record_failure()
+    metrics.increment("deadline_exceeded_total", stage=stage)
+    return DeadlineExceeded(f"'{stage}' did not complete within {timeout:.2f}s.")
+
+
+def _not_reached(breaker):
+    # The call gave up at its gate, before the dependency was called.
+    if breaker is not None:
+        breaker.release_probe()
+
+
+class _GatedCall:
+    def __init__(self, func, gate):
+        """
+        `func()` run inside `gate()` on the pool thread, so the gate is held for as long as the call
+        really runs - including after the caller abandoned it at the deadline
+        """
+        self.func = func
+        self.gate = gate
+        self.started = gate is None
+        self.abandoned = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.gate is None:
+            return self.func()
+        with self.gate():
+            with self._lock:
+                if self.abandoned: # the caller stopped waiting while this call queued at the gate
+                    return None
+                self.started = True
+            return self.func()
+
+    def abandon(self):
+        """Returns: True if the call got past the gate before the caller stopped waiting."""
+        with self._lock:
+            self.abandoned = True
+            return self.started
+
+
+def call_with_deadline(func, deadline, stage, cap=None, breaker=None, gate=None):
+    """
+    Run `func()` and wait at most the stage's share of the deadline
+
+    Args:
+        func: Blocking callable
+        deadline: Request Deadline
+        stage: Stage name (metrics, messages)
+        cap: Upper bound in seconds for this stage
+        breaker: Optional CircuitBreaker of the dependency
+        gate: Optional context manager factory entered around `func()` on the pool thread, e.g. a
+              limiter's slot. Errors raised by the gate, and the deadline passing while the call
+              still waits at it, do not count against the breaker.
+
+    Raises:
+        DeadlineExceeded, CircuitOpenError, or whatever `gate` or `func` raised
+    """
+    timeout = _start(breaker, deadline, stage, cap)
+    call = _GatedCall(func, gate)
+    future = _submit("call", call)
+    try:
+        result = future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        if call.abandon():
+            raise _timed_out(breaker, stage, timeout) from None
+        _not_reached(breaker)
+        raise _timed_out(None, stage, timeout) from None
+    except Exception:
+        if not call.started:
+            _not_reached(breaker)
+        elif breaker is not None:
+            breaker.record_failure()
+        raise
+    if breaker is not None:
+        breaker.record_success()
+    return result
+
+
+def hedged_call(func, deadline, stage, policy, cap=None, breaker=None):
+    """
+    Like call_with_deadline, but starts a second attempt of `func()` if the first one is slower
+    than the policy's threshold; the first attempt to succeed wins
+    """
+    timeout = _start(breaker, deadline, stage, cap)
+    started = time.monotonic()
+    attempts = [_submit("hedge", func)]
+    done, _ = concurrent.futures.wait(attempts, timeout=min(policy.delay(), timeout))
+    if not done and time.monotonic() - started < timeout:
+        attempts.append(_submit("hedge", func))
+
+    pending, last_error = set(attempts), None
+    while pending:
+        left = timeout - (time.monotonic() - started)
+        if left <= 0:
+            break
+        done, pending = concurrent.futures.wait(pending, timeout=left, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if breaker is not None:
+                    breaker.record_success()
+                _record_hedge(stage, attempts, future)
+                return future.result()
+            last_error = future.exception()
+    if pending or last_error is None:
+        raise _timed_out(breaker, stage, timeout)
+    if breaker is not None:
+        breaker.record_failure()
+    raise last_error
+
+
+def _record_hedge(stage, attempts, winner):
+    if len(attempts) > 1:
+        metrics.increment("hedged_requests_total", stage=stage, winner="primary" if winner is attempts[0] else "hedge")
+
+
+async def acall_with_deadline(coro_func, deadline, stage, cap=None, breaker=None, gate=None):
+    """
+    Async variant of call_with_deadline; `coro_func()` returns the awaitable to run and `gate()`
+    an async context manager. At the deadline the call is cancelled, which also releases the gate.
+    """
+    timeout = _start(breaker, deadline, stage, cap)
+    started = gate is None
+
+    async def gated():
+        nonlocal started
+        async with gate():
+            started = True
+            return await coro_func()
+
+    try:
+        result = await asyncio.wait_for(coro_func() if gate is None else gated(), timeout)
+    except asyncio.TimeoutError:
+        if started:
+            raise _timed_out(breaker, stage, timeout) from None
+        _not_reached(breaker)
+        raise _timed_out(None, stage, timeout) from None
+    except Exception:
+        if not started:
+            _not_reached(breaker)
+        elif breaker is not None:
+            breaker.record_failure()
+        raise
+    if breaker is not None:
+        breaker.record_success()
+    return result
+
+
+async def ahedged_call(coro_func, deadline, stage, policy, cap=None, breaker=None):
+    """Async variant of hedged_call; `coro_func()` returns the awaitable for one attempt."""
+    timeout = _start(breaker, deadline, stage, cap)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    attempts = [asyncio.ensure_future(coro_func())]
+    done, _ = await asyncio.wait(attempts, timeout=min(policy.delay(), timeout))
+    if not done and loop.time() - started < timeout:
+        attempts.append(asyncio.ensure_future(coro_func()))
+
+    pending, last_error = set(attempts), None
+    try:
+        while pending:
+            left = timeout - (loop.time() - started)
+            if left <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if breaker is not None:
+                        breaker.record_success()
+                    _record_hedge(stage, attempts, task)
+                    return task.result()
+                last_error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+    if pending or last_error is None:
+        raise _timed_out(breaker, stage, timeout)
+    if breaker is not None:
+        breaker.record_failure()
+    raise last_error
@@ -0,0 +1,331 @@
+#logging
+import logging
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'sessions'
+
+# Server-side chat sessions. A client that sends `conversation_id` (empty to start one) sends only
+# its new message; the history lives here, keyed by user and conversation ID:
+#   - compact: (is_user, text) pairs, bounded to SESSION_MAX_MESSAGES / SESSION_MAX_CHARS by
+#     dropping the oldest turns, evicted SESSION_TTL_SECONDS after the last turn;
+#   - with derived state cached next to it (the LangChain messages, the recent user queries the
+#     Bedrock classifier sees, the previous classification), updated per turn instead of rebuilt;
+#   - in process memory, or also in a SQLite file when SESSION_STORE_PATH is set, so sessions
+#     survive restarts and are shared by the workers of a host.
+# Requests without `conversation_id` keep sending `chat_history` and are handled as before.
+# A `conversation_id` this store does not know (expired, evicted, or kept by another worker without
+# a shared SESSION_STORE_PATH) with no `chat_history` to start over from raises ConversationNotFound:
+# the apps answer 409 with "conversation_reset": true, and the client resends its history.
+
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "86400"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))
+SESSION_MAX_CHARS = int(os.getenv("SESSION_MAX_CHARS", "16000"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000")) # kept in memory per process
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH") # e.g. backend/cache/sessions.sqlite3
+
+CLASSIFICATION_HISTORY_TURNS = 5 # trailing messages whose user queries go to the Bedrock classifier
+
+
+class ConversationNotFound(LookupError):
+    pass
+
+
+def _to_langchain(messages):
+    from langchain_core.messages import AIMessage, HumanMessage
+    return [HumanMessage(content=text) if is_user else AIMessage(content=text) for is_user, text in messages]
+
+
+class ConversationHistory:
+    __slots__ = ("messages", "last_classification", "_langchain_messages", "_recent_user_queries")
+
+    def __init__(self, messages, last_classification=None, langchain_messages=None, recent_user_queries=None):
+        """
+        Read-only chat history handed to RAGService, with its derived forms computed at most once
+
+        Args:
+            messages: Tuple of (is_user, text) pairs, oldest first
+            last_classification: Urgency classification of the previous turn, if known
+            langchain_messages, recent_user_queries: Already derived forms, if the caller has them
+        """
+        self.messages = messages
+        self.last_classification = last_classification
+        self._langchain_messages = langchain_messages
+        self._recent_user_queries = recent_user_queries
+
+    @classmethod
+    def from_frontend(cls, chat_history):
+        """Build from the `chat_history` list clients send: [{"sender": "user"|"ai", "text": ...}, ...]."""
+        return cls(tuple((msg.get('sender') == 'user', msg.get('text')) for msg in chat_history))
+
+    def __len__(self):
+        return len(self.messages)
+
+    def langchain_messages(self):
+        if self._langchain_messages is None:
+            self._langchain_messages = _to_langchain(self.messages)
+        return self._langchain_messages
+
+    def recent_user_queries(self):
+        if self._recent_user_queries is None:
+            self._recent_user_queries = _recent_user_queries(self.messages)
+        return self._recent_user_queries
+
+
+def _recent_user_queries(messages):
+    return tuple(text for is_user, text in messages[-CLASSIFICATION_HISTORY_TURNS:] if is_user)
+
+
+def as_history(chat_history):
+    """Accept either a ConversationHistory or the frontend's `chat_history` list."""
+    if isinstance(chat_history, ConversationHistory):
+        return chat_history
+    return ConversationHistory.from_frontend(chat_history or [])
+
+
+class Conversation:
+    def __init__(self, conversation_id, user, messages=(), last_classification=None, updated=None, version=0):
+        self.id = conversation_id
+        self.user = user
+        self.messages = list(messages)
+        self.last_classification = last_classification
+        self.updated = time.time() if updated is None else updated
+        self.version = version
+        self.lock = threading.Lock()
+        self._langchain_messages = None
+
+    def history(self):
+        """Snapshot for one request; later turns do not change it."""
+        with self.lock:
+            messages = tuple(self.messages)
+            langchain_messages = self._langchain_messages
+            if langchain_messages is None and messages:
+                langchain_messages = self._langchain_messages = _to_langchain(messages)
+            return ConversationHistory(messages, self.last_classification,
+                                       list(langchain_messages or ()), _recent_user_queries(messages))
+
+    def _append(self, is_user, text):
+        self.messages.append((is_user, text))
+        if self._langchain_messages is not None:
+            self._langchain_messages.extend(_to_langchain(((is_user, text),)))
+
+    def _trim(self, max_messages, max_chars):
+        total_chars = sum(len(text) for _, text in self.messages)
+        drop = 0
+        while len(self.messages) - drop > max_messages or (total_chars > max_chars and len(self.messages) - drop > 2):
+            total_chars -= len(self.messages[drop][1])
+            drop += 1
+        if drop:
+            del self.messages[:drop]
+            if self._langchain_messages is not None:
+                del self._langchain_messages[:drop]
+
+    def to_payload(self):
+        return json.dumps({"m": [[int(is_user), text] for is_user, text in self.messages], "c": self.last_classification},
+                          separators=(",", ":"))
+
+    @classmethod
+    def from_row(cls, conversation_id, user, payload, updated, version):
+        data = json.loads(payload)
+        return cls(conversation_id, user, ((bool(is_user), text) for is_user, text in data["m"]), data.get("c"), updated, version)
+
+
+class SessionStore:
+    _SCHEMA = """CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT PRIMARY KEY, user TEXT NOT NULL, payload TEXT NOT NULL, updated REAL NOT NULL, version INTEGER NOT NULL)"""
+
+    def __init__(self, path=None, ttl_seconds=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX_SESSIONS,
+                 max_messages=SESSION_MAX_MESSAGES, max_chars=SESSION_MAX_CHARS):
+        """
+        Conversation store: an LRU of Conversation objects, optionally backed by SQLite
+
+        Args:
+            path: SQLite file for persistence across restarts and workers; None keeps sessions in memory only
+            ttl_seconds: Idle time after which a conversation is forgotten
+            max_sessions: Conversations kept in memory; least recently used ones are dropped
+                (and reloaded from SQLite on their next turn, if persistent)
+            max_messages, max_chars: Bounds on one conversation's stored history
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._creates = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            connection = self._connect()
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(self._SCHEMA)
+            finally:
+                connection.close()
+            logger.info(f"Chat sessions persisted in '{path}'.")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+
+    def _connection(self):
+        # One connection per thread and process: SQLite connections must not cross a fork.
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return connection
+
+    def _expired(self, updated, now):
+        return now - updated > self.ttl_seconds
+
+    def _remember(self, conversation):
+        with self._lock:
+            self._conversations[conversation.id] = conversation
+            self._conversations.move_to_end(conversation.id)
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+
+    def get(self, user, conversation_id):
+        """
+        Returns:
+            The user's live Conversation, or None if it does not exist, expired or belongs to someone else
+        """
+        if not conversation_id:
+            return None
+        now = time.time()
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is not None:
+                self._conversations.move_to_end(conversation_id)
+        if self.path:
+            conversation = self._refresh(conversation_id, conversation)
+        if conversation is None or conversation.user != user:
+            metrics.record_cache("chat_sessions", False)
+            return None
+        if self._expired(conversation.updated, now):
+            self.delete(conversation_id)
+            metrics.record_cache("chat_sessions", False)
+            return None
+        metrics.record_cache("chat_sessions", True)
+        return conversation
+
+    def _refresh(self, conversation_id, cached):
+        # Another worker may have recorded a turn since: reload only if the stored version moved on.
+        row = self._connection().execute("SELECT user, updated, version FROM sessions WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        if cached is not None and cached.version == row[2]:
+            return cached
+        row = self._connection().execute("SELECT user, payload, updated, version FROM sessions WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        conversation = Conversation.from_row(conversation_id, row[0], row[1], row[2], row[3])
+        self._remember(conversation)
+        return conversation
+
+    def create(self, user, chat_history=None):
+        """
+        Start a conversation for `user`, optionally seeded with a frontend `chat_history` list
+        """
+        self._creates += 1
+        if self._creates % 1000 == 0:
+            self.evict_expired()
+        seed = ConversationHistory.from_frontend(chat_history).messages if chat_history else ()
+        conversation = Conversation(secrets.token_urlsafe(16), user, seed)
+        conversation._trim(self.max_messages, self.max_chars)
+        if self.path:
+            self._write(conversation)
+        self._remember(conversation)
+        return conversation
+
+    def open(self, user, conversation_id, chat_history=None):
+        """
+        The user's conversation `conversation_id`, or a new one (seeded with `chat_history`) if it is unknown
+
+        Args:
+            chat_history: Callable returning the frontend history, only called when a new conversation is started
+
+        Raises:
+            ConversationNotFound: `conversation_id` is unknown and there is no history to start over from;
+                                  answering anyway would lose the conversation's context
+        """
+        conversation = self.get(user, conversation_id)
+        if conversation is None:
+            history = chat_history() if callable(chat_history) else chat_history
+            if conversation_id and not history:
+                raise ConversationNotFound(f"Conversation '{conversation_id}' is unknown or expired.")
+            conversation = self.create(user, history)
+        return conversation
+
+    def record_turn(self, conversation, user_message, ai_message, classification=None):
+        """
+        Append one user/AI exchange and persist it
+        """
+        with conversation.lock:
+            if self.path:
+                self._merge_stored(conversation)
+            conversation._append(True, user_message)
+            conversation._append(False, ai_message)
+            conversation._trim(self.max_messages, self.max_chars)
+            conversation.last_classification = classification
+            conversation.updated = time.time()
+            if self.path:
+                self._write(conversation)
+        self._remember(conversation)
+
+    def _merge_stored(self, conversation):
+        # Pick up turns recorded by another worker before appending ours.
+        row = self._connection().execute("SELECT payload, version FROM sessions WHERE id = ?", (conversation.id,)).fetchone()
+        if row is not None and row[1] != conversation.version:
+            stored = Conversation.from_row(conversation.id, conversation.user, row[0], conversation.updated, row[1])
+            conversation.messages, conversation.last_classification, conversation.version = stored.messages, stored.last_classification, stored.version
+            conversation._langchain_messages = None
+
+    def _write(self, conversation):
+        conversation.version += 1
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO sessions (id, user, payload, updated, version) VALUES (?, ?, ?, ?, ?)",
+                (conversation.id, conversation.user, conversation.to_payload(), conversation.updated, conversation.version)
+            )
+        except sqlite3.Error as e:
+            # The in-memory copy still serves this process; only persistence is lost.
+            logger.error(f"Failed to persist chat session '{conversation.id}': {e}")
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+        if self.path:
+            self._connection().execute("DELETE FROM sessions WHERE id = ?", (conversation_id,))
+
+    def evict_expired(self):
+        """
+        Drop conversations idle for longer than the TTL
+
+        Returns:
+            Number of conversations dropped from memory
+        """
+        now = time.time()
+        with self._lock:
+            expired = [cid for cid, conversation in self._conversations.items() if self._expired(conversation.updated, now)]
+            for cid in expired:
+                del self._conversations[cid]
+        if self.path:
+            self._connection().execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl_seconds,))
+        return len(expired)
+
+    def __len__(self):
+        return len(self._conversations)
+
+
+SESSION_STORE = SessionStore(SESSION_STORE_PATH)
@@ -0,0 +1,120 @@
+#logging
+import logging
+
+import asyncio
+import threading
+
+import metrics
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'singleflight'
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "shared")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = True
+
+
+class SingleFlight:
+    def __init__(self, operation, shared=None):
+        """
+        Coalesce concurrent calls with the same key into one execution
+
+        While a call for a key is in flight, later callers with that key wait for it and receive the
+        same result (or exception) instead of starting their own. Nothing is cached: once the call
+        finishes, the next caller starts a new one. Results are shared between callers, so treat
+        them as read-only.
+
+        Args:
+            operation: Name used in the `coalesced_requests_total` / `coalesce_executions_total` metrics
+            shared: Optional `shared(result, error) -> bool`; an outcome it rejects (e.g. an error that
+                belongs to the caller that ran the call) is not handed to the waiting callers, they
+                start over: one of them runs the call again, the others wait for that run
+        """
+        self.operation = operation
+        self._shared = shared
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Run `func()` for `key`, or wait for the call already running for it (threads)
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                is_leader = call is None
+                if is_leader:
+                    call = self._calls[key] = _Call()
+            if is_leader:
+                break
+            call.done.wait()
+            if call.shared:
+                metrics.increment("coalesced_requests_total", operation=self.operation)
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            metrics.increment("coalesce_retries_total", operation=self.operation)
+
+        metrics.increment("coalesce_executions_total", operation=self.operation)
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.shared = self._shares(call.result, call.error)
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, coro_func):
+        """
+        Await `coro_func()` for `key`, or the call already running for it (asyncio)
+
+        The shared call runs as its own task, so a caller that is cancelled (e.g. the client
+        disconnected) does not cancel it for the others.
+        """
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        while True:
+            task = self._async_calls.get(loop_key)
+            if task is None or task.done():
+                metrics.increment("coalesce_executions_total", operation=self.operation)
+                task = loop.create_task(coro_func())
+                self._async_calls[loop_key] = task
+                task.add_done_callback(lambda finished: self._forget(loop_key, finished))
+                return await asyncio.shield(task)
+            try:
+                result = await asyncio.shield(task)
+            except Exception as e:
+                if self._shares(None, e):
+                    metrics.increment("coalesced_requests_total", operation=self.operation)
+                    raise
+            else:
+                if self._shares(result, None):
+                    metrics.increment("coalesced_requests_total", operation=self.operation)
+                    return result
+            metrics.increment("coalesce_retries_total", operation=self.operation)
+
+    def _shares(self, result, error):
+        return self._shared is None or self._shared(result, error)
+
+    def _forget(self, loop_key, task):
+        if self._async_calls.get(loop_key) is task:
+            del self._async_calls[loop_key]
+
+    def in_flight(self):
+        return len(self._calls) + len(self._async_calls)
+
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive form of a free-text query, used in coalescing keys."""
+    return " ".join(text.split()).casefold()
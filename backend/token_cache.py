@@ -0,0 +1,242 @@
+#logging
+import logging
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask_awscognito.exceptions import TokenVerifyError
+
+import metrics
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'token_cache'
+
+# Cognito access tokens are reused for every request of a session (1 hour by default), and the
+# user pool's signing keys change only on rotation. Verifying the RS256 signature and, worse,
+# downloading the JWKS on every request are therefore both cached:
+#   - VerifiedTokenCache: claims of tokens that passed verification, keyed by SHA-256 of the token,
+#     until the token's `exp`. Invalid tokens are never cached.
+#   - JWKSCache: the pool's public keys, refreshed in a background thread once they are older
+#     than the refresh interval (requests keep using the current keys meanwhile), and refreshed
+#     synchronously when a token names a key id we have not seen (key rotation).
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("COGNITO_TOKEN_CACHE_SIZE", "10000"))
+JWKS_REFRESH_SECONDS = float(os.getenv("COGNITO_JWKS_REFRESH_SECONDS", "3600"))
+# Lower bound between two refreshes triggered by unknown key ids, so forged tokens cannot make
+# every request download the JWKS.
+JWKS_MIN_FORCED_REFRESH_SECONDS = float(os.getenv("COGNITO_JWKS_MIN_FORCED_REFRESH_SECONDS", "60"))
+# After a failed refresh (JWKS endpoint down), the next one is attempted no sooner than this,
+# instead of by every request that finds the keys stale.
+JWKS_REFRESH_RETRY_SECONDS = float(os.getenv("COGNITO_JWKS_REFRESH_RETRY_SECONDS", "30"))
+
+_UNKNOWN_KEY_MESSAGE = "Public key not found in jwks.json"
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_entries=TOKEN_CACHE_MAX_ENTRIES):
+        """
+        Bounded LRU cache of verified token claims
+
+        Args:
+            max_entries: Maximum number of tokens kept; the least recently used is evicted first
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # token digest -> (exp, claims)
+        self._lock = threading.Lock()
+
+    def get(self, token, now=None):
+        """
+        Return the cached claims of a token, or None if it is unknown or has expired
+        """
+        digest = token_digest(token)
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            exp, claims = entry
+            if now >= exp:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+        return dict(claims)
+
+    def put(self, token, claims, now=None):
+        """
+        Remember the claims of a token that passed verification, until its `exp` claim
+        """
+        exp = claims.get("exp")
+        now = time.time() if now is None else now
+        if not isinstance(exp, (int, float)) or exp <= now:
+            return
+        digest = token_digest(token)
+        with self._lock:
+            self._entries[digest] = (exp, dict(claims))
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class JWKSCache:
+    def __init__(self, fetch_keys, refresh_seconds=JWKS_REFRESH_SECONDS, min_forced_refresh_seconds=JWKS_MIN_FORCED_REFRESH_SECONDS,
+                 retry_seconds=JWKS_REFRESH_RETRY_SECONDS):
+        """
+        Cache of the user pool's signing keys
+
+        Args:
+            fetch_keys: Callable returning the current list of JWKs (raises on failure)
+            refresh_seconds: Age after which keys are refreshed in the background
+            min_forced_refresh_seconds: Minimum interval between refreshes forced by unknown key ids
+            retry_seconds: Wait after a failed refresh before the cached keys are refreshed again
+        """
+        self.fetch_keys = fetch_keys
+        self.refresh_seconds = refresh_seconds
+        self.min_forced_refresh_seconds = min_forced_refresh_seconds
+        self.retry_seconds = retry_seconds
+        self._keys = None
+        self._fetched_at = 0.0
+        self._retry_at = 0.0 # monotonic time before which a failed refresh is not retried
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get_keys(self):
+        """
+        Return the cached keys, fetching them synchronously only when none are cached yet
+        """
+        keys = self._keys
+        if keys is None:
+            with self._lock:
+                if self._keys is None:
+                    self._refresh_locked()
+                return self._keys
+        now = time.monotonic()
+        if now - self._fetched_at >= self.refresh_seconds and now >= self._retry_at:
+            self._refresh_in_background()
+        return keys
+
+    def force_refresh(self):
+        """
+        Refresh now because a token names an unknown key id
+
+        Returns:
+            True if the keys were refreshed, False if the last refresh (or failed attempt) is too recent
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._keys is not None and (now - self._fetched_at < self.min_forced_refresh_seconds or now < self._retry_at):
+                return False
+            self._refresh_locked()
+            return True
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = None
+
+    def _refresh_locked(self):
+        try:
+            keys = self.fetch_keys()
+        except Exception:
+            self._retry_at = time.monotonic() + self.retry_seconds
+            metrics.increment("jwks_refresh_total", result="error")
+            raise
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        self._retry_at = 0.0
+        metrics.increment("jwks_refresh_total", result="ok")
+        logger.info(f"Fetched {len(keys)} Cognito signing keys.")
+
+    def _refresh_in_background(self):
+        # A thread started before a fork is reported as not alive in the child, so a worker never
+        # waits on a refresh that was in progress in the master.
+        with self._lock:
+            if (self._refresh_thread is not None and self._refresh_thread.is_alive()) or time.monotonic() < self._retry_at:
+                return
+            self._refresh_thread = threading.Thread(target=self._background_refresh, name='jwks-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._refresh_locked()
+        except Exception as e:
+            # Keep serving with the current keys; the first request after retry_seconds retries.
+            logger.warning(f"Background refresh of Cognito signing keys failed: {e}")
+
+
+class CognitoTokenVerifier:
+    def __init__(self, aws_auth, max_entries=TOKEN_CACHE_MAX_ENTRIES, jwks_refresh_seconds=JWKS_REFRESH_SECONDS):
+        """
+        Verify Cognito access tokens with flask_awscognito's TokenService, caching keys and results
+
+        Args:
+            aws_auth: The app's AWSCognitoAuthentication (user pool settings and token_service_factory)
+            max_entries: Size bound of the verified-token cache
+            jwks_refresh_seconds: Age after which the signing keys are refreshed in the background
+        """
+        self.aws_auth = aws_auth
+        self.tokens = VerifiedTokenCache(max_entries)
+        self.jwks = JWKSCache(self._fetch_keys, jwks_refresh_seconds)
+
+    def _token_service(self, jwk_keys=None):
+        auth = self.aws_auth
+        # Without keys, TokenService downloads the JWKS (raising FlaskAWSCognitoError on failure).
+        return auth.token_service_factory(auth.user_pool_id, auth.user_pool_client_id, auth.region, _jwk_keys=jwk_keys)
+
+    def _fetch_keys(self):
+        return self._token_service().jwk_keys
+
+    def cached_claims(self, token):
+        """Claims of an already verified, unexpired token, or None (never does I/O)."""
+        if not token:
+            return None
+        claims = self.tokens.get(token)
+        metrics.record_cache("cognito_token_cache", hit=claims is not None)
+        return claims
+
+    def verify(self, token):
+        """
+        Return the claims of a valid token
+
+        Raises:
+            TokenVerifyError: The token is missing, malformed, expired, badly signed or for another client
+            FlaskAWSCognitoError: The signing keys could not be fetched
+        """
+        claims = self.cached_claims(token)
+        if claims is not None:
+            return claims
+        return self.verify_uncached(token)
+
+    def verify_uncached(self, token):
+        if not token:
+            raise TokenVerifyError("No token provided")
+        try:
+            claims = self._verify_with_keys(token, self.jwks.get_keys())
+        except TokenVerifyError as e:
+            if str(e) != _UNKNOWN_KEY_MESSAGE or not self.jwks.force_refresh():
+                raise
+            logger.info("Token signed with an unknown key id; refreshed Cognito signing keys.")
+            claims = self._verify_with_keys(token, self.jwks.get_keys())
+        self.tokens.put(token, claims)
+        return dict(claims)
+
+    def _verify_with_keys(self, token, jwk_keys):
+        token_service = self._token_service(jwk_keys)
+        token_service.verify(token)
+        return token_service.claims
+
+    def clear(self):
+        self.tokens.clear()
+        self.jwks.invalidate()
@@ -0,0 +1,360 @@
+# Export the Pinecone index to a local snapshot, or load a snapshot back into an index
+#
+#   python vector_snapshot.py export -o snapshots/prod-2024-06 [--dtype float16] [--namespace ns]
+#   python vector_snapshot.py import -i snapshots/prod-2024-06 [--index staging-index] [--namespace ns]
+#
+# Restoring from a snapshot replaces re-parsing every PDF and re-embedding every chunk through
+# OpenAI (disaster recovery, a new environment, a staging copy). Imported into the served index
+# (PINECONE_INDEX_NAME) without --namespace, a snapshot becomes a new index generation, activated
+# once complete (see index_generations.py); into another index it keeps its exported namespace.
+# Snapshot layout, one directory:
+#   manifest.json        - format, dimension, dtype, vector count, chunk list, source index/namespace
+#   vectors-00000.npy    - (rows, dimension) float32 or float16 array, np.load(mmap_mode='r')-able
+#   metadata-00000.jsonl - one {"id", "metadata"} line per row of the matching vectors file
+
+#logging
+import logging
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+from logging_setup import configure_logging
+
+# --- Standalone Script Logging Setup ---
+LOG_DIR_SCRIPT_VS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+if not os.path.exists(LOG_DIR_SCRIPT_VS):
+    try:
+        os.makedirs(LOG_DIR_SCRIPT_VS)
+    except OSError as e:
+        print(f"Error creating log directory {LOG_DIR_SCRIPT_VS} for vector_snapshot.py: {e}")
+
+LOG_FILE_SCRIPT_VS = os.path.join(LOG_DIR_SCRIPT_VS, 'script_vector_snapshot.log')
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'vector_snapshot'
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_CHUNK_ROWS = int(os.getenv("SNAPSHOT_CHUNK_ROWS", "10000")) # rows per vectors/metadata file pair
+SNAPSHOT_BATCH_SIZE = 100 # IDs per list page / fetch, vectors per upsert (Pinecone's recommended batch)
+SNAPSHOT_THREADS = int(os.getenv("SNAPSHOT_THREADS", "8")) # concurrent fetch or upsert requests
+SNAPSHOT_UPSERT_ATTEMPTS = 3
+
+
+def _iter_id_pages(index, namespace, batch_size=SNAPSHOT_BATCH_SIZE):
+    """Yield lists of vector IDs. Pod-based indexes cannot list; their IDs are EmbeddingManager's doc_<n>."""
+    try:
+        pages = index.list(namespace=namespace, limit=batch_size)
+        first = next(pages, None)
+    except Exception as e:
+        total = _vector_count(index, namespace)
+        logger.warning(f"Index cannot list vector IDs ({e}); exporting doc_0..doc_{total - 1} instead.")
+        for start in range(0, total, batch_size):
+            yield [f"doc_{i}" for i in range(start, min(start + batch_size, total))]
+        return
+    if first:
+        yield list(first)
+    for page in pages:
+        if page:
+            yield list(page)
+
+
+def _vector_count(index, namespace):
+    stats = index.describe_index_stats()
+    namespaces = stats.get("namespaces") or {}
+    if namespace in namespaces:
+        return int(namespaces[namespace].get("vector_count", 0))
+    return int(stats.get("total_vector_count", 0))
+
+
+def _fetch(index, ids, namespace, dtype):
+    vectors = index.fetch(ids=ids, namespace=namespace).vectors
+    # IDs deleted between list and fetch are skipped.
+    ids = [vector_id for vector_id in ids if vector_id in vectors]
+    # Converted here, in the worker, so it overlaps the sequential ID listing.
+    values = np.asarray([vectors[vector_id].values for vector_id in ids], dtype=dtype)
+    return ids, values, [vectors[vector_id].metadata or {} for vector_id in ids]
+
+
+class _ChunkWriter:
+    def __init__(self, snapshot_dir, dtype, chunk_rows):
+        self.snapshot_dir = snapshot_dir
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self.dimension = None
+        self.chunks = []
+        self.count = 0
+        self._rows = None
+        self._records = []
+
+    def add(self, ids, values, metadatas):
+        """Append a fetched batch: IDs, a (rows, dimension) array and the metadata dicts."""
+        if not ids:
+            return
+        if self.dimension is None:
+            self.dimension = values.shape[1]
+            self._rows = np.empty((self.chunk_rows, self.dimension), dtype=self.dtype)
+        elif values.shape[1] != self.dimension:
+            raise ValueError(f"Vector '{ids[0]}' has dimension {values.shape[1]}, expected {self.dimension}.")
+        taken = 0
+        while taken < len(ids):
+            filled = len(self._records)
+            rows = min(len(ids) - taken, self.chunk_rows - filled)
+            self._rows[filled:filled + rows] = values[taken:taken + rows]
+            self._records.extend(json.dumps({"id": vector_id, "metadata": metadata}, separators=(",", ":"))
+                                 for vector_id, metadata in zip(ids[taken:taken + rows], metadatas[taken:taken + rows]))
+            taken += rows
+            if len(self._records) == self.chunk_rows:
+                self.flush()
+        self.count += len(ids)
+
+    def flush(self):
+        if not self._records:
+            return
+        number = len(self.chunks)
+        vectors_name, metadata_name = f"vectors-{number:05d}.npy", f"metadata-{number:05d}.jsonl"
+        np.save(os.path.join(self.snapshot_dir, vectors_name), self._rows[:len(self._records)])
+        with open(os.path.join(self.snapshot_dir, metadata_name), 'w', encoding='utf-8') as f:
+            f.write("\n".join(self._records) + "\n")
+        self.chunks.append({"vectors": vectors_name, "metadata": metadata_name, "rows": len(self._records)})
+        self._records = []
+
+
+def export_snapshot(index, snapshot_dir, namespace="", dtype="float32", chunk_rows=SNAPSHOT_CHUNK_ROWS,
+                    threads=SNAPSHOT_THREADS, source=None):
+    """
+    Dump every vector of a namespace, with its ID and metadata, to a snapshot directory
+
+    Args:
+        index: Pinecone Index (or anything with list/fetch/describe_index_stats)
+        snapshot_dir: Target directory; replaced if it exists
+        namespace: Namespace to export
+        dtype: "float32" (exact) or "float16" (half the size; ~1e-3 relative error per component)
+        chunk_rows: Vectors per file pair
+        threads: Concurrent fetch requests
+        source: Index name recorded in the manifest
+
+    Returns:
+        Dict with "vectors", "seconds", "vectors_per_second" and "bytes"
+    """
+    start = time.perf_counter()
+    tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    writer = _ChunkWriter(tmp_dir, dtype, chunk_rows)
+    # Fetches run ahead in a bounded window; results are written in list order.
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='snapshot-fetch') as pool:
+        window = deque()
+        for ids in _iter_id_pages(index, namespace):
+            window.append(pool.submit(_fetch, index, ids, namespace, writer.dtype))
+            if len(window) >= threads * 2:
+                writer.add(*window.popleft().result())
+        while window:
+            writer.add(*window.popleft().result())
+    writer.flush()
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT, "dimension": writer.dimension, "dtype": writer.dtype.name, "count": writer.count,
+        "chunks": writer.chunks, "source_index": source, "namespace": namespace, "created": time.time()
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    size = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))
+    if os.path.exists(snapshot_dir):
+        shutil.rmtree(snapshot_dir)
+    os.rename(tmp_dir, snapshot_dir)
+
+    seconds = time.perf_counter() - start
+    rate = writer.count / seconds if seconds else 0.0
+    logger.info(f"Exported {writer.count} vectors ({writer.dtype.name}, {size / 2 ** 20:.1f} MiB) to '{snapshot_dir}' "
+                f"in {seconds:.1f}s: {rate:.0f} vectors/sec.")
+    return {"vectors": writer.count, "seconds": seconds, "vectors_per_second": rate, "bytes": size}
+
+
+def load_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format')} in '{snapshot_dir}'.")
+    return manifest
+
+
+def iter_snapshot_batches(snapshot_dir, batch_size=SNAPSHOT_BATCH_SIZE):
+    """
+    Yield batches of (records, vectors): the {"id", "metadata"} dicts and a slice of the
+    memory-mapped vectors file, rows aligned
+
+    Args:
+        snapshot_dir: Snapshot written by export_snapshot
+        batch_size: Vectors per batch
+    """
+    manifest = load_manifest(snapshot_dir)
+    for chunk in manifest["chunks"]:
+        vectors = np.load(os.path.join(snapshot_dir, chunk["vectors"]), mmap_mode='r')
+        with open(os.path.join(snapshot_dir, chunk["metadata"]), 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        if len(records) != len(vectors):
+            raise ValueError(f"Snapshot chunk '{chunk['vectors']}' has {len(vectors)} vectors but {len(records)} metadata lines.")
+        for start in range(0, len(records), batch_size):
+            yield records[start:start + batch_size], vectors[start:start + batch_size]
+
+
+def _upsert_with_retry(index, records, vectors, namespace):
+    # Pinecone takes lists of floats; converting in the worker keeps queued batches as arrays.
+    batch = [{"id": record["id"], "values": values, "metadata": record["metadata"]}
+             for record, values in zip(records, vectors.astype(np.float32).tolist())]
+    for attempt in range(1, SNAPSHOT_UPSERT_ATTEMPTS + 1):
+        try:
+            index.upsert(vectors=batch, namespace=namespace)
+            return len(batch)
+        except Exception as e:
+            if attempt == SNAPSHOT_UPSERT_ATTEMPTS:
+                raise
+            logger.warning(f"Upsert of {len(batch)} vectors failed (attempt {attempt}/{SNAPSHOT_UPSERT_ATTEMPTS}): {e}")
+            time.sleep(0.5 * 2 ** (attempt - 1))
+
+
+def import_snapshot(index, snapshot_dir, namespace=None, batch_size=SNAPSHOT_BATCH_SIZE, threads=SNAPSHOT_THREADS):
+    """
+    Bulk-load a snapshot into an index with parallel batched upserts
+
+    Args:
+        index: Pinecone Index to load into
+        snapshot_dir: Snapshot written by export_snapshot
+        namespace: Target namespace (default: the one the snapshot was exported from)
+        batch_size: Vectors per upsert request
+        threads: Concurrent upsert requests
+
+    Returns:
+        Dict with "vectors", "seconds" and "vectors_per_second"
+    """
+    manifest = load_manifest(snapshot_dir)
+    namespace = manifest.get("namespace", "") if namespace is None else namespace
+    dimension = index.describe_index_stats().get("dimension")
+    if dimension and manifest["dimension"] and dimension != manifest["dimension"]:
+        raise ValueError(f"Snapshot dimension {manifest['dimension']} does not match the index dimension {dimension}.")
+
+    start = time.perf_counter()
+    upserted = 0
+    in_flight = threading.BoundedSemaphore(threads * 2) # bounds the batches held in memory
+    futures = []
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='snapshot-upsert') as pool:
+        for records, vectors in iter_snapshot_batches(snapshot_dir, batch_size):
+            in_flight.acquire()
+            future = pool.submit(_upsert_with_retry, index, records, vectors, namespace)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+        for future in futures:
+            upserted += future.result()
+
+    seconds = time.perf_counter() - start
+    rate = upserted / seconds if seconds else 0.0
+    logger.info(f"Imported {upserted} vectors from '{snapshot_dir}' into namespace '{namespace}' "
+                f"in {seconds:.1f}s: {rate:.0f} vectors/sec.")
+    return {"vectors": upserted, "seconds": seconds, "vectors_per_second": rate}
+
+
+def import_snapshot_as_generation(index, snapshot_dir, threads=SNAPSHOT_THREADS):
+    """
+    Import a snapshot into a new index generation, rebuild its lexical index from the chunks'
+    text and make it the active one: the serving processes switch to it, the previous generation
+    is garbage-collected after the grace period. A generation not fully imported is deleted.
+
+    Args:
+        index: The Pinecone Index the serving processes use
+        snapshot_dir: Snapshot written by export_snapshot
+        threads: Concurrent upsert requests
+
+    Returns:
+        (import_snapshot's result dict, the Generation activated)
+    """
+    import index_generations
+    from langchain_core.documents import Document
+    from lexical_index import build_lexical_index
+
+    manifest = load_manifest(snapshot_dir)
+    with index_generations.generation_build(): # uploads would land in the generation being replaced
+        generation = index_generations.new_generation()
+        try:
+            result = import_snapshot(index, snapshot_dir, namespace=generation.namespace, threads=threads)
+            # Serverless indexes report new vectors with a short delay.
+            deadline = time.monotonic() + index_generations.GENERATION_VALIDATION_TIMEOUT_SECONDS
+            while True:
+                namespaces = index.describe_index_stats().get("namespaces") or {}
+                count = int((namespaces.get(generation.namespace) or {}).get("vector_count", 0))
+                if count >= manifest["count"] or time.monotonic() > deadline:
+                    break
+                time.sleep(1.0)
+            if count != manifest["count"]:
+                raise index_generations.GenerationValidationError(
+                    f"Generation '{generation.name}' holds {count} vectors, the snapshot {manifest['count']}.")
+            records = [record for records, _ in iter_snapshot_batches(snapshot_dir) for record in records]
+            documents = [Document(page_content=record["metadata"].get("text", ""),
+                                  metadata={key: value for key, value in record["metadata"].items() if key != "text"})
+                         for record in records]
+            build_lexical_index(documents, generation.lexical_dir, ids=[record["id"] for record in records])
+            generation.vectors = result["vectors"]
+            index_generations.activate(generation)
+        except Exception:
+            index_generations.delete_generation(index, generation)
+            raise
+    index_generations.collect_garbage(index)
+    return result, generation
+
+
+def _connect(index_name):
+    from pinecone import Pinecone
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    index = pc.Index(index_name)
+    logger.info(f"Connected to Pinecone index '{index_name}'.")
+    return index
+
+
+def main():
+    if not logging.getLogger().hasHandlers():
+        configure_logging(LOG_FILE_SCRIPT_VS, default_level="INFO", max_bytes=2*1024*1024, backup_count=3)
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Export or import a local snapshot of the Pinecone vectors')
+    parser.add_argument('--index', type=str, default=os.getenv("PINECONE_INDEX_NAME", "pet-health-rag"),
+                        help='Pinecone index name (default: PINECONE_INDEX_NAME)')
+    parser.add_argument('--namespace', type=str, default=None,
+                        help='Namespace (export default: the active index generation; import default: a new generation '
+                             'activated once complete, or the exported namespace for an index other than PINECONE_INDEX_NAME)')
+    parser.add_argument('--threads', type=int, default=SNAPSHOT_THREADS, help='Concurrent Pinecone requests')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='Dump all vectors, IDs and metadata to a snapshot directory')
+    export_parser.add_argument('--output', '-o', type=str, required=True)
+    export_parser.add_argument('--dtype', choices=('float32', 'float16'), default='float32')
+    import_parser = commands.add_parser('import', help='Upsert a snapshot into the index')
+    import_parser.add_argument('--input', '-i', type=str, required=True)
+    args = parser.parse_args()
+
+    index = _connect(args.index)
+    if args.command == 'export':
+        if args.namespace is None:
+            import index_generations
+            args.namespace = index_generations.load_state()[0].namespace
+        export_snapshot(index, args.output, namespace=args.namespace, dtype=args.dtype, threads=args.threads, source=args.index)
+    elif args.namespace is None and args.index == os.getenv("PINECONE_INDEX_NAME", "pet-health-rag"):
+        _, generation = import_snapshot_as_generation(index, args.input, threads=args.threads)
+        logger.info(f"Snapshot '{args.input}' is now served as index generation '{generation.name}'.")
+    else:
+        import index_generations
+        namespace = load_manifest(args.input).get("namespace", "") if args.namespace is None else args.namespace
+        served = index_generations.load_state()[0]
+        if args.index == os.getenv("PINECONE_INDEX_NAME", "pet-health-rag") and namespace != served.namespace:
+            logger.warning(f"Importing into namespace '{namespace}', which is not served: the active index generation "
+                           f"'{served.name}' uses namespace '{served.namespace}'. Omit --namespace to import and activate a new generation.")
+        import_snapshot(index, args.input, namespace=namespace, threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
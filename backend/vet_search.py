@@ -0,0 +1,133 @@
+#logging
+import logging
+
+import math
+import os
+
+from singleflight import SingleFlight, normalize_text
+
+# Get a logger for this module
+logger = logging.getLogger(__name__) # Logger name will be 'vet_search'
+
+# Shared by the Flask (app.py) and ASGI (asgi_app.py) endpoints so both keep the same contract.
+
+NEARBY_SEARCH_RADIUS_KM = 50  # Search within a 50km radius (approx. 30 miles)
+NEARBY_SEARCH_TEXT = 'veterinary animal pet clinic hospital vet'
+
+# Nearby searches run from the centre of a small lat/lon tile (0.01 deg is about 1.1 km, negligible
+# next to the 50km search box), so every point in a tile gets the same clinics and concurrent
+# searches for one area, or for one text query, share a single Amazon Location call.
+# VET_SEARCH_TILE_DEGREES=0 searches from the exact point and only coalesces identical points.
+VET_SEARCH_TILE_DEGREES = float(os.getenv("VET_SEARCH_TILE_DEGREES", "0.01"))
+VET_SEARCH_FLIGHT = SingleFlight("vet_search")
+
+
+def snap_to_tile(latitude, longitude, tile_degrees=VET_SEARCH_TILE_DEGREES):
+    """
+    Centre of the tile containing a point
+
+    Returns:
+        (latitude, longitude) to search from
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    if tile_degrees <= 0:
+        return latitude, longitude
+    return (round((math.floor(latitude / tile_degrees) + 0.5) * tile_degrees, 6),
+            round((math.floor(longitude / tile_degrees) + 0.5) * tile_degrees, 6))
+
+
+def nearby_search_key(latitude, longitude):
+    """Coalescing key of a nearby search from an already snapped point."""
+    return ("nearby", latitude, longitude)
+
+
+def text_search_key(query):
+    """Coalescing key of a free-text search."""
+    return ("text", normalize_text(query))
+
+
+def nearby_search_params(index_name, latitude, longitude, radius_km=NEARBY_SEARCH_RADIUS_KM):
+    """
+    Build Amazon Location search parameters for vets around a point
+
+    Args:
+        index_name: Amazon Location place index name
+        latitude: Search centre latitude
+        longitude: Search centre longitude
+        radius_km: Half-width of the bounding box
+
+    Returns:
+        Keyword arguments for search_place_index_for_text
+    """
+    # --- FIX: Calculate a bounding box to filter results ---
+    lat_delta = radius_km / 111.0
+    lon_delta = radius_km / (111.0 * math.cos(math.radians(latitude)))
+
+    min_lon = longitude - lon_delta
+    min_lat = latitude - lat_delta
+    max_lon = longitude + lon_delta
+    max_lat = latitude + lat_delta
+    # ---------------------------------------------------------
+
+    return {
+        'IndexName': index_name, 
+        # 'BiasPosition': [float(longitude), float(latitude)],
+        # FIX: Add the FilterBBox parameter to restrict the search area
+        'FilterBBox': [min_lon, min_lat, max_lon, max_lat], 
+        'MaxResults': 20,
+        'Text': NEARBY_SEARCH_TEXT,
+    }
+
+
+def text_search_params(index_name, query):
+    """
+    Build Amazon Location search parameters for a free-text location query
+
+    Args:
+        index_name: Amazon Location place index name
+        query: User's location text, e.g. a city or ZIP code
+
+    Returns:
+        Keyword arguments for search_place_index_for_text
+    """
+    # Prepend search terms to the user's location query for better results
+    return {
+        'IndexName': index_name,
+        'Text': f"veterinarian or vet in {query}",
+        'FilterCountries': ['USA'], # Optional: Filter results to a specific country
+        'MaxResults': 10,
+        'Language': 'en'
+    }
+
+
+def parse_vet_results(response):
+    """
+    Convert an Amazon Location search response into the vet list returned to the frontend
+
+    Args:
+        response: search_place_index_for_text response
+
+    Returns:
+        List of vet dicts (id, name, address, longitude, latitude, phone)
+    """
+    vets = []
+    for place_result in response.get('Results', []):
+        place = place_result.get('Place', {})
+
+        # Safer way to parse the address label
+        label_parts = place.get('Label', '').split(', ', 1)
+        vet_name = label_parts[0]
+        vet_address = label_parts[1] if len(label_parts) > 1 else ''
+
+        vet_info = {
+            "id": place.get('PlaceId'), 
+            "name": vet_name,
+            "address": vet_address,
+            "longitude": place.get('Geometry', {}).get('Point', [None, None])[0],
+            "latitude": place.get('Geometry', {}).get('Point', [None, None])[1],
+            "phone": place.get('PhoneNumber')
+        }
+        
+        if vet_info["name"]:
+            vets.append(vet_info)
+    return vets
@@ -0,0 +1,11 @@
+# Production WSGI entry point.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# With preload_app=True (see gunicorn.conf.py) this module is imported once in the master, so
+# RAGService, the prompt templates and local caches are built before fork and shared
+# copy-on-write by every worker. Network clients are re-created per worker in `post_fork`.
+
+from app import app, reinitialize_clients_after_fork
+
+__all__ = ["app", "reinitialize_clients_after_fork"]
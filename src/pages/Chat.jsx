@@ -17,6 +17,8 @@ function Chat() {
     const [selectedImageFile, setSelectedImageFile] = useState(null);
     const [imagePreview, setImagePreview] = useState(null);
     const fileInputRef = useRef(null); // Ref for hidden file input
+    // Server-side conversation: after the first reply only the new message is sent with this ID
+    const conversationIdRef = useRef("");
 
     const messagesEndRef = useRef(null);
     const navigate = useNavigate(); // Removed as per previous discussions for security redirect
@@ -76,19 +78,24 @@ function Chat() {
             imagePreview: selectedImageFile ? imagePreview : null // Store preview for UI
         };
 
-        // For backend, we need the chat history for context (text only for history)
-        const historyForBackend = messages.map(msg => ({
-            sender: msg.sender,
-            text: msg.text // Only send text content of past messages
-        }));
-
-        // Use FormData for sending files and text together
-        const formData = new FormData();
-        formData.append('message', trimmedInput); // Send actual typed message
-        formData.append('chat_history', JSON.stringify(historyForBackend));
-        if (selectedImageFile) {
-            formData.append('image', selectedImageFile, selectedImageFile.name); // Append the image file
-        }
+        // Use FormData for sending files and text together (built per attempt, see the reset below)
+        const buildFormData = () => {
+            const formData = new FormData();
+            formData.append('message', trimmedInput); // Send actual typed message
+            formData.append('conversation_id', conversationIdRef.current);
+            if (!conversationIdRef.current) {
+                // New conversation: the backend seeds its stored history with ours (text only), then keeps it
+                const historyForBackend = messages.map(msg => ({
+                    sender: msg.sender,
+                    text: msg.text // Only send text content of past messages
+                }));
+                formData.append('chat_history', JSON.stringify(historyForBackend));
+            }
+            if (selectedImageFile) {
+                formData.append('image', selectedImageFile, selectedImageFile.name); // Append the image file
+            }
+            return formData;
+        };
 
         // Update UI immediately
         setMessages(prevMessages => [...prevMessages, userMessageForUI]);
@@ -100,16 +107,27 @@ function Chat() {
             const { tokens } = await fetchAuthSession();
             const idToken = tokens.idToken.toString();
 
-            const response = await fetch(API_URL, {
+            const postChat = () => fetch(API_URL, {
                 method: 'POST',
                 // IMPORTANT: Do NOT set 'Content-Type': 'multipart/form-data' explicitly for FormData.
                 // The browser sets it automatically with the correct boundary.
                 headers: {
                     'Authorization': `Bearer ${idToken}`
                 },
-                body: formData, // Send FormData object
+                body: buildFormData(), // Send FormData object
             });
 
+            let response = await postChat();
+            if (response.status === 409 && conversationIdRef.current) {
+                // The backend no longer knows our conversation (expired, or the server restarted):
+                // start it over, seeded with the history we still have
+                const resetData = await response.clone().json().catch(() => ({}));
+                if (resetData.conversation_reset) {
+                    conversationIdRef.current = "";
+                    response = await postChat();
+                }
+            }
+
             if (!response.ok) {
                 let errorData = { error: `HTTP error! status: ${response.status}` };
                 try {
@@ -124,6 +142,7 @@ function Chat() {
             }
 
             const data = await response.json();
+            if (data.conversation_id) conversationIdRef.current = data.conversation_id;
 
             // This block correctly handles the new, cleaner backend response
             const aiMessageForDisplay = {
@@ -206,6 +225,7 @@ function Chat() {
     };
 
     const clearChat = () => {
+        conversationIdRef.current = "";
         setMessages([
             { id: Date.now(), text: "Hello! I'm PetHealth AI. How can I help you and your pet today? You can describe symptoms or upload an image for skin analysis.", sender: "ai", type: "text" }
         ]);